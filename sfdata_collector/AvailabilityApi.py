@@ -0,0 +1,163 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import urlparse
+import threading
+import BaseHTTPServer
+import SocketServer
+
+CONTENT_TYPE = 'application/json; charset=utf-8'
+
+
+class AvailabilityApi(object):
+    """
+    A small read-only HTTP/JSON API over the latest state the collector
+    holds in memory for each source, so that dashboards can poll it
+    rather than the database.  Answers:
+
+      GET /NAME/locations            every location of source NAME
+      GET /NAME/locations?type=ON    filtered, as the source allows
+      GET /NAME/locations/ID         a single location
+      GET /NAME/nearest?lat=LAT&lon=LON&k=5
+                                     the locations nearest a point
+      GET /NAME/within?lat=LAT&lon=LON&radius=METERS
+                                     the locations within a radius
+
+    Each response has an ETag, and a request whose If-None-Match holds
+    it gets a 304 with no body, until the data changes.
+
+    The cache of each source must have getList(filters), getItem(key),
+    getNearest(query) and getWithin(query), returning an (etag, body) 
+    tuple, or None if there is no such thing, as LatestAvailabilityCache
+    does.  The last two return None if the cache has no spatial index.
+    """
+
+    def __init__(self, caches):
+        """
+        Constructor.  *caches* is a dictionary of source name -> cache.
+        """
+        self.caches = caches
+        self.server = None
+
+    def get(self, path, query, etags=()):
+        """
+        Answers a request for *path*, with the parsed *query* string,
+        from a client holding the ETags *etags*.  Returns (status, etag,
+        body), with a body of None for a 304 or an error.
+        """
+        parts = [part for part in path.split('/') if part]
+        if len(parts) < 2 or parts[0] not in self.caches:
+            return 404, None, None
+        cache = self.caches[parts[0]]
+
+        try:
+            if parts[1:] == ['locations']:
+                found = cache.getList(query)
+            elif len(parts) == 3 and parts[1] == 'locations':
+                found = cache.getItem(parts[2])
+            elif parts[1:] == ['nearest']:
+                found = cache.getNearest(query)
+            elif parts[1:] == ['within']:
+                found = cache.getWithin(query)
+            else:
+                return 404, None, None
+        except (ValueError, OverflowError):
+            return 400, None, None
+        if found is None:
+            return 404, None, None
+
+        etag, body = found
+        if etag in etags or '*' in etags:
+            return 304, etag, None
+        return 200, etag, body
+
+    def startServer(self, port, host=''):
+        """
+        Serves the API at http://host:port/ from a thread of its own.
+        """
+        self.server = ApiServer((host, port), self)
+        thread = threading.Thread(target=self.server.serve_forever, name='api')
+        thread.daemon = True
+        thread.start()
+
+    def stopServer(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+class ApiRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Answers GET requests from the AvailabilityApi.
+    """
+
+    def do_GET(self):
+        url = urlparse.urlsplit(self.path)
+        query = dict(urlparse.parse_qsl(url.query))
+        status, etag, body = self.server.api.get(url.path, query,
+            parseEtags(self.headers.get('If-None-Match')))
+
+        if status in (400, 404):
+            self.send_error(status)
+            return
+
+        self.send_response(status)
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        if body is None:
+            self.end_headers()
+            return
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ApiServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    A small HTTP server for the AvailabilityApi.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, api):
+        BaseHTTPServer.HTTPServer.__init__(self, address, ApiRequestHandler)
+        self.api = api
+
+
+def parseEtags(header):
+    """
+    Returns the list of ETags in an If-None-Match *header*, or an empty
+    list if there is none.  Weak ETags match too, as they should for a
+    GET.
+    """
+    if not header:
+        return []
+    etags = []
+    for etag in header.split(','):
+        etag = etag.strip()
+        if etag.startswith('W/'):
+            etag = etag[2:]
+        etags.append(etag)
+    return etags
@@ -0,0 +1,71 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import random
+
+# doublings of the wait after which it stops growing, long after it has
+# reached any cap, so that the wait after a very long run of failures
+# doesn't overflow a float
+MAX_DOUBLINGS = 32
+
+
+class Backoff(object):
+    """
+    Exponential backoff with full jitter.  The wait after the nth failure
+    in a row is chosen at random between zero and *base* * 2**n seconds,
+    up to *cap*, so that many clients retrying against the same server or
+    database spread themselves out rather than retrying in step.
+    """
+
+    def __init__(self, base=1.0, cap=60.0):
+        """
+        Constructor.
+
+        *base* is the longest wait, in seconds, after the first failure.
+
+        *cap* is the longest wait after any number of failures.
+        """
+        self.base = base
+        self.cap = cap
+
+        # failures in a row, for failed() and succeeded()
+        self.failures = 0
+
+    def delay(self, attempt):
+        """
+        Returns the seconds to wait before retry number *attempt*,
+        counting from zero.
+        """
+        return random.uniform(0, min(self.cap, 
+                                     self.base * 2 ** min(attempt, MAX_DOUBLINGS)))
+
+    def failed(self):
+        """
+        Records a failure, and returns the seconds to wait before trying
+        again.
+        """
+        wait = self.delay(self.failures)
+        self.failures += 1
+        return wait
+
+    def succeeded(self):
+        """
+        Records a success, so the next failure waits the least.
+        """
+        self.failures = 0
@@ -0,0 +1,114 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import threading
+
+# bump this if the layout of the file changes, so old files are ignored
+CHECKPOINT_VERSION = 2
+
+
+class CollectorCheckpoint(object):
+    """
+    A small local file holding the runtime state of each source, as
+    returned by its getState() method, so the collector can restart
+    without reading that state back from the database.
+
+    The file is json, and is replaced as a whole each time it is saved,
+    by writing a new file and renaming it over the old one, so a crash
+    leaves either the old checkpoint or the new one, never half of each.
+    It is saved after each successful write, so it describes what has
+    been committed.  A source should still check that the state agrees
+    with the database before trusting it, in case the checkpoint is from
+    a different database or the collector stopped between the commit
+    and the save.
+    """
+
+    def __init__(self, path):
+        """
+        Constructor.
+
+        *path* is the checkpoint file.  It doesn't need to exist yet.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+
+        # source name -> last state saved
+        self.states = {}
+        self.load()
+
+    def load(self):
+        """
+        Reads the checkpoint file, if there is one.  A file that can't be
+        read is reported and ignored, so the sources fall back to the
+        database.
+        """
+        if not os.path.exists(self.path):
+            return
+
+        try:
+            f = open(self.path, 'r')
+            try:
+                checkpoint = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError), e:
+            print "Ignoring checkpoint %s: %s" % (self.path, e)
+            return
+
+        if checkpoint.get('version') != CHECKPOINT_VERSION:
+            print "Ignoring checkpoint %s from a different version" % self.path
+            return
+        self.states = checkpoint['sources']
+
+    def getState(self, name):
+        """
+        Returns the last state saved for the source called *name*, or None.
+        """
+        return self.states.get(name)
+
+    def save(self, source):
+        """
+        Records the current state of *source*, and writes the file.
+        Called after each successful write, from the writer threads.
+        """
+        state = source.getState()
+        if state is None:
+            return
+
+        with self.lock:
+            self.states[source.name] = state
+
+            tempPath = self.path + '.tmp'
+            f = open(tempPath, 'w')
+            try:
+                json.dump({'version' : CHECKPOINT_VERSION,
+                           'sources' : self.states}, f, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                f.close()
+
+            # Windows won't rename over an existing file
+            try:
+                os.rename(tempPath, self.path)
+            except OSError:
+                os.remove(self.path)
+                os.rename(tempPath, self.path)
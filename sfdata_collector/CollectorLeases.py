@@ -0,0 +1,280 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import math
+import time
+import socket
+from sets import Set
+
+from sqlalchemy import Column, select, and_, or_, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.types import Float, String, DateTime
+
+from SFparkDataModels import Base
+
+# seconds a lease lasts without being renewed.  Leases are renewed every
+# third of this, so a standby takes over at most a third of it after
+# the owner stops
+LEASE_SECONDS = 90
+
+# the names of the rows that record which nodes are alive start with this
+NODE_PREFIX = 'node:'
+
+
+class CollectorLeaseRecord(Base):
+    """
+    A lease on the work of one source, or on nothing but the liveness of
+    one node, held by the collector called *owner* until the unix time
+    *expires*.  Only the owner of a source's lease polls and writes it.
+
+    *high_water* is the upstream time of the newest data written under
+    the lease, set in the same transaction as the data, so whichever node
+    holds the lease next knows what is already in the database.
+
+    CREATE TABLE collector_lease (
+	name VARCHAR(64) NOT NULL PRIMARY KEY,     # source name, or 'node:' plus node id
+	owner VARCHAR(255),                        # node id of the holder, or NULL if free
+	expires FLOAT,                             # unix time the lease runs out
+	high_water TIMESTAMP                       # upstream time of the newest data written
+    );
+    """
+
+    __tablename__ = 'collector_lease'
+
+    name = Column(String(64), primary_key=True)
+    owner = Column(String(255))
+    expires = Column(Float)
+    high_water = Column(DateTime)
+
+
+class LeaseLost(Exception):
+    """
+    Raised when a write is attempted for a source whose lease this node
+    no longer holds.
+    """
+    pass
+
+
+class LeaseCoordinator(object):
+    """
+    Shares the work of a set of sources between any number of collectors
+    writing to the same database, so each source is polled and written by
+    exactly one of them, through leases in the collector_lease table.
+    Works on any database, including SQLite, using only single-row
+    conditional UPDATEs.
+
+    Each node renews its leases with refresh(), every third of the lease
+    time.  A node that stops renewing loses its leases when they expire,
+    and the others take them over.  Each node takes at most its fair
+    share of the sources, the number of sources over the number of live
+    nodes, rounded up, and gives up any beyond that, so the work spreads
+    out as nodes and sources are added.
+
+    Every write goes through hold(), in the write's own transaction.  It
+    renews the lease, and fails if another node has taken it.  On
+    PostgreSQL this locks the lease row until the commit, so a lease can't
+    change hands in the middle of a write.  hold() also skips any data no
+    newer than the high water mark of the lease, and raises the mark, so
+    the same upstream data is never written twice, even when the old and
+    new owners both fetched it around a takeover.
+
+    The times are from each node's own clock, so the nodes' clocks should
+    agree to within a few seconds.
+    """
+
+    def __init__(self, names, nodeId=None, leaseSeconds=LEASE_SECONDS):
+        """
+        Constructor.
+
+        *names* are the names of the sources to share.
+
+        *nodeId* identifies this collector, and defaults to the host name
+        and process id.
+        """
+        self.names = sorted(names)
+        self.nodeId = nodeId or '%s:%i' % (socket.gethostname(), os.getpid())
+        self.leaseSeconds = leaseSeconds
+
+        # the sources this node holds, as of the last refresh, and the
+        # number of nodes alive
+        self.owned = Set()
+        self.liveNodes = 0
+
+        self.stats = {'gained'     : 0,
+                      'lost'       : 0,
+                      'duplicates' : 0}
+
+    def owns(self, name):
+        return name in self.owned
+
+    def refresh(self, session):
+        """
+        Renews this node's leases, and takes or gives up leases to hold
+        its fair share.  Commits.  Returns the lists of the names of the
+        sources (gained, lost).
+        """
+        table = CollectorLeaseRecord.__table__
+        nodeName = NODE_PREFIX + self.nodeId
+        self.createRows(session, self.names + [nodeName])
+
+        now = time.time()
+        expires = now + self.leaseSeconds
+
+        # announce this node, and forget those long gone
+        self.take(session, nodeName, now, expires)
+        session.execute(table.delete()
+                        .where(table.c.name.like(NODE_PREFIX + '%'))
+                        .where(table.c.expires < now - self.leaseSeconds))
+        self.liveNodes = session.execute(
+            select([func.count()]).select_from(table)
+                .where(table.c.name.like(NODE_PREFIX + '%'))
+                .where(table.c.expires >= now)).scalar()
+        share = int(math.ceil(len(self.names) / float(max(self.liveNodes, 1))))
+
+        owned = [name for name in self.names if name in self.owned and
+                 self.renew(session, name, expires)]
+        for name in owned[share:]:
+            self.release(session, name)
+        owned = owned[:share]
+        for name in self.names:
+            if len(owned) >= share:
+                break
+            if name not in owned and self.take(session, name, now, expires):
+                owned.append(name)
+        session.commit()
+
+        gained = [name for name in owned if name not in self.owned]
+        lost = [name for name in self.owned if name not in owned]
+        self.owned = Set(owned)
+        self.stats['gained'] += len(gained)
+        self.stats['lost'] += len(lost)
+        return gained, lost
+
+    def hold(self, session, source, items):
+        """
+        Renews the lease on *source* within the current transaction of
+        *session*, before writing *items*, a list of its data, so the
+        lease can't be taken until the write commits.  Raises LeaseLost
+        if another node holds it.
+
+        Returns the items newer than the high water mark, in order, and
+        raises the mark to the newest of them, to commit with the data.
+        Items without a getDataTime() are always written.
+        """
+        table = CollectorLeaseRecord.__table__
+        if not self.renew(session, source.name, time.time() + self.leaseSeconds):
+            if source.name in self.owned:
+                self.owned.discard(source.name)
+                self.stats['lost'] += 1
+            raise LeaseLost("%s is held by another node" % source.name)
+
+        highWater = session.execute(select([table.c.high_water])
+                                    .where(table.c.name == source.name)).scalar()
+        newItems = []
+        for data in items:
+            dataTime = source.getDataTime(data)
+            if dataTime is not None:
+                if highWater is not None and dataTime <= highWater:
+                    self.stats['duplicates'] += 1
+                    continue
+                highWater = dataTime
+            newItems.append(data)
+
+        if len(newItems) > 0:
+            session.execute(table.update()
+                            .where(table.c.name == source.name)
+                            .values(high_water=highWater))
+        return newItems
+
+    def releaseAll(self, session):
+        """
+        Gives up all this node's leases, so others can take them over
+        straight away, rather than after they expire.  Commits.
+        """
+        for name in self.names + [NODE_PREFIX + self.nodeId]:
+            self.release(session, name)
+        session.commit()
+        self.owned = Set()
+
+    def getLeases(self, session):
+        """
+        Returns a list of (name, owner, seconds left, high water) for
+        every lease, including those of the nodes.
+        """
+        table = CollectorLeaseRecord.__table__
+        now = time.time()
+        return [(name, owner, None if expires is None else expires - now, highWater)
+                for name, owner, expires, highWater in session.execute(
+                    select([table.c.name, table.c.owner, table.c.expires,
+                            table.c.high_water]).order_by(table.c.name))]
+
+    def createRows(self, session, names):
+        """
+        Adds a free lease for each of *names* that doesn't have a row,
+        each in a transaction of its own, since another node may add the
+        same one at the same time.
+        """
+        table = CollectorLeaseRecord.__table__
+        existing = Set([name for (name,) in session.execute(
+            select([table.c.name]).where(table.c.name.in_(names)))])
+        session.commit()
+        for name in names:
+            if name in existing:
+                continue
+            try:
+                session.execute(table.insert().values(name=name, owner=None,
+                                                      expires=0.0))
+                session.commit()
+            except IntegrityError:
+                session.rollback()
+
+    def take(self, session, name, now, expires):
+        """
+        Takes the lease on *name* if it is free, expired or already this
+        node's.  Returns True if this node holds it.
+        """
+        table = CollectorLeaseRecord.__table__
+        result = session.execute(table.update()
+            .where(table.c.name == name)
+            .where(or_(table.c.owner == self.nodeId, table.c.owner == None,
+                       table.c.expires < now))
+            .values(owner=self.nodeId, expires=expires))
+        return result.rowcount == 1
+
+    def renew(self, session, name, expires):
+        """
+        Extends the lease on *name* if this node still holds it, even if
+        it has expired, as long as nobody else has taken it.  Returns True
+        if this node holds it.
+        """
+        table = CollectorLeaseRecord.__table__
+        result = session.execute(table.update()
+            .where(and_(table.c.name == name, table.c.owner == self.nodeId))
+            .values(expires=expires))
+        return result.rowcount == 1
+
+    def release(self, session, name):
+        """
+        Frees the lease on *name*, if this node holds it.
+        """
+        table = CollectorLeaseRecord.__table__
+        session.execute(table.update()
+            .where(and_(table.c.name == name, table.c.owner == self.nodeId))
+            .values(owner=None, expires=0.0))
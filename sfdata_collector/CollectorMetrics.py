@@ -0,0 +1,381 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import time
+import bisect
+import threading
+import BaseHTTPServer
+import SocketServer
+
+# upper bounds of the histogram buckets for each kind of measurement.
+# Prometheus adds +Inf
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+LAG_BUCKETS = (5.0, 15.0, 30.0, 60.0, 90.0, 120.0, 180.0, 300.0, 600.0, 1800.0)
+
+# the content type of the Prometheus text format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Metric(object):
+    """
+    A named metric with a set of labels, keeping one value, or set of
+    values, per combination of label values.  Updated from any thread.
+    """
+
+    type = None
+
+    def __init__(self, name, help, labelNames=()):
+        self.name = name
+        self.help = help
+        self.labelNames = tuple(labelNames)
+        self.lock = threading.Lock()
+
+        # tuple of label values -> value
+        self.values = {}
+
+    def formatLabels(self, labelValues, extra=()):
+        """
+        Returns the {name="value",...} part of a sample line.
+        """
+        pairs = zip(self.labelNames, labelValues) + list(extra)
+        if len(pairs) == 0:
+            return ''
+        return '{%s}' % ','.join(['%s="%s"' % (name, escapeLabel(value))
+                                  for name, value in pairs])
+
+    def format(self):
+        """
+        Returns the lines of the Prometheus text format for this metric.
+        """
+        lines = ['# HELP %s %s' % (self.name, self.help),
+                 '# TYPE %s %s' % (self.name, self.type)]
+        with self.lock:
+            for labelValues in sorted(self.values):
+                lines.extend(self.formatSamples(labelValues, self.values[labelValues]))
+        return lines
+
+    def formatSamples(self, labelValues, value):
+        return ['%s%s %s' % (self.name, self.formatLabels(labelValues),
+                             formatValue(value))]
+
+
+class Counter(Metric):
+    """
+    A count that only goes up.
+    """
+
+    type = 'counter'
+
+    def inc(self, labelValues=(), amount=1):
+        with self.lock:
+            self.values[labelValues] = self.values.get(labelValues, 0) + amount
+
+    def setTotal(self, labelValues, total):
+        """
+        Sets the count to *total*, a count kept elsewhere since the
+        collector started, which also only goes up.
+        """
+        with self.lock:
+            self.values[labelValues] = total
+
+
+class Gauge(Metric):
+    """
+    A value that is set to the latest measurement.
+    """
+
+    type = 'gauge'
+
+    def set(self, labelValues, value):
+        with self.lock:
+            self.values[labelValues] = value
+
+
+class Histogram(Metric):
+    """
+    The distribution of a measurement, as counts in cumulative buckets,
+    plus the count and sum of all the observations.
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labelNames=(), buckets=SECONDS_BUCKETS):
+        Metric.__init__(self, name, help, labelNames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, labelValues, value):
+        with self.lock:
+            counts = self.values.get(labelValues)
+            if counts is None:
+                # a count per bucket, plus +Inf, then the sum
+                counts = [0] * (len(self.buckets) + 1) + [0.0]
+                self.values[labelValues] = counts
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def formatSamples(self, labelValues, counts):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts[:-1]):
+            cumulative += count
+            if bound != '+Inf':
+                bound = formatValue(bound)
+            lines.append('%s_bucket%s %i' % (self.name,
+                         self.formatLabels(labelValues, [('le', bound)]), cumulative))
+        lines.append('%s_sum%s %s' % (self.name, self.formatLabels(labelValues),
+                                      formatValue(counts[-1])))
+        lines.append('%s_count%s %i' % (self.name, self.formatLabels(labelValues),
+                                        cumulative))
+        return lines
+
+
+class CollectorMetrics(object):
+    """
+    Measurements of every cycle of the collector, in the Prometheus text
+    format, so they can be scraped from a small HTTP server, with
+    startServer(), or written to a file for the node_exporter textfile
+    collector, with *textfile*.
+
+    The pipeline records the latency of each fetch, parse and write, and
+    the size of each response.  A source's write() adds the time of each
+    step of the write, and the rows written to each table.  The freshness
+    lag is the time from the upstream timestamp of the data to the commit,
+    and the fetch lag the time from it to the start of the fetch.
+    """
+
+    def __init__(self, textfile=None):
+        """
+        Constructor.
+
+        *textfile* is a file to write all the metrics to after every
+        write, or None.
+        """
+        self.textfile = textfile
+        self.textfileLock = threading.Lock()
+        self.server = None
+
+        self.fetchSeconds = Histogram('sfdata_fetch_seconds',
+            'Time to fetch a response', ('source',))
+        self.responseBytes = Histogram('sfdata_response_bytes',
+            'Size of each response fetched', ('source',), BYTES_BUCKETS)
+        self.parseSeconds = Histogram('sfdata_parse_seconds',
+            'Time to parse a response', ('source',))
+        self.writeSeconds = Histogram('sfdata_write_seconds',
+            'Time to write and commit a response', ('source',))
+        self.writeStepSeconds = Histogram('sfdata_write_step_seconds',
+            'Time spent in each step of a write', ('source', 'step'))
+        self.rowsWritten = Counter('sfdata_rows_written_total',
+            'Rows written to each table', ('source', 'table'))
+        self.freshnessLag = Histogram('sfdata_freshness_lag_seconds',
+            'Time from the upstream timestamp of the data to its commit',
+            ('source',), LAG_BUCKETS)
+        self.fetchLag = Histogram('sfdata_fetch_lag_seconds',
+            'Time from the upstream timestamp of new data to the fetch that found it',
+            ('source',), LAG_BUCKETS)
+        self.lastCommit = Gauge('sfdata_last_commit_timestamp_seconds',
+            'Unix time of the last successful write', ('source',))
+        self.errors = Counter('sfdata_errors_total',
+            'Failed fetches and writes', ('source', 'stage'))
+        self.missed = Counter('sfdata_missed_polls_total',
+            'Polls skipped because the last was still in progress', ('source',))
+        self.wastedPolls = Counter('sfdata_wasted_polls_total',
+            'Polls that found nothing new, or failed', ('source',))
+        self.missedRefreshes = Counter('sfdata_missed_refreshes_total',
+            'Upstream refreshes never fetched, estimated from their timestamps',
+            ('source',))
+        self.cadence = Gauge('sfdata_upstream_cadence_seconds',
+            'Seconds between upstream refreshes, as learned', ('source',))
+        self.refreshDelay = Gauge('sfdata_upstream_delay_seconds',
+            'Seconds from the upstream timestamp of a refresh until it can be '
+            'fetched, as learned', ('source',))
+        self.queueDepth = Gauge('sfdata_write_queue_depth',
+            'Items waiting in each writer queue', ('queue',))
+        self.queueDropped = Counter('sfdata_write_queue_dropped_total',
+            'Items dropped from each full writer queue', ('queue',))
+        self.spoolPending = Gauge('sfdata_spool_pending',
+            'Items in the spool not yet written', ('source',))
+        self.rss = Gauge('sfdata_process_rss_bytes',
+            'Resident set size of the collector after the last write')
+        self.objects = Gauge('sfdata_gc_objects',
+            'Objects tracked by the garbage collector after the last write')
+        self.sessionObjects = Gauge('sfdata_session_objects',
+            'Objects in the session of the last write, before it was closed',
+            ('source',))
+        self.leaseHeld = Gauge('sfdata_lease_held',
+            'Whether this node holds the lease to poll and write each source',
+            ('source',))
+
+        self.metrics = (self.fetchSeconds, self.responseBytes, self.parseSeconds,
+                        self.writeSeconds, self.writeStepSeconds, self.rowsWritten,
+                        self.freshnessLag, self.fetchLag, self.lastCommit,
+                        self.errors, self.missed, self.wastedPolls,
+                        self.missedRefreshes, self.cadence, self.refreshDelay,
+                        self.queueDepth, self.queueDropped,
+                        self.spoolPending, self.rss, self.objects,
+                        self.sessionObjects, self.leaseHeld)
+
+        # called before formatting, to update the gauges, and the counters
+        # kept by the pipeline
+        self.pipeline = None
+
+    def recordWrite(self, source, seconds, timings, rowCounts, dataTime):
+        """
+        Records a successful write by *source*, which took *seconds*.
+
+        *timings* is the seconds spent in each step, by step name.
+
+        *rowCounts* is the rows written, by table name.
+
+        *dataTime* is the upstream timestamp of the data written, as a
+        unix time, or None.
+        """
+        now = time.time()
+        self.writeSeconds.observe((source.name,), seconds)
+        for step, stepSeconds in timings.iteritems():
+            self.writeStepSeconds.observe((source.name, step), stepSeconds)
+        for table, numRows in rowCounts.iteritems():
+            self.rowsWritten.inc((source.name, table), numRows)
+        if dataTime is not None:
+            self.freshnessLag.observe((source.name,), now - dataTime)
+        self.lastCommit.set((source.name,), now)
+
+        if self.textfile is not None:
+            self.writeTextfile()
+
+    def format(self):
+        """
+        Returns all the metrics in the Prometheus text format.
+        """
+        if self.pipeline is not None:
+            stats = self.pipeline.getStats()
+            for name, missed in stats['missed'].iteritems():
+                self.missed.setTotal((name,), missed)
+            for name, schedule in stats['polls'].iteritems():
+                self.wastedPolls.setTotal((name,), schedule.stats['wasted'])
+                self.missedRefreshes.setTotal((name,), schedule.stats['missed'])
+                if schedule.cadence is not None:
+                    self.cadence.set((name,), schedule.cadence)
+                if schedule.delay is not None:
+                    self.refreshDelay.set((name,), schedule.delay)
+            for i, depth in enumerate(stats['writeQueueDepth']):
+                self.queueDepth.set((str(i),), depth)
+            for i, dropped in enumerate(stats['writeQueueDropped']):
+                self.queueDropped.setTotal((str(i),), dropped)
+            for name, pending in stats['spoolPending'].iteritems():
+                self.spoolPending.set((name,), pending)
+            memory = stats['memory']
+            if memory['rss'] is not None:
+                self.rss.set((), memory['rss'])
+            self.objects.set((), memory['objects'])
+            for name, count in memory['sessionObjects'].iteritems():
+                self.sessionObjects.set((name,), count)
+            for name, held in stats['leases'].iteritems():
+                self.leaseHeld.set((name,), int(held))
+
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.format())
+        return '\n'.join(lines) + '\n'
+
+    def writeTextfile(self):
+        """
+        Writes the metrics to the textfile, replacing it whole, so a
+        reader never sees half of it.
+        """
+        with self.textfileLock:
+            tempPath = self.textfile + '.tmp'
+            f = open(tempPath, 'w')
+            try:
+                f.write(self.format())
+            finally:
+                f.close()
+            try:
+                os.rename(tempPath, self.textfile)
+            except OSError:
+                os.remove(self.textfile)
+                os.rename(tempPath, self.textfile)
+
+    def startServer(self, port, host=''):
+        """
+        Serves the metrics at http://host:port/metrics from a thread of
+        its own.
+        """
+        self.server = MetricsServer((host, port), self)
+        thread = threading.Thread(target=self.server.serve_forever, name='metrics')
+        thread.daemon = True
+        thread.start()
+
+    def stopServer(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+class MetricsRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Answers GET /metrics with the current metrics.
+    """
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        body = self.server.metrics.format()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    A small HTTP server for Prometheus to scrape.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, metrics):
+        BaseHTTPServer.HTTPServer.__init__(self, address, MetricsRequestHandler)
+        self.metrics = metrics
+
+
+def formatValue(value):
+    """
+    Formats a sample value, or bucket bound, as Prometheus expects.
+    """
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def escapeLabel(value):
+    """
+    Escapes a label value for the text format.
+    """
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
@@ -0,0 +1,753 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import sys
+import time
+import heapq
+import threading
+import traceback
+import Queue
+
+from sets import Set
+
+from Backoff import Backoff
+from CollectorLeases import LeaseLost
+from ProcessMemory import getRss, countObjects, formatBytes
+from PollSchedule import PollSchedule
+
+
+class DropOldestQueue(object):
+    """
+    A bounded queue between two pipeline stages.  When it is full, putting
+    a new item discards the oldest one instead of blocking, so the stage
+    upstream never waits on the stage downstream.  Discarded items are
+    counted in *dropped*.
+    """
+
+    def __init__(self, maxsize):
+        self.queue = Queue.Queue(maxsize)
+        self.dropped = 0
+
+    def put(self, item):
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except Queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except Queue.Empty:
+                    pass
+
+    def get(self, timeout):
+        """
+        Returns the next item, or raises Queue.Empty after *timeout* seconds.
+        """
+        return self.queue.get(True, timeout)
+
+    def qsize(self):
+        return self.queue.qsize()
+
+
+class StageStats(object):
+    """
+    Running counts and latencies for one pipeline stage.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.lastLatency = 0.0
+        self.maxLatency = 0.0
+        self.totalLatency = 0.0
+
+    def record(self, latency):
+        self.count += 1
+        self.lastLatency = latency
+        self.maxLatency = max(self.maxLatency, latency)
+        self.totalLatency += latency
+
+    def meanLatency(self):
+        if self.count == 0:
+            return 0.0
+        return self.totalLatency / self.count
+
+
+class WorkerThread(threading.Thread):
+    """
+    A thread that takes items from *inQueue* and calls *func* on each.
+    Exceptions are printed and counted in *errors*, and the worker carries
+    on with the next item.
+    """
+
+    def __init__(self, name, func, inQueue):
+        threading.Thread.__init__(self, name=name)
+        self.daemon = True
+        self.func = func
+        self.inQueue = inQueue
+        self.stopEvent = threading.Event()
+        self.errors = 0
+
+    def run(self):
+        while not self.stopEvent.is_set():
+            try:
+                item = self.inQueue.get(1.0)
+            except Queue.Empty:
+                continue
+            self.process(item)
+
+        # finish off whatever is already queued
+        while True:
+            try:
+                item = self.inQueue.get(0)
+            except Queue.Empty:
+                break
+            self.process(item)
+
+    def process(self, item):
+        try:
+            self.func(item)
+        except Exception:
+            self.errors += 1
+            print "Error in %s:" % self.name
+            traceback.print_exc(file=sys.stdout)
+
+
+class SchedulerThread(threading.Thread):
+    """
+    Puts each source on *outQueue* once every source.period seconds.  One
+    of these serves all the sources, however many there are.
+
+    Each source's schedule is anchored to the start time, so it does not
+    drift however long each poll takes.  If a source is still being
+    fetched or parsed when its next poll is due, that poll is skipped
+    and counted in missed[source.name].
+
+    With a LeaseCoordinator, *coordinator*, only the sources whose lease
+    this node holds are polled.
+
+    Each source has a PollSchedule, in *schedules*, which learns when its
+    upstream refreshes, and counts the polls that find nothing new.  If
+    *adaptive*, once it has learned enough, the PollSchedule chooses the
+    time of each poll after the one before is done, in place of the next
+    one every period.
+    """
+
+    def __init__(self, sources, outQueue, coordinator=None, adaptive=False):
+        threading.Thread.__init__(self, name='scheduler')
+        self.daemon = True
+        self.sources = sources
+        self.outQueue = outQueue
+        self.coordinator = coordinator
+        self.stopEvent = threading.Event()
+        self.inFlight = Set()
+        self.missed = dict([(source.name, 0) for source in sources])
+        self.schedules = dict([(source.name, PollSchedule(source.period, adaptive))
+                               for source in sources])
+
+        # (index, time) of the polls chosen by the schedules as each poll
+        # is done, and set when there are any
+        self.rescheduled = Queue.Queue()
+        self.wakeEvent = threading.Event()
+
+    def run(self):
+        now = time.time()
+        schedule = [(now, i) for i in range(len(self.sources))]
+        heapq.heapify(schedule)
+
+        # the time each source is due, so the earlier times of sources
+        # that have since been rescheduled can be passed over
+        due = [now] * len(self.sources)
+
+        while not self.stopEvent.is_set():
+            while not self.rescheduled.empty():
+                i, dueTime = self.rescheduled.get()
+                due[i] = dueTime
+                heapq.heappush(schedule, (dueTime, i))
+
+            dueTime, i = schedule[0]
+            if dueTime != due[i]:
+                heapq.heappop(schedule)
+                continue
+            wait = dueTime - time.time()
+            if wait > 0:
+                self.wakeEvent.wait(min(wait, 1.0))
+                self.wakeEvent.clear()
+                continue
+
+            source = self.sources[i]
+            if self.coordinator is not None and not self.coordinator.owns(source.name):
+                # polled by another node
+                pass
+            elif source.name in self.inFlight:
+                self.missed[source.name] += 1
+            else:
+                self.inFlight.add(source.name)
+                self.outQueue.put(source)
+
+            # if we have fallen more than a period behind, skip ahead
+            # rather than polling several times in a row to catch up
+            nextTime = dueTime + source.period
+            now = time.time()
+            if now > nextTime:
+                skipped = int((now - nextTime) // source.period) + 1
+                self.missed[source.name] += skipped
+                nextTime += skipped * source.period
+            due[i] = nextTime
+            heapq.heapreplace(schedule, (nextTime, i))
+
+    def done(self, source, fetchTime=None, fresh=False, dataTime=None):
+        """
+        Called when a source has been fetched and parsed, so it can be
+        polled again.  *fetchTime* is the unix time the poll started,
+        *fresh* whether it found new data, and *dataTime* the upstream
+        timestamp of the data, as a unix time, or None.
+        """
+        if fetchTime is not None:
+            schedule = self.schedules[source.name]
+            schedule.observe(fetchTime, fresh, dataTime)
+            nextTime = schedule.nextTime(time.time())
+            if nextTime is not None:
+                self.rescheduled.put((self.sources.index(source), nextTime))
+                self.wakeEvent.set()
+        self.inFlight.discard(source.name)
+
+
+class SpoolDrainerThread(threading.Thread):
+    """
+    Writes the data that *sources* have appended to a WriteSpool, in
+    batches of up to *batchSize* items, with *writeItems*, a function
+    taking a tuple of a source and a list of its items.
+
+    When a write fails, the batch stays in the spool, and is tried again
+    after a wait chosen by *backoff*, so a database that is down is
+    retried less and less often, without holding up polling.  Once it is
+    back, the backlog is written in full batches, each in a single
+    transaction.
+
+    If the same upstream data was spooled twice, as when a poll after a
+    restart returns the response still waiting in the spool, the second
+    copy is skipped.  So is anything no newer than what the source says
+    is already stored, as when the collector stopped after a batch was
+    committed but before the spool recorded it.
+    """
+
+    def __init__(self, name, sources, spool, writeItems, batchSize, backoff):
+        threading.Thread.__init__(self, name=name)
+        self.daemon = True
+        self.sources = sources
+        self.spool = spool
+        self.writeItems = writeItems
+        self.batchSize = batchSize
+        self.backoff = backoff
+        self.stopEvent = threading.Event()
+        self.wakeEvent = threading.Event()
+        self.errors = 0
+
+        # source name -> getDataTime() of the newest item written
+        self.lastDataTime = {}
+
+    def run(self):
+        while True:
+            # once stopped, make one last attempt to empty the spool.
+            # Whatever is left is written at the next startup
+            stopping = self.stopEvent.is_set()
+            self.wakeEvent.clear()
+            try:
+                drained = self.drain()
+            except Exception:
+                # drain() handles a failed write.  Anything else, such as
+                # the spool failing to read, is retried the same way, 
+                # rather than ending the thread, which would leave the 
+                # spool to grow unseen
+                self.errors += 1
+                print "Error in %s:" % self.name
+                traceback.print_exc(file=sys.stdout)
+                drained = False
+
+            if drained:
+                self.backoff.succeeded()
+                if stopping:
+                    break
+                self.wakeEvent.wait(1.0)
+            else:
+                if stopping:
+                    break
+                wait = self.backoff.failed()
+                print "%s will retry in %.1f seconds" % (self.name, wait)
+                self.stopEvent.wait(wait)
+
+    def drain(self):
+        """
+        Writes everything in the spool for each source.  Returns False if
+        a write failed.  A source whose write fails doesn't hold up the
+        others, which are still written.
+        """
+        drained = True
+        for source in self.sources:
+            if not self.drainSource(source):
+                drained = False
+        return drained
+
+    def drainSource(self, source):
+        """
+        Writes everything in the spool for *source*.  Returns False, and
+        leaves the rest in the spool, if a write failed.
+        """
+        while True:
+            items, position = self.spool.read(source.name, self.batchSize)
+            if len(items) == 0:
+                return True
+
+            last = self.lastDataTime.get(source.name)
+            stored = source.getStoredTime()
+            if stored is not None and (last is None or stored > last):
+                last = stored
+            newItems = []
+            for data in items:
+                dataTime = source.getDataTime(data)
+                if dataTime is not None and last is not None and dataTime <= last:
+                    continue
+                newItems.append(data)
+                if dataTime is not None:
+                    last = dataTime
+
+            try:
+                if len(newItems) > 0:
+                    self.writeItems((source, newItems))
+            except Exception, e:
+                self.errors += 1
+                if self.backoff.failures == 0:
+                    print "Error in %s:" % self.name
+                    traceback.print_exc(file=sys.stdout)
+                else:
+                    print "Error in %s: %s" % (self.name, str(e).split('\n')[0])
+                return False
+
+            self.spool.commit(source.name, position)
+            self.lastDataTime[source.name] = last
+
+
+class CoordinatorThread(threading.Thread):
+    """
+    Refreshes the leases of a LeaseCoordinator every third of the lease
+    time, with a new session from *Session* each time.  *gained* is 
+    called with the name of each source taken over from another node.
+    """
+
+    def __init__(self, coordinator, Session, gained):
+        threading.Thread.__init__(self, name='coordinator')
+        self.daemon = True
+        self.coordinator = coordinator
+        self.Session = Session
+        self.gained = gained
+        self.stopEvent = threading.Event()
+        self.errors = 0
+
+    def run(self):
+        while not self.stopEvent.wait(self.coordinator.leaseSeconds / 3.0):
+            self.refresh()
+
+    def refresh(self):
+        """
+        Refreshes the leases once, and reports any change.  If the
+        database can't be reached, the leases are left to expire, and 
+        are renewed if nobody has taken them by the time it is back.
+        """
+        session = self.Session()
+        try:
+            gained, lost = self.coordinator.refresh(session)
+        except Exception, e:
+            self.errors += 1
+            session.rollback()
+            print "Error in %s: %s" % (self.name, str(e).split('\n')[0])
+            return
+        finally:
+            session.close()
+
+        for name in gained:
+            print "Took over %s, with %i nodes live" % (name, self.coordinator.liveNodes)
+            self.gained(name)
+        for name in lost:
+            print "Lost %s to another node" % name
+
+
+class CollectorPipeline(object):
+    """
+    Polls any number of DataSources concurrently, with a fixed number of
+    threads:
+
+        scheduler - one thread that decides when each source is due
+        fetch     - *fetchWorkers* threads that fetch and parse, sharing
+                    one HttpFetcher and its connection pool
+        write     - *writeWorkers* threads that store the parsed data,
+                    with a new session for each write
+
+    Each source always goes to the same writer, so its data are written
+    in order.  The writers' queues hold at most *queueSize* items, and
+    when one is full the oldest item is dropped, so a slow database
+    never holds up the fetch schedule.
+
+    With a *spool*, nothing is dropped.  The fetch threads append the
+    parsed data to the spool instead, and the writers drain it into the
+    database, in batches, whenever the database can be reached.
+
+    With a *coordinator*, other collectors can write to the same
+    database, and a thread of its own keeps the leases that decide which
+    sources this one polls and writes.
+
+    If *adaptive*, each source is polled soon after its upstream is
+    expected to refresh, rather than every period.  See PollSchedule.py.
+    """
+
+    def __init__(self, sources, fetcher, Session,
+                 fetchWorkers=4, writeWorkers=2, queueSize=5, checkpoint=None,
+                 metrics=None, spool=None, spoolBatch=60, backoff=None,
+                 coordinator=None, adaptive=False):
+        """
+        Constructor.
+
+        *sources* is a list of DataSources, already initialized.
+
+        *fetcher* is the HttpFetcher shared by all the sources.
+
+        *Session* is a session factory, from sessionmaker().
+
+        *checkpoint* is an optional CollectorCheckpoint, where the state
+        of each source is saved after each successful write.
+
+        *metrics* is an optional CollectorMetrics, where every fetch, parse
+        and write is recorded.
+
+        *spool* is an optional WriteSpool.  The writers write at most
+        *spoolBatch* items from it at a time, and wait between attempts
+        when the database fails as chosen by *backoff*, a Backoff, which
+        defaults to between 1 and 300 seconds.
+
+        *coordinator* is an optional LeaseCoordinator, shared with the
+        other collectors through the database.  A source taken over from
+        another node is reset before its first write, and data for a
+        source whose lease has been lost is dropped, since the node that
+        took it over polls it now.
+        """
+        self.sources = sources
+        self.fetcher = fetcher
+        self.Session = Session
+        self.checkpoint = checkpoint
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.pipeline = self
+        self.spool = spool
+        self.coordinator = coordinator
+
+        # names of the sources whose last write failed, to reset before
+        # the next one
+        self.needsReset = Set()
+
+        # so memory growth can be watched:
+        #   rss            - resident set size of the process, in bytes
+        #   objects        - objects tracked by the garbage collector
+        #   sessionObjects - objects in the identity map of the session of
+        #                    the last write, by source name, before it was
+        #                    closed
+        # rss and objects are measured when the stats are read, by the
+        # reports and metrics, since counting the objects walks the whole
+        # heap.  sessionObjects is kept after each write
+        self.memory = {'rss' : None, 'objects' : 0, 'sessionObjects' : {}}
+
+        # per source and stage, with stages of fetch, parse and write
+        self.stats = {}
+        for source in sources:
+            for stage in ('fetch', 'parse', 'write'):
+                self.stats[(source.name, stage)] = StageStats()
+
+        # never fills, since each source is queued at most once at a time
+        self.fetchQueue = DropOldestQueue(0)
+        self.scheduler = SchedulerThread(sources, self.fetchQueue, coordinator,
+                                         adaptive)
+        self.fetchers = [WorkerThread('fetch-%i' % i, self.fetchAndParse, self.fetchQueue)
+                         for i in range(fetchWorkers)]
+
+        self.writeQueues = []
+        self.writers = []
+        self.writeQueueOf = {}
+        self.drainerOf = {}
+        if spool is None:
+            for i in range(writeWorkers):
+                queue = DropOldestQueue(queueSize)
+                self.writeQueues.append(queue)
+                self.writers.append(WorkerThread('write-%i' % i, self.makeWriter(), queue))
+            for i, source in enumerate(sources):
+                self.writeQueueOf[source.name] = self.writeQueues[i % writeWorkers]
+        else:
+            for i in range(writeWorkers):
+                group = sources[i::writeWorkers]
+                drainer = SpoolDrainerThread('drain-%i' % i, group, spool,
+                                             self.makeWriter(), spoolBatch,
+                                             backoff or Backoff(1.0, 300.0))
+                self.writers.append(drainer)
+                for source in group:
+                    self.drainerOf[source.name] = drainer
+
+        self.coordinatorThread = None
+        if coordinator is not None:
+            self.coordinatorThread = CoordinatorThread(coordinator, Session,
+                                                       self.needsReset.add)
+
+    def fetchAndParse(self, source):
+        fetchTime = time.time()
+        fresh = False
+        dataTime = None
+        try:
+            startTime = fetchTime
+            response = source.fetch(self.fetcher)
+            latency = time.time() - startTime
+            self.stats[(source.name, 'fetch')].record(latency)
+            if self.metrics is not None:
+                self.metrics.fetchSeconds.observe((source.name,), latency)
+            if response is None:
+                return
+
+            if self.metrics is not None:
+                size = source.getResponseSize(response)
+                if size is not None:
+                    self.metrics.responseBytes.observe((source.name,), size)
+
+            startTime = time.time()
+            data = source.parse(response)
+            latency = time.time() - startTime
+            self.stats[(source.name, 'parse')].record(latency)
+            if self.metrics is not None:
+                self.metrics.parseSeconds.observe((source.name,), latency)
+            if data is None:
+                return
+
+            fresh = True
+            dataTime = source.getDataUnixTime(data)
+            if self.metrics is not None and dataTime is not None:
+                self.metrics.fetchLag.observe((source.name,), fetchTime - dataTime)
+
+            if self.spool is not None:
+                self.spool.append(source.name, data)
+                self.drainerOf[source.name].wakeEvent.set()
+            else:
+                self.writeQueueOf[source.name].put((source, [data]))
+        except Exception:
+            self.stats[(source.name, 'fetch')].errors += 1
+            if self.metrics is not None:
+                self.metrics.errors.inc((source.name, 'fetch'))
+            raise
+        finally:
+            self.scheduler.done(source, fetchTime, fresh, dataTime)
+
+    def makeWriter(self):
+        """
+        Returns a function for a writer thread, which stores a tuple of a
+        source and a list of its items.  If the write fails, the source is
+        reset before its next write.
+
+        Each write has a session of its own, which is closed afterwards,
+        so nothing it loaded or added outlives the write.  A session kept
+        for the life of the collector holds on to whatever is still
+        referenced from its identity map, and grows for weeks.
+        """
+        def write(item):
+            source, items = item
+            session = self.Session()
+            try:
+                self.writeItems(session, source, items)
+                self.memory['sessionObjects'][source.name] = len(session.identity_map)
+            finally:
+                session.close()
+
+        return write
+
+    def sampleMemory(self):
+        """
+        Measures the resident memory and the objects of the process, in
+        *memory*.
+        """
+        self.memory['rss'] = getRss()
+        self.memory['objects'] = countObjects()
+
+    def writeItems(self, session, source, items):
+        """
+        Writes a list of items from *source*, with *session*, and records
+        how it went.
+        """
+        timings = {}
+        rowCounts = {}
+        startTime = time.time()
+        try:
+            if self.coordinator is not None:
+                items = self.coordinator.hold(session, source, items)
+                if len(items) == 0:
+                    session.commit()
+                    return
+            if source.name in self.needsReset:
+                source.reset(session)
+                self.needsReset.discard(source.name)
+            if len(items) == 1:
+                source.write(session, items[0], timings, rowCounts)
+            else:
+                source.writeBatch(session, items, timings, rowCounts)
+        except LeaseLost, e:
+            session.rollback()
+            print "Dropped %i items: %s" % (len(items), e)
+            return
+        except Exception:
+            session.rollback()
+            self.needsReset.add(source.name)
+            self.stats[(source.name, 'write')].errors += 1
+            if self.metrics is not None:
+                self.metrics.errors.inc((source.name, 'write'))
+            raise
+        latency = time.time() - startTime
+        self.stats[(source.name, 'write')].record(latency)
+
+        if self.checkpoint is not None:
+            self.checkpoint.save(source)
+
+        if self.metrics is not None:
+            self.metrics.recordWrite(source, latency, timings, rowCounts,
+                                     source.getDataUnixTime(items[-1]))
+
+    def start(self):
+        threads = self.writers + self.fetchers + [self.scheduler]
+        if self.coordinatorThread is not None:
+            # the sources were just initialized, so those taken now don't
+            # need a reset
+            session = self.Session()
+            try:
+                self.coordinator.refresh(session)
+            finally:
+                session.close()
+            threads.append(self.coordinatorThread)
+        for thread in threads:
+            thread.start()
+
+    def stop(self):
+        """
+        Stops polling, and waits for the data already fetched to be
+        parsed and written.  The threads are stopped in order, so each
+        one has received everything from the ones before it.
+        """
+        for group in ([self.scheduler], self.fetchers, self.writers):
+            for thread in group:
+                thread.stopEvent.set()
+            for thread in group:
+                thread.join()
+
+        # once everything is written, hand the leases straight over
+        if self.coordinatorThread is not None:
+            self.coordinatorThread.stopEvent.set()
+            self.coordinatorThread.join()
+            session = self.Session()
+            try:
+                self.coordinator.releaseAll(session)
+            finally:
+                session.close()
+
+    def getStats(self):
+        """
+        Returns a dictionary describing the state of the pipeline:
+            writeQueueDepth   - items waiting in each writer queue
+            writeQueueDropped - items dropped from each writer queue
+            spoolPending      - items in the spool not yet written, by
+                                source name, if there is a spool
+            fetchQueueDepth   - sources waiting for a fetch thread
+            missed            - polls skipped, by source name
+            polls             - the PollSchedule of each source, by name
+            leases            - whether this node holds the lease on each
+                                source, by name, if there is a coordinator
+            memory            - the process's memory, measured now,
+                                as described in __init__()
+            stages            - a StageStats object for each
+                                (source name, stage) pair
+        """
+        self.sampleMemory()
+        return {'writeQueueDepth'   : [q.qsize() for q in self.writeQueues],
+                'writeQueueDropped' : [q.dropped for q in self.writeQueues],
+                'spoolPending'      : dict([(source.name, self.spool.pending(source.name))
+                                            for source in self.sources
+                                            if self.spool is not None]),
+                'fetchQueueDepth'   : self.fetchQueue.qsize(),
+                'missed'            : dict(self.scheduler.missed),
+                'polls'             : dict(self.scheduler.schedules),
+                'leases'            : dict([(source.name, self.coordinator.owns(source.name))
+                                            for source in self.sources
+                                            if self.coordinator is not None]),
+                'memory'            : self.memory,
+                'stages'            : self.stats}
+
+    def formatStats(self):
+        """
+        Returns a short human readable summary of getStats().
+        """
+        stats = self.getStats()
+        if self.spool is not None:
+            lines = ['  spool: %s pending' % ', '.join(['%s %i' % item for item in
+                                                     sorted(stats['spoolPending'].items())])]
+        else:
+            lines = ['  write queues: depth %s, dropped %s' %
+                     (stats['writeQueueDepth'], stats['writeQueueDropped'])]
+        if self.coordinator is not None:
+            coordinator = self.coordinator
+            lines.append('  leases: holding %s as %s, %i nodes live, %i taken over, '
+                         '%i lost, %i duplicates skipped' %
+                         (', '.join(sorted(coordinator.owned)) or 'none',
+                          coordinator.nodeId, coordinator.liveNodes,
+                          coordinator.stats['gained'], coordinator.stats['lost'],
+                          coordinator.stats['duplicates']))
+        memory = stats['memory']
+        lines.append('  memory: %s resident, %i objects, %i in the last session' %
+                     (formatBytes(memory['rss']), memory['objects'],
+                      sum(memory['sessionObjects'].values())))
+        for source in self.sources:
+            fetch = self.stats[(source.name, 'fetch')]
+            parse = self.stats[(source.name, 'parse')]
+            write = self.stats[(source.name, 'write')]
+            lines.append('  %s: %i fetched (%i errors, %i missed, %.2fs mean), '
+                         '%i parsed (%.2fs mean), %i written (%i errors, '
+                         '%.2fs mean, %.2fs max)' %
+                         (source.name, fetch.count, fetch.errors,
+                          stats['missed'][source.name], fetch.meanLatency(),
+                          parse.count, parse.meanLatency(),
+                          write.count, write.errors,
+                          write.meanLatency(), write.maxLatency))
+            polls = stats['polls'][source.name]
+            lines.append('  %s polls: %i found new data (%.1fs mean lag, %.1fs max), '
+                         '%i wasted, %i refreshes missed, %s' %
+                         (source.name, polls.stats['fresh'], polls.meanLag(),
+                          polls.stats['maxLag'], polls.stats['wasted'],
+                          polls.stats['missed'], formatCadence(polls)))
+        return '\n'.join(lines)
+
+
+def formatCadence(schedule):
+    """
+    Returns what a PollSchedule has learned of the upstream refreshes.
+    """
+    if schedule.cadence is None:
+        return 'cadence not known yet'
+    if schedule.delay is None:
+        return 'refreshed every %.0fs' % schedule.cadence
+    return 'refreshed every %.0fs, fetchable %.1fs after' % (schedule.cadence,
+                                                              schedule.delay)
@@ -0,0 +1,178 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import time
+
+
+class DataSource(object):
+    """
+    Base class for a source of real time data that the collector polls.
+    To add a new feed, subclass this, set the class attributes, override
+    fetch() and write(), and add the class to SOURCES in
+    sfdata_collector.py.
+
+    The collector calls fetch() and parse() from a shared pool of fetch
+    threads, and write(), writeBatch(), reset() and getState() from a
+    shared pool of writer threads.  For any one source:
+
+        - a poll's fetch() and parse() are made one after the other, and
+          the next poll's only start once they are done, so they can
+          share state without locking
+
+        - the writer calls are made one at a time, and write() receives
+          the data in the order it was parsed, so they can share state
+          without locking too
+
+        - but the two sides run at the same time, since the next poll is
+          fetched and parsed while the last is still being written
+
+    So the state kept by fetch() and parse(), such as what was last
+    parsed, and the state kept by the writer calls, such as what is in
+    the database, should be kept apart, or locked where they meet.
+    Everything passes from one side to the other in the data returned by
+    parse().  initialize() is called before either side starts.
+    """
+
+    # short unique name, used in the command line options and reports
+    name = None
+
+    # seconds between polls
+    period = 60
+
+    # the mapped classes this source stores, in the order they are
+    # written, so that tables referred to by others come first
+    models = ()
+
+    def __init__(self):
+        # running totals reported by the collector.  Sources can add their own.
+        self.stats = {'skippedUnchanged' : 0}
+
+        # a cache of the latest state the source has written, served by
+        # AvailabilityApi, or None if the source doesn't keep one
+        self.latest = None
+
+    def initialize(self, session, state=None):
+        """
+        Called once at startup, before the first poll, to load whatever
+        state the source needs from the database.
+
+        *state* is what getState() returned at the last checkpoint, if
+        the collector is keeping one, or None.  A source should check
+        that it is consistent with the database before using it in place
+        of the database.
+        """
+        pass
+
+    def getState(self):
+        """
+        Returns the runtime state of the source, made of json-compatible
+        types, to be saved in the checkpoint after each write and passed 
+        to initialize() at the next startup.  Returns None by default, 
+        when there is nothing worth saving.
+        """
+        return None
+
+    def fetch(self, fetcher):
+        """
+        Makes the request for one poll, using the shared HttpFetcher, and
+        returns the raw response, or None if there is nothing new.
+        Raises a requests.exceptions.RequestException if the request fails.
+        """
+        raise NotImplementedError
+
+    def parse(self, response):
+        """
+        Turns a response returned by fetch() into the data passed to
+        write(), or returns None if it should not be stored.
+        """
+        return response
+
+    def write(self, session, data, timings=None, rowCounts=None):
+        """
+        Stores the data returned by parse() in the database, and commits.
+        If this raises an exception, the collector rolls back the session.
+
+        *timings* and *rowCounts* are optional dictionaries, for the
+        collector's metrics, to which a source can add the seconds spent
+        in each step of the write, and the number of rows written to each
+        table, keyed by table name.
+        """
+        raise NotImplementedError
+
+    def writeBatch(self, session, items, timings=None, rowCounts=None):
+        """
+        Stores a list of the data returned by parse(), in order, as when
+        catching up from the spool.  By default, each is written in turn,
+        but a source can override this to write them all at once, in one
+        transaction, which is much faster.
+        """
+        for data in items:
+            self.write(session, data, timings, rowCounts)
+
+    def reset(self, session):
+        """
+        Called after a write fails and is rolled back, before the data is
+        written again, so the source can forget what it recorded about
+        data that never reached the database.  Raises an exception if 
+        the database can't be read, and is called again before the next
+        attempt.  Does nothing by default.
+        """
+        pass
+
+    def getResponseSize(self, response):
+        """
+        Returns the size in bytes of a response returned by fetch(), or
+        None if it is not known.
+        """
+        content = getattr(response, 'content', None)
+        if content is None:
+            return None
+        return len(content)
+
+    def getDataTime(self, data):
+        """
+        Returns the time the upstream service says the data returned by
+        parse() is as of, as a naive datetime in local time, for measuring
+        how fresh the data is when it is written, or None if it has no
+        such time.
+        """
+        return None
+
+    def getStoredTime(self):
+        """
+        Returns the getDataTime() of the newest data this source knows
+        to be in the database, or None if it doesn't know.  Called from
+        the writer side, so that data spooled but already written, as 
+        when the collector stopped before the spool recorded the commit,
+        isn't written twice.
+        """
+        return None
+
+    def getDataUnixTime(self, data):
+        """
+        Returns the time of getDataTime() as a unix time, for measuring 
+        how fresh the data is against the clock, or None if it has no 
+        such time.  By default, the data time is taken to be in this
+        computer's time zone, so a source whose upstream is elsewhere 
+        should override this.
+        """
+        dataTime = self.getDataTime(data)
+        if dataTime is None:
+            return None
+        return time.mktime(dataTime.timetuple()) + dataTime.microsecond / 1e6
@@ -0,0 +1,168 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import time
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from Backoff import Backoff
+
+# status codes worth retrying, since the server may recover in seconds
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class HttpFetcher(object):
+    """
+    A reusable HTTP client for polling data services.  Connections are
+    pooled and kept alive between requests, responses are requested with
+    gzip compression, and if the server sends an ETag or Last-Modified
+    header, the next request for the same URL is made conditional on it,
+    so an unchanged response costs a 304 and no body.  One fetcher can
+    be shared by several threads.
+
+    A request that fails to connect, times out, or gets a 429 or 5xx
+    status is retried, after a wait with exponential backoff and jitter.
+
+    Running totals are kept in the *stats* dictionary:
+        requests          - number of requests made
+        notModified       - responses that were 304 Not Modified
+        bytesTransferred  - response body bytes received over the wire,
+                            before decompression
+        bytesDecoded      - response body bytes after decompression
+        retries           - requests retried
+    """
+
+    def __init__(self, poolSize=4, timeout=60, retries=2, backoff=None):
+        """
+        Constructor.
+
+        *poolSize* is the number of connections kept open to each host.
+
+        *timeout* is the number of seconds to wait for the server before
+        giving up on a request.
+
+        *retries* is the number of times to retry a failed request.
+
+        *backoff* is the Backoff choosing the wait before each retry.  It
+        defaults to up to 2, then 4, ... seconds, but no more than 30.
+        """
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff or Backoff(2.0, 30.0)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Accept-Encoding' : 'gzip, deflate',
+                                     'Connection'      : 'keep-alive'})
+
+        # (url, params) -> (etag, last-modified) from the last response
+        self.validators = {}
+        self.lock = threading.Lock()
+
+        self.stats = {'requests'         : 0,
+                      'notModified'      : 0,
+                      'bytesTransferred' : 0,
+                      'bytesDecoded'     : 0,
+                      'retries'          : 0}
+
+    def get(self, url, params=None):
+        """
+        Makes a GET request, conditional on the validators of the last
+        response from the same url and params, if there were any.
+
+        Returns the response, or None if the server says it has not
+        changed.  Raises a requests.exceptions.RequestException if the
+        request fails or returns an error status, after any retries.
+        """
+        attempt = 0
+        while True:
+            try:
+                return self.request(url, params)
+            except requests.exceptions.RequestException, e:
+                if attempt >= self.retries or not isRetryable(e):
+                    raise
+            time.sleep(self.backoff.delay(attempt))
+            attempt += 1
+            self.count(retries=1)
+
+    def request(self, url, params):
+        """
+        Makes a single attempt at get().
+        """
+        key = (url, tuple(sorted((params or {}).items())))
+        etag, lastModified = self.validators.get(key, (None, None))
+
+        headers = {}
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        if lastModified is not None:
+            headers['If-Modified-Since'] = lastModified
+
+        r = self.session.get(url, params=params, headers=headers,
+                             timeout=self.timeout)
+
+        if r.status_code == 304:
+            self.count(requests=1, notModified=1)
+            return None
+        self.count(requests=1)
+        r.raise_for_status()
+
+        # urllib3 knows how many bytes came over the wire before decoding
+        decoded = len(r.content)
+        try:
+            transferred = r.raw.tell()
+        except AttributeError:
+            transferred = 0
+        if not transferred:
+            transferred = int(r.headers.get('Content-Length', decoded))
+        self.count(bytesTransferred=transferred, bytesDecoded=decoded)
+
+        self.validators[key] = (r.headers.get('ETag'),
+                                r.headers.get('Last-Modified'))
+        return r
+
+    def count(self, **increments):
+        """
+        Adds to the running totals in *stats*.
+        """
+        with self.lock:
+            for key, value in increments.iteritems():
+                self.stats[key] += value
+
+    def close(self):
+        """
+        Closes all pooled connections.
+        """
+        self.session.close()
+
+
+def isRetryable(e):
+    """
+    Returns True if the RequestException *e* is worth retrying.
+    """
+    if isinstance(e, (requests.exceptions.ConnectionError,
+                      requests.exceptions.Timeout)):
+        return True
+    if isinstance(e, requests.exceptions.HTTPError) and e.response is not None:
+        return e.response.status_code in RETRY_STATUS
+    return False
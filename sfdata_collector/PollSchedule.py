@@ -0,0 +1,238 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import collections
+
+# seconds to wait after a poll that finds nothing new, doubled after each
+# one in a row, up to MAX_SECONDS, so that a night with no refreshes
+# costs few requests
+RETRY_SECONDS = 5.0
+MAX_SECONDS = 300.0
+
+# the number of recent gaps between refreshes the cadence is the median of
+REFRESH_HISTORY = 31
+
+# the share of the polls aimed at a refresh that should find it there.
+# The rest are too early, and cost a retry
+TARGET_QUANTILE = 0.9
+
+# the share of the cadence the delay moves by after each aimed poll,
+# split between the polls that find the refresh and those too early
+STEP_FRACTION = 1 / 12.0
+
+# refreshes after one that doesn't come that are still aimed at, in case
+# the upstream only skipped one, before just backing off
+SKIPPED_REFRESHES = 3
+
+
+class PollSchedule(object):
+    """
+    Learns when an upstream service refreshes its data, from the upstream
+    timestamps of what each poll finds, and if *adaptive*, chooses when
+    to poll next, so that each refresh is fetched soon after it appears,
+    without polling in between.
+
+    The cadence is the median gap between the timestamps of the recent
+    refreshes.  The delay is the time from a refresh's timestamp to when
+    it can be fetched, by this computer's clock, so it takes in both the
+    time the upstream takes to publish and any difference between the
+    clocks.  A poll is aimed at the timestamp of the next refresh plus
+    the delay.
+
+    The delay is tracked as the TARGET_QUANTILE quantile of the actual
+    delays: an aimed poll that finds the refresh, or a later one, moves it
+    a little earlier, and one that is too early, finding nothing new or
+    only the refresh before, moves it later, by more, so that
+    in the long run that share of aimed polls find their refresh first
+    time.  It starts from the largest delay a refresh is known to have
+    had, once the cadence is known, which is too early rather than too
+    late, since it rises faster than it falls.
+
+    Only the cadence is learned if not adaptive, since the delay is
+    learned from the aimed polls.  Neither can be learned for a cadence
+    shorter than the period, since the polls before the cadence is known
+    see only some of the refreshes.
+
+    A poll that finds nothing new is retried after RETRY_SECONDS, then
+    twice as long each time, up to MAX_SECONDS, except that the next few
+    refreshes due are still aimed at, if they come sooner.
+
+    Whether adaptive or not, *stats* counts:
+        fetches  - polls made
+        fresh    - polls that found new data
+        wasted   - polls that found nothing new, or failed
+        missed   - refreshes never seen, because more than one came
+                   between two polls, estimated from the gaps in the
+                   timestamps
+        lastLag, totalLag, maxLag - seconds from the timestamp of new
+                   data to the start of the poll that found it
+    """
+
+    def __init__(self, period, adaptive=False, retrySeconds=RETRY_SECONDS,
+                 maxSeconds=MAX_SECONDS):
+        """
+        Constructor.
+
+        *period* is the fixed seconds between polls, used until the
+        cadence is known, and always if not *adaptive*.
+        """
+        self.period = period
+        self.adaptive = adaptive
+        self.retrySeconds = retrySeconds
+        self.maxSeconds = maxSeconds
+
+        # the gaps between recent refreshes, and their median, and the
+        # delay, in seconds, or None until known
+        self.gaps = collections.deque(maxlen=REFRESH_HISTORY)
+        self.cadence = None
+        self.delay = None
+
+        # unix times of the newest timestamp seen, and of the last poll
+        self.lastDataTime = None
+        self.lastFetchTime = None
+
+        # polls in a row that found nothing new
+        self.staleInRow = 0
+
+        # the timestamp of the refresh the next poll is aimed at, and of
+        # the one an aimed poll was too early for, if it is still to come
+        self.aimedAt = None
+        self.earlyFor = None
+
+        self.stats = {'fetches'  : 0,
+                      'fresh'    : 0,
+                      'wasted'   : 0,
+                      'missed'   : 0,
+                      'lastLag'  : None,
+                      'totalLag' : 0.0,
+                      'maxLag'   : 0.0}
+
+    def observe(self, fetchTime, fresh, dataTime=None):
+        """
+        Records a poll that started at the unix time *fetchTime*.  *fresh*
+        is whether it found new data, and *dataTime* the upstream
+        timestamp of the data, as a unix time, or None if there is none.
+        """
+        stats = self.stats
+        stats['fetches'] += 1
+        aimedAt, self.aimedAt = self.aimedAt, None
+        lastFetchTime, self.lastFetchTime = self.lastFetchTime, fetchTime
+
+        if not fresh:
+            stats['wasted'] += 1
+            self.staleInRow += 1
+            if aimedAt is not None:
+                self.earlyFor = aimedAt
+            return
+
+        stats['fresh'] += 1
+        self.staleInRow = 0
+        if dataTime is None:
+            return
+
+        lag = fetchTime - dataTime
+        stats['lastLag'] = lag
+        stats['totalLag'] += lag
+        stats['maxLag'] = max(stats['maxLag'], lag)
+
+        if self.lastDataTime is not None and dataTime > self.lastDataTime:
+            gap = dataTime - self.lastDataTime
+            if self.cadence is not None:
+                # more than one refresh can only have come between two
+                # polls in a row if they were far enough apart
+                skipped = min(int(round(gap / self.cadence)) - 1,
+                              int((fetchTime - lastFetchTime) / self.cadence))
+                stats['missed'] += max(skipped, 0)
+            self.gaps.append(gap)
+            self.cadence = median(self.gaps)
+
+        if self.adaptive:
+            self.learnDelay(dataTime, lag, lastFetchTime, aimedAt)
+        self.earlyFor = None
+        self.lastDataTime = max(dataTime, self.lastDataTime)
+
+    def learnDelay(self, dataTime, lag, lastFetchTime, aimedAt):
+        """
+        Updates the delay from a poll that found new data with the
+        timestamp *dataTime*, *lag* seconds old, after the poll at
+        *lastFetchTime* didn't, and was aimed at the refresh of *aimedAt*,
+        or None.
+        """
+        step = self.cadence * STEP_FRACTION if self.cadence is not None else 0.0
+        if self.delay is None:
+            # the last poll didn't find it, so it took at least this long,
+            # and the next refresh wasn't there yet, or this would have
+            # found that one
+            if self.cadence is not None:
+                self.delay = max(lastFetchTime - dataTime, lag - self.cadence)
+        elif aimedAt is not None and dataTime < aimedAt - self.cadence / 2.0:
+            # found one before the refresh aimed at, which wasn't there yet
+            self.delay += step * TARGET_QUANTILE
+        elif aimedAt is not None:
+            self.delay -= step * (1 - TARGET_QUANTILE)
+        elif self.earlyFor is not None and self.isSameRefresh(dataTime, self.earlyFor):
+            self.delay += step * TARGET_QUANTILE
+
+    def nextTime(self, now):
+        """
+        Returns the unix time of the next poll, after the one just
+        observed, or None to poll every period, as when not adaptive or
+        before enough has been learned.
+        """
+        if not self.adaptive or self.cadence is None or self.delay is None:
+            return None
+
+        if self.staleInRow == 0:
+            wait = self.maxSeconds
+        else:
+            wait = min(self.maxSeconds,
+                       self.retrySeconds * 2 ** (self.staleInRow - 1))
+
+        # the first refresh due after now
+        refreshes = int((now - self.delay - self.lastDataTime) / self.cadence) + 1
+        if refreshes <= SKIPPED_REFRESHES:
+            expected = self.lastDataTime + refreshes * self.cadence
+            if expected + self.delay - now <= wait:
+                self.aimedAt = expected
+                return expected + self.delay
+        return now + wait
+
+    def isSameRefresh(self, dataTime, expected):
+        """
+        Returns True if the timestamp *dataTime* is that of the refresh
+        expected at *expected*, to within half the cadence.
+        """
+        return abs(dataTime - expected) < self.cadence / 2.0
+
+    def meanLag(self):
+        if self.stats['fresh'] == 0:
+            return 0.0
+        return self.stats['totalLag'] / self.stats['fresh']
+
+
+def median(values):
+    """
+    Returns the median of a non-empty sequence of numbers.
+    """
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2 == 1:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
@@ -0,0 +1,91 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import gc
+import sys
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def getRss():
+    """
+    Returns the resident set size of this process, in bytes, or None if
+    it can't be found on this platform.
+    """
+    # Linux
+    if os.path.exists('/proc/self/statm'):
+        f = open('/proc/self/statm', 'r')
+        try:
+            pages = int(f.read().split()[1])
+        finally:
+            f.close()
+        return pages * resource.getpagesize()
+
+    # Windows
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD),
+                        ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t),
+                        ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t),
+                        ('PeakPagefileUsage', ctypes.c_size_t)]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        if ctypes.windll.psapi.GetProcessMemoryInfo(
+                ctypes.windll.kernel32.GetCurrentProcess(),
+                ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+        return None
+
+    # elsewhere, only the peak is available, in kilobytes, or bytes on a Mac
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    return None
+
+
+def countObjects():
+    """
+    Returns the number of objects tracked by the garbage collector,
+    which are the containers and class instances in the process.  A
+    count that keeps rising from one cycle to the next is a leak.
+    """
+    return len(gc.get_objects())
+
+
+def formatBytes(n):
+    """
+    Formats a number of bytes, or None, in megabytes, for reports.
+    """
+    if n is None:
+        return 'unknown'
+    return '%.1f MB' % (n / 1048576.0)
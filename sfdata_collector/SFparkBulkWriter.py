@@ -0,0 +1,225 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import datetime
+from cStringIO import StringIO
+from sets import Set
+
+from sqlalchemy import select, bindparam
+
+# the ways we know how to write a list of rows.
+#   orm  - one ORM object per row, added to the session (slowest)
+#   core - a single INSERT statement through SQLAlchemy Core, executed
+#          once for the whole list of rows
+#   copy - PostgreSQL COPY FROM STDIN (fastest, psycopg2 only)
+#   bulk - pick the fastest of core/copy that the database supports
+WRITE_MODES = ('orm', 'bulk', 'core', 'copy')
+
+# number of keys in each SELECT ... WHERE id IN (...), for upserts without
+# ON CONFLICT
+KEY_CHUNK = 500
+
+
+def resolveWriteMode(session, writeMode):
+    """
+    Translates the 'bulk' write mode into the specific method to use
+    for the database the session is bound to.  COPY is only available
+    on PostgreSQL through psycopg2.  Other modes are returned unchanged.
+    """
+    if writeMode != 'bulk':
+        return writeMode
+
+    dialect = session.get_bind().dialect
+    if dialect.name == 'postgresql' and dialect.driver == 'psycopg2':
+        return 'copy'
+    else:
+        return 'core'
+
+
+def insertRows(session, model, rows, writeMode='bulk'):
+    """
+    Writes a list of row dictionaries to the table for *model* within the
+    current transaction of *session*, without building ORM objects.
+    The caller is responsible for committing.
+
+    *model* is one of the mapped classes from SFparkDataModels.
+
+    *rows* is a list of dictionaries, all with the same keys, as
+    returned by the toRow() methods of the models.
+
+    *writeMode* is 'core', 'copy' or 'bulk'.
+
+    Returns the number of rows written.
+    """
+    if len(rows)==0:
+        return 0
+
+    writeMode = resolveWriteMode(session, writeMode)
+    table = model.__table__
+
+    if writeMode == 'copy':
+        copyRows(session, table, rows)
+    elif writeMode == 'core':
+        coreInsertRows(session, table, rows)
+    else:
+        raise ValueError("Unknown bulk write mode: %s" % writeMode)
+
+    return len(rows)
+
+
+def upsertRows(session, model, rows):
+    """
+    Writes a list of row dictionaries to the table for *model*, inserting
+    new rows and updating those whose primary key is already there, within
+    the current transaction of *session*.  The caller is responsible for
+    committing.
+
+    Uses a single INSERT ... ON CONFLICT DO UPDATE on PostgreSQL, and on
+    SQLite 3.24 or later, if the installed SQLAlchemy supports it.  
+    Otherwise, falls back to genericUpsertRows().
+
+    Returns the number of rows written.
+    """
+    if len(rows)==0:
+        return 0
+
+    table = model.__table__
+
+    # ON CONFLICT can't update the same row twice in one statement, so
+    # keep only the last row for each key
+    keys = [c.name for c in table.primary_key.columns]
+    rows = dict([(tuple([row[k] for k in keys]), row) for row in rows]).values()
+
+    statement = makeOnConflictUpsert(session, table)
+    if statement is not None:
+        session.execute(statement, rows)
+    else:
+        genericUpsertRows(session, table, rows)
+    return len(rows)
+
+
+def makeOnConflictUpsert(session, table):
+    """
+    Returns an INSERT ... ON CONFLICT DO UPDATE statement for *table*,
+    which replaces every column but the primary key, or None if the 
+    database or the installed SQLAlchemy doesn't support one.
+    """
+    dialect = session.get_bind().dialect
+    try:
+        if dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        elif (dialect.name == 'sqlite' and 
+              dialect.dbapi.sqlite_version_info >= (3, 24, 0)):
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            return None
+    except ImportError:
+        return None
+
+    keys = [c.name for c in table.primary_key.columns]
+    statement = insert(table)
+    updates = dict([(c.name, statement.excluded[c.name]) 
+                    for c in table.columns if c.name not in keys])
+    return statement.on_conflict_do_update(index_elements=keys, set_=updates)
+
+
+def genericUpsertRows(session, table, rows):
+    """
+    Upserts on any database, by looking up which of the keys already
+    exist, then updating those rows and inserting the rest, each as a 
+    single executemany.  Only for tables with a single primary key column.
+    Unlike ON CONFLICT, this can fail with an IntegrityError if another
+    connection inserts the same key at the same time.
+    """
+    key = list(table.primary_key.columns)[0]
+    ids = [row[key.name] for row in rows]
+
+    existing = Set()
+    for i in range(0, len(ids), KEY_CHUNK):
+        for (id,) in session.execute(select([key]).where(key.in_(ids[i:i+KEY_CHUNK]))):
+            existing.add(id)
+
+    updates = []
+    inserts = []
+    for row in rows:
+        if row[key.name] in existing:
+            # the key goes in a parameter of its own, for the WHERE clause
+            row = dict(row)
+            row['_key'] = row.pop(key.name)
+            updates.append(row)
+        else:
+            inserts.append(row)
+
+    if len(updates) > 0:
+        session.execute(table.update().where(key == bindparam('_key')), updates)
+    if len(inserts) > 0:
+        coreInsertRows(session, table, inserts)
+
+
+def coreInsertRows(session, table, rows):
+    """
+    Inserts the rows with a single Core INSERT statement, passing the whole 
+    list as parameters.  The statement is compiled once, and the driver 
+    sends it as an executemany (psycopg2 batches these into multi-row 
+    VALUES clauses).  This is much cheaper than building an INSERT with 
+    thousands of literal VALUES, which spends most of its time compiling. 
+    """
+    session.execute(table.insert(), rows)
+
+
+def copyRows(session, table, rows):
+    """
+    Streams the rows to PostgreSQL using COPY FROM STDIN in text format,
+    on the connection that the session is currently using, so the rows
+    are part of the same transaction as everything else.
+    """
+    columns = [c.name for c in table.columns if c.name in rows[0]]
+
+    buf = StringIO()
+    for row in rows:
+        buf.write('\t'.join([copyValue(row[c]) for c in columns]))
+        buf.write('\n')
+    buf.seek(0)
+
+    sql = 'COPY %s (%s) FROM STDIN' % (table.name, ', '.join(columns))
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(sql, buf)
+    finally:
+        cursor.close()
+
+
+def copyValue(value):
+    """
+    Formats a single value for the PostgreSQL COPY text format.
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    elif isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    elif isinstance(value, float):
+        return repr(value)
+    else:
+        value = str(value)
+    return (value.replace('\\', '\\\\')
+                 .replace('\t', '\\t')
+                 .replace('\n', '\\n')
+                 .replace('\r', '\\r'))
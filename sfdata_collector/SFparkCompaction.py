@@ -0,0 +1,440 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import time
+import datetime
+
+from sqlalchemy import text, bindparam, inspect, MetaData, Table, Column
+from sqlalchemy.types import BigInteger, Integer, DateTime
+
+from SFparkDataModels import SFparkLocationRecord
+from SFparkPartitions import (AvailabilityPartitions, TABLE, COLUMNS,
+                              listPartitions, partitionName)
+from SFparkBulkWriter import KEY_CHUNK
+
+# locations read and compacted at a time, within a day
+CHUNK_LOCATIONS = 200
+
+# by default, a row is kept for each location at least this often, even if
+# it hasn't changed, so the table reads like one collected in delta mode
+# with the default keyframe interval
+KEYFRAME_MINUTES = 60
+
+# the index the chunks are read by, which each partition already has
+INDEX = '%s_loc_time' % TABLE
+
+COMPACTION_CHECKPOINT_VERSION = 1
+
+
+class AvailabilityCompactor(object):
+    """
+    Removes the redundant rows from the history in sfpark_avl, offline:
+
+        duplicates - a second row for the same (loc_id,
+                     availability_updated_timestamp), as when a snapshot
+                     was stored twice
+        repeats    - a row with the same (occ, oper) as the row before it
+                     for the same location, unless the last row kept is
+                     *keyframeMinutes* old
+
+    What is left is what the collector stores in delta mode, so it is
+    read the same way, with SFparkQueries.getAvailabilitySeries() or
+    SFparkRollups.readSnapshots() and a keyframe interval of
+    *keyframeMinutes*.
+
+    The table is walked one day at a time, and within each day, in chunks
+    of *chunkLocations* locations, each read in (loc_id, time) order
+    through the (loc_id, availability_updated_timestamp) index, and
+    compacted and committed in a transaction of its own, so no lock is
+    held for long.  The removed rows are deleted, or moved to the table
+    *moveTo*, with their ids, so they can be put back.
+
+    Each chunk starts after the last loc_id done, and runs to the
+    *chunkLocations*'th location in sfpark_loc after that, or to the end
+    of the day for the last chunk, so the chunks don't depend on which
+    locations there were when the run started.  After each chunk, the
+    position, (date_id, last loc_id done), and the last row seen for 
+    each location are saved to the *checkpoint* file, so a run that is
+    stopped carries on with the rows where loc_id > the last done, 
+    whatever locations have been added since.  Doing a chunk twice 
+    changes nothing, so stopping between the commit and the save is
+    harmless.
+
+    *rowsPerSecond* limits how fast rows are read, by sleeping between
+    chunks, so the job doesn't starve a collector writing at the same
+    time.
+    """
+
+    def __init__(self, keyframeMinutes=KEYFRAME_MINUTES, moveTo=None,
+                 checkpoint=None, chunkLocations=CHUNK_LOCATIONS,
+                 rowsPerSecond=None):
+        """
+        Constructor.  *keyframeMinutes* can be None to remove every
+        repeat, however old the last row kept.
+        """
+        self.keyframe = None
+        if keyframeMinutes is not None:
+            self.keyframe = datetime.timedelta(minutes=keyframeMinutes)
+        self.keyframeMinutes = keyframeMinutes
+        self.moveTo = moveTo
+        self.checkpoint = checkpoint
+        self.chunkLocations = chunkLocations
+        self.rowsPerSecond = rowsPerSecond
+
+        # loc_id -> [time of the last row, occ, oper, time of the last row
+        # kept] for each location seen so far
+        self.state = {}
+
+        # the (date_id, last loc_id done) of the last chunk, so that every
+        # row of that day up to and including that loc_id is done
+        self.position = None
+
+        self.totals = {'scanned'    : 0,
+                       'duplicates' : 0,
+                       'repeats'    : 0}
+
+    def run(self, session, startDate, endDate, report=None):
+        """
+        Compacts each day from the date ids *startDate* to *endDate*,
+        inclusive, carrying on from the checkpoint if there is one.
+
+        *report* is called after each day with (date_id, rows scanned,
+        duplicates removed, repeats removed) for that day.
+
+        Returns the totals, a dictionary of rows scanned, duplicates
+        and repeats.
+        """
+        self.loadCheckpoint()
+
+        partitions = AvailabilityPartitions()
+        partitions.detect(session)
+        sqlitePartitions = (partitions.partitioned and
+                            session.get_bind().dialect.name == 'sqlite')
+        if not partitions.partitioned:
+            ensureIndex(session)
+        if self.moveTo is not None:
+            createMoveTable(session, self.moveTo)
+
+        day = dateFromId(startDate)
+        end = dateFromId(endDate)
+        while day <= end:
+            date_id = 10000*day.year + 100*day.month + day.day
+            day += datetime.timedelta(days=1)
+            if self.position is not None and date_id < self.position[0]:
+                continue
+            if sqlitePartitions:
+                if date_id // 100 not in partitions.months:
+                    continue
+                table = partitionName(date_id // 100)
+            else:
+                table = TABLE
+
+            afterLoc = None
+            if self.position is not None and date_id == self.position[0]:
+                afterLoc = self.position[1]
+
+            counts = {'scanned' : 0, 'duplicates' : 0, 'repeats' : 0}
+            while True:
+                lastLoc = self.getChunkEnd(session, afterLoc)
+
+                startTime = time.time()
+                scanned, lastDone = self.compactChunk(session, table, date_id, afterLoc,
+                                                      lastLoc, counts)
+                session.commit()
+                if lastLoc is not None:
+                    lastDone = lastLoc
+                elif lastDone is None:
+                    lastDone = afterLoc
+                self.position = (date_id, lastDone)
+                self.saveCheckpoint()
+
+                if self.rowsPerSecond:
+                    wait = scanned / float(self.rowsPerSecond) - (time.time() - startTime)
+                    if wait > 0:
+                        time.sleep(wait)
+
+                if lastLoc is None:
+                    break
+                afterLoc = lastLoc
+
+            for key, count in counts.iteritems():
+                self.totals[key] += count
+            if report is not None:
+                report(date_id, counts['scanned'], counts['duplicates'], counts['repeats'])
+
+        return self.totals
+
+    def getChunkEnd(self, session, afterLoc):
+        """
+        Returns the last loc_id of the chunk that follows *afterLoc*, or
+        starts at the beginning if it is None: the *chunkLocations*'th 
+        location in sfpark_loc after it, or None if there are no more 
+        than that, so the chunk runs to the end. 
+        """
+        query = session.query(SFparkLocationRecord.id)
+        if afterLoc is not None:
+            query = query.filter(SFparkLocationRecord.id > afterLoc)
+        found = query.order_by(SFparkLocationRecord.id) \
+                     .offset(self.chunkLocations - 1).limit(1).first()
+        if found is None:
+            return None
+        return found[0]
+
+    def compactChunk(self, session, table, date_id, afterLoc, lastLoc, counts):
+        """
+        Compacts the rows of one day, *date_id*, in *table*, for the
+        locations after *afterLoc* up to and including *lastLoc*, either
+        of which can be None for no bound, within the current 
+        transaction, and adds what was done to *counts*.  Returns the 
+        number of rows read, and the last loc_id read, or None if there
+        were none.
+        """
+        midnight = datetime.datetime.combine(dateFromId(date_id), datetime.time())
+        params = {'start' : midnight,
+                  'end' : midnight + datetime.timedelta(days=1),
+                  'date_id' : date_id}
+        bounds = ''
+        if afterLoc is not None:
+            bounds += "loc_id > :after AND "
+            params['after'] = afterLoc
+        if lastLoc is not None:
+            bounds += "loc_id <= :last AND "
+            params['last'] = lastLoc
+
+        # the times are typed, so they are compared in the form they
+        # are stored in on SQLite
+        query = text(
+            "SELECT id, loc_id, availability_updated_timestamp, occ, oper "
+            "FROM %s WHERE %savailability_updated_timestamp >= :start "
+            "AND availability_updated_timestamp < :end AND date_id = :date_id "
+            "ORDER BY loc_id, availability_updated_timestamp, id" % (table, bounds)
+            ).bindparams(bindparam('start', type_=DateTime),
+                         bindparam('end', type_=DateTime)
+            ).columns(availability_updated_timestamp=DateTime)
+        rows = session.execute(query, params).fetchall()
+
+        state = self.state
+        keyframe = self.keyframe
+        removed = []
+        for id, loc_id, timestamp, occ, oper in rows:
+            last = state.get(loc_id)
+            if last is None:
+                state[loc_id] = [timestamp, occ, oper, timestamp]
+            elif timestamp == last[0]:
+                removed.append(id)
+                counts['duplicates'] += 1
+            elif occ == last[1] and oper == last[2] and (keyframe is None or
+                                                         timestamp - last[3] < keyframe):
+                removed.append(id)
+                counts['repeats'] += 1
+                last[0] = timestamp
+            else:
+                state[loc_id] = [timestamp, occ, oper, timestamp]
+        counts['scanned'] += len(rows)
+
+        # date_id picks the partition on PostgreSQL
+        for i in range(0, len(removed), KEY_CHUNK):
+            where = "date_id = %i AND id IN (%s)" % (date_id, ','.join(
+                [str(id) for id in removed[i:i+KEY_CHUNK]]))
+            if self.moveTo is not None:
+                session.execute(text("INSERT INTO %s (id, %s) SELECT id, %s FROM %s "
+                                     "WHERE %s" % (self.moveTo, ', '.join(COLUMNS),
+                                                   ', '.join(COLUMNS), table, where)))
+            session.execute(text("DELETE FROM %s WHERE %s" % (table, where)))
+
+        if not rows:
+            return 0, None
+        return len(rows), rows[-1][1]
+
+    def loadCheckpoint(self):
+        """
+        Picks up where the last run left off, if there is a checkpoint.
+        Raises a ValueError if it was made with a different keyframe
+        interval, which would leave the table compacted two ways.
+        """
+        if self.checkpoint is None or not os.path.exists(self.checkpoint):
+            return
+
+        f = open(self.checkpoint, 'r')
+        try:
+            checkpoint = json.load(f)
+        finally:
+            f.close()
+        if checkpoint.get('version') != COMPACTION_CHECKPOINT_VERSION:
+            raise ValueError("%s is from a different version" % self.checkpoint)
+        if checkpoint['keyframeMinutes'] != self.keyframeMinutes:
+            raise ValueError("%s was made with a keyframe of %s minutes.  Use the "
+                             "same, or delete it to start over" %
+                             (self.checkpoint, checkpoint['keyframeMinutes']))
+
+        self.position = tuple(checkpoint['position'])
+        self.state = dict([(int(loc_id), [parseTimestamp(last), occ, oper,
+                                          parseTimestamp(kept)])
+                           for loc_id, (last, occ, oper, kept)
+                           in checkpoint['state'].iteritems()])
+
+    def saveCheckpoint(self):
+        """
+        Writes the position and state to the checkpoint file, replacing
+        it whole.
+        """
+        if self.checkpoint is None:
+            return
+
+        tempPath = self.checkpoint + '.tmp'
+        f = open(tempPath, 'w')
+        try:
+            json.dump({'version'         : COMPACTION_CHECKPOINT_VERSION,
+                       'keyframeMinutes' : self.keyframeMinutes,
+                       'position'        : self.position,
+                       'state'           : dict([(loc_id, [last.isoformat(), occ, oper,
+                                                           kept.isoformat()])
+                                                 for loc_id, (last, occ, oper, kept)
+                                                 in self.state.iteritems()])},
+                      f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+
+        # Windows won't rename over an existing file
+        try:
+            os.rename(tempPath, self.checkpoint)
+        except OSError:
+            os.remove(self.checkpoint)
+            os.rename(tempPath, self.checkpoint)
+
+
+def ensureIndex(session):
+    """
+    Creates the (loc_id, availability_updated_timestamp) index on an
+    unpartitioned sfpark_avl, if it doesn't have one, so the chunks can
+    be read without scanning the table.  This takes a while on a big
+    table, but only once.
+
+    On PostgreSQL, the index is built with CREATE INDEX CONCURRENTLY, 
+    outside of any transaction, so the collector can carry on inserting
+    while it is built.  If that fails, it leaves an invalid index, which
+    is dropped, so the next run starts over.  Elsewhere, a plain CREATE
+    INDEX holds up writes to the table until it is done, so create the 
+    index before starting the collector, or stop the collector first.
+    """
+    engine = session.get_bind()
+    indexes = inspect(engine).get_indexes(TABLE)
+    for index in indexes:
+        if list(index['column_names'][:2]) == ['loc_id', 'availability_updated_timestamp']:
+            return
+    print "Creating index %s..." % INDEX
+    session.commit()
+
+    if engine.dialect.name != 'postgresql':
+        session.execute(text("CREATE INDEX %s ON %s (loc_id, availability_updated_timestamp)"
+                             % (INDEX, TABLE)))
+        session.commit()
+        return
+
+    connection = engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+    try:
+        try:
+            connection.execute(text("CREATE INDEX CONCURRENTLY %s ON %s "
+                                    "(loc_id, availability_updated_timestamp)"
+                                    % (INDEX, TABLE)))
+        except Exception:
+            connection.execute(text("DROP INDEX CONCURRENTLY IF EXISTS %s" % INDEX))
+            raise
+    finally:
+        connection.close()
+
+
+def createMoveTable(session, name):
+    """
+    Creates the table *name*, with the columns of sfpark_avl, to move
+    removed rows to, if it isn't there.
+    """
+    table = Table(name, MetaData(),
+                  Column('id', BigInteger, primary_key=True, autoincrement=False),
+                  Column('loc_id', BigInteger),
+                  Column('date_id', Integer),
+                  Column('availability_updated_timestamp', DateTime),
+                  Column('occ', Integer),
+                  Column('oper', Integer))
+    table.create(session.get_bind(), checkfirst=True)
+
+
+def getTableBytes(session):
+    """
+    Returns the bytes taken by sfpark_avl, its partitions and their
+    indexes, and the number of rows they hold, or (None, None) if the
+    database can't say.  On PostgreSQL the row count is the planner's
+    estimate, so this is quick on any size of table.
+    """
+    dialect = session.get_bind().dialect.name
+    names = [TABLE] + [partitionName(month) for month in listPartitions(session)]
+
+    if dialect == 'postgresql':
+        numBytes = 0
+        numRows = 0
+        for name in names:
+            size, rows = session.execute(text(
+                "SELECT pg_total_relation_size(oid), reltuples FROM pg_class "
+                "WHERE relname = :name AND pg_table_is_visible(oid)"),
+                {'name' : name}).first()
+            numBytes += size
+            numRows += max(rows, 0)
+        return numBytes, int(numRows)
+
+    elif dialect == 'sqlite':
+        try:
+            numBytes = 0
+            numRows = 0
+            for name in names:
+                if session.execute(text("SELECT type FROM sqlite_master WHERE name = :name"),
+                                   {'name' : name}).scalar() != 'table':
+                    continue
+                numBytes += session.execute(text(
+                    "SELECT sum(pgsize) FROM dbstat WHERE name = :name OR name IN "
+                    "(SELECT name FROM sqlite_master WHERE type = 'index' "
+                    "AND tbl_name = :name)"), {'name' : name}).scalar() or 0
+                numRows += session.execute(text("SELECT count(*) FROM %s" % name)).scalar()
+            return numBytes, numRows
+        except Exception:
+            # built without the dbstat table
+            session.rollback()
+            return None, None
+
+    return None, None
+
+
+def dateFromId(date_id):
+    """
+    Returns the datetime.date of a date id in the form YYYYMMDD.
+    """
+    return datetime.date(date_id // 10000, date_id // 100 % 100, date_id % 100)
+
+
+def parseTimestamp(string):
+    """
+    Parses a timestamp in ISO form, as saved in the checkpoint.
+    """
+    string = string.replace('T', ' ')
+    if '.' in string:
+        return datetime.datetime.strptime(string, '%Y-%m-%d %H:%M:%S.%f')
+    return datetime.datetime.strptime(string, '%Y-%m-%d %H:%M:%S')
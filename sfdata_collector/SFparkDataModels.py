@@ -21,13 +21,54 @@ __license__     = """
 import datetime
 
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, ForeignKey, Index
+from sqlalchemy.orm import relationship, configure_mappers
+from sqlalchemy.orm.attributes import manager_of_class
 from sqlalchemy.types import (BigInteger, Integer, Float, String, DateTime, 
                                 Time)
 
 Base = declarative_base()
 
+# time strings, such as '7:00 AM', already parsed.  There are only a few
+# dozen distinct values across all the rates and operating hours
+TIME_CACHE = {}
+
+def parseTime(string_time):
+    """
+    Converts a time string from the SFpark API, such as '7:00 AM', into
+    a datetime.time, remembering the result for the next time the same
+    string comes along.
+    """
+    try:
+        return TIME_CACHE[string_time]
+    except KeyError:
+        t = datetime.datetime.strptime(string_time, "%I:%M %p").time()
+        TIME_CACHE[string_time] = t
+        return t
+
+
+def recordsFromRows(model, rows):
+    """
+    Creates a list of ORM objects of class *model* directly from a list of
+    dictionaries of column values, as returned by its toRow() method,
+    without going through the constructor.
+    """
+    configure_mappers()
+    manager = manager_of_class(model)
+
+    records = []
+    for row in rows:
+        record = manager.new_instance()
+        for key, value in row.iteritems():
+            setattr(record, key, value)
+        records.append(record)
+    return records
+
+
+# SQLite only auto-increments a primary key declared as INTEGER, so
+# use that in place of BIGINT there
+BigIntegerKey = BigInteger().with_variant(Integer, 'sqlite')
+
 class SFparkLocationRecord(Base):
     """ 
     Maps the object representation of a single parking location (off-street 
@@ -115,28 +156,44 @@ class SFparkLocationRecord(Base):
                 
         """        
         
+        for key, value in self.toRow(loc_id, json).iteritems(): 
+            setattr(self, key, value)
+            
+    @staticmethod
+    def toRow(loc_id, json):
+        """
+        Returns the column values for a location as a dictionary, without 
+        creating an ORM object.  Takes the same arguments as the constructor, 
+        and is used for bulk inserts.
+        """
+        
         # the data attributes
-        self.id = loc_id
-        if "TYPE"  in json: self.parktype      = json["TYPE"]           
-        if "NAME"  in json: self.name          = json["NAME"]    
-        if "DESC"  in json: self.descr         = json["DESC"]                
-        if "INTER" in json: self.inter         = json["INTER"]                
-        if "TEL"   in json: self.tel           = json["TEL"]                
-        if "OSPID" in json: self.ospid         = int(json["OSPID"])                
-        if "BFID"  in json: self.bfid          = int(json["BFID"])                
-        if "PTS"   in json: self.pts           = int(json["PTS"])                    
+        row = dict.fromkeys(('parktype', 'name', 'descr', 'inter', 'tel', 
+                             'ospid', 'bfid', 'pts', 
+                             'lat1', 'lon1', 'lat2', 'lon2'))
+        row['id'] = loc_id
+        if "TYPE"  in json: row['parktype']    = json["TYPE"]           
+        if "NAME"  in json: row['name']        = json["NAME"]    
+        if "DESC"  in json: row['descr']       = json["DESC"]                
+        if "INTER" in json: row['inter']       = json["INTER"]                
+        if "TEL"   in json: row['tel']         = json["TEL"]                
+        if "OSPID" in json: row['ospid']       = int(json["OSPID"])                
+        if "BFID"  in json: row['bfid']        = int(json["BFID"])                
+        if "PTS"   in json: row['pts']         = int(json["PTS"])                    
                 
         # This is in the order specified by the SFpark API
         if "LOC" in json:
             loc = json["LOC"].split(',')
-            if self.pts==1:
-                self.lat1 = float(loc[1])
-                self.lon1 = float(loc[0])
-            elif self.pts==2:  
-                self.lat1 = float(loc[1])
-                self.lon1 = float(loc[0])
-                self.lat2 = float(loc[3])
-                self.lon2 = float(loc[2])
+            if row['pts']==1:
+                row['lat1'] = float(loc[1])
+                row['lon1'] = float(loc[0])
+            elif row['pts']==2:  
+                row['lat1'] = float(loc[1])
+                row['lon1'] = float(loc[0])
+                row['lat2'] = float(loc[3])
+                row['lon2'] = float(loc[2])
+                
+        return row
                 
 
 class SFparkAvailabilityRecord(Base):
@@ -156,18 +213,20 @@ class SFparkAvailabilityRecord(Base):
 	occ   INTEGER,                             # Number of spaces currently occupied  
 	oper  INTEGER                              # Number of spaces currently operational for this location
     );
+    CREATE INDEX ix_sfpark_avl_date_id ON sfpark_avl (date_id);
     """
     
     __tablename__ = 'sfpark_avl'
     
     # Primary and unique ID
-    id = Column(BigInteger, primary_key=True, autoincrement=True)   
+    id = Column(BigIntegerKey, primary_key=True, autoincrement=True)   
 
     # links to ID in location table
     loc_id = Column(BigInteger, ForeignKey('sfpark_loc.id')) 
     
-    # date ID: integer in YYYYMMDD form
-    date_id = Column(Integer)
+    # date ID: integer in YYYYMMDD form, indexed so the newest rows can
+    # be found without reading the rest
+    date_id = Column(Integer, index=True)
     
     # The Timestamp of when the availability data response was updated for the request
     availability_updated_timestamp = Column(DateTime)   
@@ -194,11 +253,25 @@ class SFparkAvailabilityRecord(Base):
         
         """
         
-        self.loc_id = loc_id
-        self.date_id = date_id
-        self.availability_updated_timestamp    = updated_time     
-        if "OCC"   in json: self.occ           = int(json["OCC"])            
-        if "OPER"  in json: self.oper          = int(json["OPER"])                  
+        for key, value in self.toRow(loc_id, date_id, updated_time, json).iteritems(): 
+            setattr(self, key, value)
+            
+    @staticmethod
+    def toRow(loc_id, date_id, updated_time, json):
+        """
+        Returns the column values for an availability record as a dictionary, 
+        without creating an ORM object.  Takes the same arguments as the 
+        constructor, and is used for bulk inserts.
+        """
+        
+        row = {'loc_id'  : loc_id, 
+               'date_id' : date_id, 
+               'availability_updated_timestamp' : updated_time, 
+               'occ'     : None, 
+               'oper'    : None}
+        if "OCC"   in json: row['occ']         = int(json["OCC"])            
+        if "OPER"  in json: row['oper']        = int(json["OPER"])                  
+        return row
         
         
         
@@ -227,7 +300,7 @@ class SFparkRatesRecord(Base):
     __tablename__ = 'sfpark_rates'
     
     # Primary and unique ID
-    id = Column(BigInteger, primary_key=True, autoincrement=True)   
+    id = Column(BigIntegerKey, primary_key=True, autoincrement=True)   
 
     # links to ID in location table
     loc_id = Column(BigInteger, ForeignKey('sfpark_loc.id')) 
@@ -266,18 +339,27 @@ class SFparkRatesRecord(Base):
         record.        
         """
 
-        self.loc_id = loc_id
-        self.date_id = date_id
-        if "BEG"  in json:       
-            t = datetime.datetime.strptime(json["BEG"], "%I:%M %p")
-            self.begtime = t.time()
-        if "END"  in json: 
-            t = datetime.datetime.strptime(json["END"], "%I:%M %p")
-            self.endtime = t.time()
-        if "RATE" in json: self.rate  = float(json["RATE"])
-        if "DESC" in json: self.descr = json["DESC"]
-        if "RQ"   in json: self.rq    = json["RQ"]
-        if "RR"   in json: self.rr    = json["RR"]
+        for key, value in self.toRow(loc_id, date_id, json).iteritems(): 
+            setattr(self, key, value)
+            
+    @staticmethod
+    def toRow(loc_id, date_id, json):
+        """
+        Returns the column values for a rates record as a dictionary, 
+        without creating an ORM object.  Takes the same arguments as the 
+        constructor, and is used for bulk inserts.
+        """
+        
+        row = dict.fromkeys(('begtime', 'endtime', 'rate', 'descr', 'rq', 'rr'))
+        row['loc_id'] = loc_id
+        row['date_id'] = date_id
+        if "BEG"  in json: row['begtime']  = parseTime(json["BEG"])
+        if "END"  in json: row['endtime']  = parseTime(json["END"])
+        if "RATE" in json: row['rate']  = float(json["RATE"])
+        if "DESC" in json: row['descr'] = json["DESC"]
+        if "RQ"   in json: row['rq']    = json["RQ"]
+        if "RR"   in json: row['rr']    = json["RR"]
+        return row
         
         
 
@@ -304,7 +386,7 @@ class SFparkOphrsRecord(Base):
     __tablename__ = 'sfpark_ophrs'
     
     # Primary and unique ID
-    id = Column(BigInteger, primary_key=True, autoincrement=True)      
+    id = Column(BigIntegerKey, primary_key=True, autoincrement=True)      
 
     # links to ID in location table
     loc_id = Column(BigInteger, ForeignKey('sfpark_loc.id')) 
@@ -319,10 +401,10 @@ class SFparkOphrsRecord(Base):
     to_day = Column(String(16))
 
     # Indicates the begin time for this rate schedule
-    begtime = Column(DateTime)
+    begtime = Column(Time)
     
     # Indicates the end time for this rate schedule                            
-    endtime = Column(DateTime)
+    endtime = Column(Time)
 
     def __init__(self, loc_id, date_id, json):
         """
@@ -340,15 +422,349 @@ class SFparkOphrsRecord(Base):
         http://sfpark.org/resources/sfpark-availability-service-api-reference/
         """
         
-        self.loc_id = loc_id
-        self.date_id = date_id
-        if "FROM" in json: self.from_day = json["FROM"]
-        if "TO"   in json: self.to_day   = json["TO"]
-        if "BEG"  in json:       
-            t = datetime.datetime.strptime(json["BEG"], "%I:%M %p")
-            self.begtime = t.time()
-        if "END"  in json: 
-            t = datetime.datetime.strptime(json["END"], "%I:%M %p")
-            self.endtime = t.time()
-                
-        
\ No newline at end of file
+        for key, value in self.toRow(loc_id, date_id, json).iteritems(): 
+            setattr(self, key, value)
+            
+    @staticmethod
+    def toRow(loc_id, date_id, json):
+        """
+        Returns the column values for an operating hours record as a 
+        dictionary, without creating an ORM object.  Takes the same arguments
+        as the constructor, and is used for bulk inserts.
+        """
+        
+        row = dict.fromkeys(('from_day', 'to_day', 'begtime', 'endtime'))
+        row['loc_id'] = loc_id
+        row['date_id'] = date_id
+        if "FROM" in json: row['from_day'] = json["FROM"]
+        if "TO"   in json: row['to_day']   = json["TO"]
+        if "BEG"  in json: row['begtime']  = parseTime(json["BEG"])
+        if "END"  in json: row['endtime']  = parseTime(json["END"])
+        return row
+
+
+
+class SFparkRatesVersionRecord(Base):
+    """ 
+    A versioned copy of the rates, for use in place of sfpark_rates, which
+    holds a copy of every location's rates for every day.  Rates rarely
+    change, so here a location's rates are only written when they differ
+    from the last version stored, and each version records the range of
+    dates it applies to.  All the rows of one version share the same 
+    valid_from, valid_to and sched_hash.
+    
+    A corresponding database, named sfdata, should be available, and contain
+    a table with the following definition: 
+        
+    CREATE TABLE sfpark_rates_ver (
+	id BIGSERIAL NOT NULL PRIMARY KEY,         # Unique ID and primary index in this table
+	loc_id INT NOT NULL,                       # ID to link back to location table
+	valid_from INT NOT NULL,                   # first date ID, in form YYYYMMDD, this version was seen
+	valid_to   INT,                            # date ID when it was replaced, or NULL if still current
+	sched_hash CHAR(32),                       # hash of all the rates of this location in this version
+	begtime   TIME,                            # Indicates the begin time for this rate schedule
+	endtime   TIME,                            # Indicates the end time for this rate schedule 
+	rate      NUMERIC(8,2),                    # Applicable rate for this rate schedule
+	descr     VARCHAR(255),                    # Used for descriptive rate information when not possible to specify using BEG or END times for this rate schedule
+	rq        CHAR(16),                        # Rate qualifier for this rate schedule e.g. PerHr
+	rr        VARCHAR(255)                     # Rate restriction for this rate schedule if any
+    ); 
+    """
+    
+    __tablename__ = 'sfpark_rates_ver'
+    
+    # Primary and unique ID
+    id = Column(BigIntegerKey, primary_key=True, autoincrement=True)   
+
+    # links to ID in location table
+    loc_id = Column(BigInteger, ForeignKey('sfpark_loc.id'), index=True) 
+    
+    # first date ID, in YYYYMMDD form, that this version was seen
+    valid_from = Column(Integer)
+
+    # date ID when this version was replaced, or None if it is current
+    valid_to = Column(Integer)
+
+    # hash of all the rates of this location in this version
+    sched_hash = Column(String(32))
+        
+    # Indicates the begin time for this rate schedule
+    begtime = Column(Time)
+    
+    # Indicates the end time for this rate schedule                            
+    endtime = Column(Time)
+    
+    # Applicable rate for this rate schedule
+    rate = Column(Float)
+    
+    # Used for descriptive rate information when not possible to specify using BEG or END times for this rate schedule
+    descr = Column(String(255))
+    
+    # Rate qualifier for this rate schedule e.g. PerHr                   
+    rq = Column(String(16))
+
+    # Rate restriction for this rate schedule if any                        
+    rr = Column(String(255))                   
+
+    # the columns that make up the schedule itself
+    scheduleColumns = ('begtime', 'endtime', 'rate', 'descr', 'rq', 'rr')
+
+    # the table that holds a copy for every day
+    dailyModel = SFparkRatesRecord
+
+
+
+class SFparkOphrsVersionRecord(Base):
+    """ 
+    A versioned copy of the operating hours, for use in place of 
+    sfpark_ophrs, in the same way as SFparkRatesVersionRecord.
+    
+    A corresponding database, named sfdata, should be available, and contain
+    a table with the following definition: 
+        
+    CREATE TABLE sfpark_ophrs_ver (
+	id BIGSERIAL NOT NULL PRIMARY KEY,         # Unique ID and primary index in this table
+	loc_id INT NOT NULL,                       # ID to link back to location table
+	valid_from INT NOT NULL,                   # first date ID, in form YYYYMMDD, this version was seen
+	valid_to   INT,                            # date ID when it was replaced, or NULL if still current
+	sched_hash CHAR(32),                       # hash of all the operating hours of this location in this version
+	from_day  CHAR(16),                        # Start day for this schedule, e.g., Monday
+	to_day    CHAR(16),                        # End day for this schedule, e.g., Friday
+	begtime   TIME,                            # Indicates the begin time for this schedule
+	endtime   TIME                             # Indicates the end time for this schedule 
+    ); 
+    """
+    
+    __tablename__ = 'sfpark_ophrs_ver'
+    
+    # Primary and unique ID
+    id = Column(BigIntegerKey, primary_key=True, autoincrement=True)      
+
+    # links to ID in location table
+    loc_id = Column(BigInteger, ForeignKey('sfpark_loc.id'), index=True) 
+    
+    # first date ID, in YYYYMMDD form, that this version was seen
+    valid_from = Column(Integer)
+
+    # date ID when this version was replaced, or None if it is current
+    valid_to = Column(Integer)
+
+    # hash of all the operating hours of this location in this version
+    sched_hash = Column(String(32))
+    
+    # Start day for this schedule, e.g., Monday
+    from_day = Column(String(16))
+    
+    # End day for this schedule, e.g., Friday                           
+    to_day = Column(String(16))
+
+    # Indicates the begin time for this rate schedule
+    begtime = Column(Time)
+    
+    # Indicates the end time for this rate schedule                            
+    endtime = Column(Time)
+
+    # the columns that make up the schedule itself
+    scheduleColumns = ('from_day', 'to_day', 'begtime', 'endtime')
+
+    # the table that holds a copy for every day
+    dailyModel = SFparkOphrsRecord
+
+
+
+class SFparkStringRecord(Base):
+    """ 
+    The dictionary of the strings in the rates and operating hours, for
+    use with SFparkRatesCodedRecord and SFparkOphrsCodedRecord, which
+    store a code from here in place of each string.  There are only a
+    few hundred distinct strings, repeated in millions of rows.
+    
+    A corresponding database, named sfdata, should be available, and contain
+    a table with the following definition: 
+        
+    CREATE TABLE sfpark_string (
+	id SERIAL NOT NULL PRIMARY KEY,            # Unique ID, the code stored in place of the string
+	value VARCHAR(255) NOT NULL UNIQUE         # The string
+    ); 
+    """
+    
+    __tablename__ = 'sfpark_string'
+    
+    # the code stored in place of the string
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+    # the string
+    value = Column(String(255), nullable=False, unique=True)
+
+
+
+class SFparkRatesCodedRecord(Base):
+    """ 
+    A compact copy of the rates, for use in place of sfpark_rates, with 
+    the descr, rq and rr strings replaced by codes from sfpark_string.  
+    Rows are written every day, as in sfpark_rates.  The view 
+    sfpark_rates_decoded shows them in the form of sfpark_rates.
+    
+    A corresponding database, named sfdata, should be available, and contain
+    a table with the following definition: 
+        
+    CREATE TABLE sfpark_rates_coded (
+	id BIGSERIAL NOT NULL PRIMARY KEY,         # Unique ID and primary index in this table
+	loc_id INT NOT NULL,                       # ID to link back to location table
+	date_id INT NOT NULL,                      # date ID in form YYYYMMDD
+	begtime   TIME,                            # Indicates the begin time for this rate schedule
+	endtime   TIME,                            # Indicates the end time for this rate schedule 
+	rate      NUMERIC(8,2),                    # Applicable rate for this rate schedule
+	descr_id  INT,                             # Code in sfpark_string of the descr of sfpark_rates
+	rq_id     INT,                             # Code in sfpark_string of the rate qualifier
+	rr_id     INT                              # Code in sfpark_string of the rate restriction
+    ); 
+    """
+    
+    __tablename__ = 'sfpark_rates_coded'
+    
+    # Primary and unique ID
+    id = Column(BigIntegerKey, primary_key=True, autoincrement=True)   
+
+    # links to ID in location table
+    loc_id = Column(BigInteger, ForeignKey('sfpark_loc.id')) 
+    
+    # date ID: integer in YYYYMMDD form
+    date_id = Column(Integer)
+        
+    # Indicates the begin time for this rate schedule
+    begtime = Column(Time)
+    
+    # Indicates the end time for this rate schedule                            
+    endtime = Column(Time)
+    
+    # Applicable rate for this rate schedule
+    rate = Column(Float)
+    
+    # Codes in sfpark_string of the descriptive rate information, the rate
+    # qualifier and the rate restriction
+    descr_id = Column(Integer, ForeignKey('sfpark_string.id'))
+    rq_id = Column(Integer, ForeignKey('sfpark_string.id'))
+    rr_id = Column(Integer, ForeignKey('sfpark_string.id'))
+
+    # the string columns of the daily table, and the code columns that 
+    # replace them
+    codedColumns = (('descr', 'descr_id'), ('rq', 'rq_id'), ('rr', 'rr_id'))
+
+    # the table with the strings, which has the same rows
+    dailyModel = SFparkRatesRecord
+
+
+
+class SFparkOphrsCodedRecord(Base):
+    """ 
+    A compact copy of the operating hours, for use in place of 
+    sfpark_ophrs, in the same way as SFparkRatesCodedRecord, with the
+    view sfpark_ophrs_decoded.
+    
+    A corresponding database, named sfdata, should be available, and contain
+    a table with the following definition: 
+        
+    CREATE TABLE sfpark_ophrs_coded (
+	id BIGSERIAL NOT NULL PRIMARY KEY,         # Unique ID and primary index in this table
+	loc_id INT NOT NULL,                       # ID to link back to location table
+	date_id INT NOT NULL,                      # date ID in form YYYYMMDD
+	from_day_id INT,                           # Code in sfpark_string of the start day, e.g., Monday
+	to_day_id   INT,                           # Code in sfpark_string of the end day, e.g., Friday
+	begtime   TIME,                            # Indicates the begin time for this schedule
+	endtime   TIME                             # Indicates the end time for this schedule 
+    ); 
+    """
+    
+    __tablename__ = 'sfpark_ophrs_coded'
+    
+    # Primary and unique ID
+    id = Column(BigIntegerKey, primary_key=True, autoincrement=True)      
+
+    # links to ID in location table
+    loc_id = Column(BigInteger, ForeignKey('sfpark_loc.id')) 
+    
+    # date ID: integer in YYYYMMDD form
+    date_id = Column(Integer)      
+    
+    # Codes in sfpark_string of the start and end days for this schedule
+    from_day_id = Column(Integer, ForeignKey('sfpark_string.id'))
+    to_day_id = Column(Integer, ForeignKey('sfpark_string.id'))
+
+    # Indicates the begin time for this rate schedule
+    begtime = Column(Time)
+    
+    # Indicates the end time for this rate schedule                            
+    endtime = Column(Time)
+
+    # the string columns of the daily table, and the code columns that 
+    # replace them
+    codedColumns = (('from_day', 'from_day_id'), ('to_day', 'to_day_id'))
+
+    # the table with the strings, which has the same rows
+    dailyModel = SFparkOphrsRecord
+
+
+
+class SFparkRollupRecord(Base):
+    """ 
+    Occupancy summarized by location and time bucket, kept up to date by 
+    the collector from every snapshot, so that occupancy rates can be 
+    read without scanning sfpark_avl.  There is one row per location per
+    bucket, for each bucket size kept.  Only snapshots with both occ and
+    oper count.  The rate over a bucket is occ_sum / oper_sum. 
+    
+    A corresponding database, named sfdata, should be available, and contain
+    a table with the following definition: 
+        
+    CREATE TABLE sfpark_avl_rollup (
+	id BIGSERIAL NOT NULL PRIMARY KEY,         # Unique ID and primary index in this table
+	loc_id INT NOT NULL,                       # ID to link back to location table
+	date_id INT NOT NULL,                      # date ID in form YYYYMMDD
+	bucket_minutes INT NOT NULL,               # length of the bucket, in minutes
+	bucket_start TIMESTAMP NOT NULL,           # start of the bucket
+	n         INTEGER,                         # number of snapshots in the bucket
+	occ_sum   INTEGER,                         # sum of occ over the snapshots
+	occ_min   INTEGER,                         # smallest occ
+	occ_max   INTEGER,                         # largest occ
+	oper_sum  INTEGER,                         # sum of oper over the snapshots
+	oper_min  INTEGER,                         # smallest oper
+	oper_max  INTEGER                          # largest oper
+    ); 
+    """
+    
+    __tablename__ = 'sfpark_avl_rollup'
+
+    # written a whole bucket at a time, and read by location and time
+    __table_args__ = (Index('sfpark_avl_rollup_bucket', 'bucket_minutes', 
+                            'bucket_start'), 
+                      Index('sfpark_avl_rollup_loc', 'loc_id', 'bucket_minutes', 
+                            'bucket_start'))
+    
+    # Primary and unique ID
+    id = Column(BigIntegerKey, primary_key=True, autoincrement=True)      
+
+    # links to ID in location table
+    loc_id = Column(BigInteger, ForeignKey('sfpark_loc.id')) 
+    
+    # date ID: integer in YYYYMMDD form
+    date_id = Column(Integer)
+
+    # length of the bucket, in minutes
+    bucket_minutes = Column(Integer)
+
+    # start of the bucket
+    bucket_start = Column(DateTime)
+
+    # number of snapshots in the bucket
+    n = Column(Integer)
+
+    # sum, smallest and largest number of spaces occupied
+    occ_sum = Column(Integer)
+    occ_min = Column(Integer)
+    occ_max = Column(Integer)
+
+    # sum, smallest and largest number of spaces operational
+    oper_sum = Column(Integer)
+    oper_min = Column(Integer)
+    oper_max = Column(Integer)
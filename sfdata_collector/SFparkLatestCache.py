@@ -0,0 +1,279 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import math
+import json
+import hashlib
+import threading
+
+from SFparkDataModels import SFparkLocationRecord
+from SFparkResponse import MISSING
+from SFparkQueries import getLatestAvailability, getNewestAvailabilityTime
+
+# the columns of sfpark_loc given for each location, in the order listed
+LOCATION_COLUMNS = ('id', 'parktype', 'name', 'descr', 'inter', 'tel', 'ospid',
+                    'bfid', 'pts', 'lat1', 'lon1', 'lat2', 'lon2')
+
+# columns that may come back from the database as Decimals
+COORDINATE_COLUMNS = ('lat1', 'lon1', 'lat2', 'lon2')
+
+# query parameters that are counts or distances, so can't be negative
+NON_NEGATIVE = ('k', 'radius', 'min_available')
+
+# the largest magnitude of each coordinate in a query
+COORDINATE_LIMITS = {'lat' : 90.0, 'lon' : 180.0}
+
+
+class LatestAvailabilityCache(object):
+    """
+    The latest state of every SFpark location, with its attributes from
+    sfpark_loc and its latest occ and oper, kept in memory by the
+    collector so that readers don't have to find the latest row of each
+    location in sfpark_avl.  AvailabilityApi.py serves it over HTTP.
+
+    The source updates the cache after each commit, so it only holds what
+    is in the database.  The JSON of each query is built the first time
+    it is asked for after an update, and kept, with an ETag, until the
+    next update, so a client polling with If-None-Match costs next to
+    nothing until the data changes.
+
+    With a LocationIndex, *index*, kept up to date by the source in the
+    same way, it also answers nearest and within-radius queries, with 
+    getNearest() and getWithin().  Their JSON depends on the point asked
+    about, so it is built every time, but has an ETag all the same.
+    """
+
+    def __init__(self, name='sfpark', index=None):
+        """
+        Constructor.  Creates an empty cache for the source called *name*.
+        """
+        self.name = name
+        self.index = index
+        self.lock = threading.Lock()
+
+        # loc_id -> dictionary of the LOCATION_COLUMNS
+        self.locations = {}
+
+        # loc_id -> (occ, oper), with None where they aren't known, and
+        # the time of the newest availability
+        self.availability = {}
+        self.updatedTime = None
+
+        # the (etag, body) of each list asked for since the last update,
+        # by the parktype it was filtered to, or None for all
+        self.bodies = {}
+
+    def __len__(self):
+        return len(self.locations)
+
+    def load(self, session, lookbackMinutes=None, updatedTime=None, availability=None):
+        """
+        Fills the cache from the locations in the database, and their
+        latest availability, within *lookbackMinutes* of the newest.
+        *updatedTime* and *availability* are as for LocationIndex.load().
+        """
+        columns = [getattr(SFparkLocationRecord, column) for column in LOCATION_COLUMNS]
+        locations = {}
+        for values in session.query(*columns):
+            row = dict(zip(LOCATION_COLUMNS, values))
+            for column in COORDINATE_COLUMNS:
+                if row[column] is not None:
+                    row[column] = float(row[column])
+            locations[row['id']] = row
+        if updatedTime is None:
+            updatedTime = getNewestAvailabilityTime(session)
+        if availability is None:
+            availability = getLatestAvailability(session, lookbackMinutes, updatedTime)
+
+        with self.lock:
+            self.locations = locations
+            self.availability = availability
+            self.updatedTime = updatedTime
+            self.bodies = {}
+
+    def update(self, response, indices=()):
+        """
+        Brings the cache up to date with an SFparkResponse that has been
+        written: replaces the locations at *indices* of it, which are
+        those that are new or changed, and takes the availability of all
+        of them.
+        """
+        rows = response.toRows(SFparkLocationRecord, indices)
+        with self.lock:
+            for row in rows:
+                self.locations[row['id']] = dict([(column, row[column])
+                                                  for column in LOCATION_COLUMNS])
+
+            availability = self.availability
+            for loc_id, occ, oper in zip(response.loc_ids, response.occ, response.oper):
+                availability[loc_id] = (None if occ == MISSING else occ,
+                                        None if oper == MISSING else oper)
+            self.updatedTime = response.updated_time
+            self.bodies = {}
+
+    def getList(self, filters):
+        """
+        Returns the (etag, body) of the JSON list of all the locations,
+        in order of id.  *filters* is a dictionary of the query string
+        parameters, of which only 'type' is known, to list only those of
+        one parktype, ON or OFF.  Raises a ValueError for any other.
+        """
+        parktype = None
+        for key, value in filters.iteritems():
+            if key != 'type':
+                raise ValueError("Unknown filter: %s" % key)
+            parktype = value.upper()
+
+        with self.lock:
+            cached = self.bodies.get(parktype)
+            if cached is None:
+                locations = [self.getRecord(loc_id) for loc_id in sorted(self.locations)
+                             if parktype is None or
+                                self.locations[loc_id]['parktype'] == parktype]
+                cached = makeBody({'source'    : self.name,
+                                   'updated'   : formatTime(self.updatedTime),
+                                   'count'     : len(locations),
+                                   'locations' : locations})
+                self.bodies[parktype] = cached
+            return cached
+
+    def getItem(self, key):
+        """
+        Returns the (etag, body) of the JSON of the location with the id
+        *key*, a string, or None if there is no such location.  Raises a
+        ValueError if *key* is not a number.
+        """
+        loc_id = int(key)
+        with self.lock:
+            if loc_id not in self.locations:
+                return None
+            return makeBody({'source'   : self.name,
+                             'updated'  : formatTime(self.updatedTime),
+                             'location' : self.getRecord(loc_id)})
+
+    def getNearest(self, query):
+        """
+        Returns the (etag, body) of the JSON list of the locations nearest
+        a point, nearest first, with the meters to each, or None if there
+        is no index.  *query* is a dictionary of the query string 
+        parameters:
+
+            lat, lon       - the point (required)
+            k              - the number of locations (default 5)
+            radius         - leave out those further than this, in meters
+            min_available  - leave out those with fewer spaces free
+
+        Raises a ValueError if a parameter is missing, unknown, not a 
+        finite number, or a negative count or distance.
+        """
+        if self.index is None:
+            return None
+        params = parseQuery(query, ('lat', 'lon'), ('k', 'radius', 'min_available'))
+        k = int(params.get('k', 5))
+        if k < 1:
+            raise ValueError("k must be at least 1")
+        return self.makeNearby(self.index.nearest(params['lat'], params['lon'], k,
+                                                  params.get('radius'),
+                                                  params.get('min_available')))
+
+    def getWithin(self, query):
+        """
+        Returns the (etag, body) of the JSON list of the locations within 
+        a radius of a point, nearest first, with the meters to each, or 
+        None if there is no index.  *query* is as for getNearest(), but 
+        the radius is required, and there is no k.
+        """
+        if self.index is None:
+            return None
+        params = parseQuery(query, ('lat', 'lon', 'radius'), ('min_available',))
+        return self.makeNearby(self.index.within(params['lat'], params['lon'],
+                                                 params['radius'],
+                                                 params.get('min_available')))
+
+    def makeNearby(self, results):
+        """
+        Returns the (etag, body) of the JSON list of the locations in 
+        *results*, from a query of the index, each with its meters from
+        the point.  The occ and oper are the cache's, which matches the
+        index, since both are updated after the same commits.
+        """
+        with self.lock:
+            locations = []
+            for meters, loc_id, occ, oper in results:
+                if loc_id in self.locations:
+                    record = self.getRecord(loc_id)
+                    record['meters'] = round(meters, 1)
+                    locations.append(record)
+            return makeBody({'source'    : self.name,
+                             'updated'   : formatTime(self.updatedTime),
+                             'count'     : len(locations),
+                             'locations' : locations})
+
+    def getRecord(self, loc_id):
+        """
+        Returns the dictionary given for one location, with its occ and
+        oper.  Called with the lock held.
+        """
+        record = self.locations[loc_id].copy()
+        record['occ'], record['oper'] = self.availability.get(loc_id, (None, None))
+        return record
+
+
+def makeBody(data):
+    """
+    Returns the (etag, body) for the JSON of *data*.  The ETag is a hash
+    of the body, so it is the same across restarts for the same data.
+    """
+    body = json.dumps(data, sort_keys=True, separators=(',', ':'))
+    return '"%s"' % hashlib.md5(body).hexdigest(), body
+
+
+def parseQuery(query, required, optional=()):
+    """
+    Returns the numbers in the dictionary of query string parameters
+    *query*, as floats, by name.  Raises a ValueError if any of the names
+    *required* are missing, if a value is not a finite number, if one of
+    the NON_NEGATIVE is negative, if a coordinate is out of range, or if
+    a name is neither required nor *optional*.
+    """
+    params = {}
+    for key, value in query.iteritems():
+        if key not in required and key not in optional:
+            raise ValueError("Unknown parameter: %s" % key)
+        number = float(value)
+        if math.isinf(number) or math.isnan(number):
+            raise ValueError("%s must be a finite number" % key)
+        if number < 0 and key in NON_NEGATIVE:
+            raise ValueError("%s must not be negative" % key)
+        if key in COORDINATE_LIMITS and abs(number) > COORDINATE_LIMITS[key]:
+            raise ValueError("%s is out of range" % key)
+        params[key] = number
+    for key in required:
+        if key not in params:
+            raise ValueError("Missing parameter: %s" % key)
+    return params
+
+
+def formatTime(timestamp):
+    """
+    Returns a datetime in ISO 8601 form, or None.
+    """
+    if timestamp is None:
+        return None
+    return timestamp.isoformat()
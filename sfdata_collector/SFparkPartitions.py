@@ -0,0 +1,392 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import re
+import datetime
+from sets import Set
+
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+from SFparkDataModels import SFparkAvailabilityRecord
+
+# the availability table, and the pattern for the name of each month's
+# partition, as sfpark_avl_YYYYMM
+TABLE = SFparkAvailabilityRecord.__tablename__
+PARTITION_PATTERN = re.compile(r'^%s_(\d{6})$' % TABLE)
+
+# the columns, other than id, in the order they are copied
+COLUMNS = ('loc_id', 'date_id', 'availability_updated_timestamp', 'occ', 'oper')
+
+# on SQLite, each month's ids start at YYYYMM * ID_OFFSET, so they are
+# unique across the months, as they are in a single table
+ID_OFFSET = 10**10
+
+POSTGRESQL_TABLE = """
+CREATE TABLE %(table)s (
+    id BIGSERIAL NOT NULL,
+    loc_id BIGINT REFERENCES sfpark_loc (id),
+    date_id INTEGER NOT NULL,
+    availability_updated_timestamp TIMESTAMP WITHOUT TIME ZONE,
+    occ INTEGER,
+    oper INTEGER,
+    PRIMARY KEY (id, date_id)
+) PARTITION BY RANGE (date_id)
+"""
+
+# created on the parent, so PostgreSQL creates it on every partition
+POSTGRESQL_INDEX = """
+CREATE INDEX %(table)s_loc_time ON %(table)s (loc_id, availability_updated_timestamp)
+"""
+
+POSTGRESQL_PARTITION = """
+CREATE TABLE %(partition)s PARTITION OF %(table)s
+    FOR VALUES FROM (%(begin)i) TO (%(end)i)
+"""
+
+SQLITE_PARTITION = """
+CREATE TABLE %(partition)s (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    loc_id BIGINT REFERENCES sfpark_loc (id),
+    date_id INTEGER NOT NULL,
+    availability_updated_timestamp DATETIME,
+    occ INTEGER,
+    oper INTEGER
+)
+"""
+
+SQLITE_INDEX = """
+CREATE INDEX %(partition)s_loc_time ON %(partition)s (loc_id, availability_updated_timestamp)
+"""
+
+
+class AvailabilityPartitions(object):
+    """
+    Keeps sfpark_avl split into one partition per month of date_id, named
+    sfpark_avl_YYYYMM, so that old months can be removed whole, rather
+    than with a DELETE, and each partition has a (loc_id,
+    availability_updated_timestamp) index small enough to stay in memory.
+
+    On PostgreSQL, sfpark_avl is a table partitioned by range, which
+    routes rows to the partitions itself.  It needs PostgreSQL 11 or
+    later.
+
+    SQLite has no partitioning, so the months are separate tables, and
+    sfpark_avl is a view of all of them, with an INSTEAD OF INSERT
+    trigger that routes each row to its month.  The view and trigger are
+    rebuilt whenever a month is added or removed.
+
+    Either way, the rest of the code reads and writes sfpark_avl as
+    before.  The partition for a month must exist before rows for it are
+    written, which maintain() takes care of.
+    """
+
+    def __init__(self, monthsAhead=1, retentionMonths=None, detachOld=False):
+        """
+        Constructor.
+
+        *monthsAhead* is the number of months after the current one to
+        create partitions for, so they are ready before they are needed.
+
+        *retentionMonths* is the number of whole months before the
+        current one to keep.  Older partitions are removed.  None keeps
+        everything.
+
+        *detachOld* keeps the removed partitions as tables of their own,
+        rather than dropping them.  On PostgreSQL they are detached, and on
+        SQLite they are renamed to sfpark_avl_YYYYMM_detached.
+        """
+        self.monthsAhead = monthsAhead
+        self.retentionMonths = retentionMonths
+        self.detachOld = detachOld
+
+        # True once detect() finds a partitioned table
+        self.partitioned = False
+
+        # True on SQLite, where rows are written through the view's
+        # trigger, so the ids of the rows inserted can't be read back
+        self.insertsThroughView = False
+
+        # the months with a partition, as YYYYMM
+        self.months = Set()
+
+        # the newest month maintain() has been called for
+        self.lastMonth = None
+
+    def detect(self, session):
+        """
+        Checks whether sfpark_avl is partitioned, and if it is, loads the
+        list of partitions.  Returns True if it is partitioned.
+        """
+        dialect = session.get_bind().dialect.name
+        if dialect == 'postgresql':
+            self.partitioned = session.execute(text(
+                "SELECT relkind FROM pg_class WHERE relname = :table "
+                "AND pg_table_is_visible(oid)"), {'table' : TABLE}).scalar() == 'p'
+        elif dialect == 'sqlite':
+            self.partitioned = session.execute(text(
+                "SELECT type FROM sqlite_master WHERE name = :table"),
+                {'table' : TABLE}).scalar() == 'view'
+        else:
+            self.partitioned = False
+
+        self.insertsThroughView = self.partitioned and dialect == 'sqlite'
+        self.months = Set(listPartitions(session)) if self.partitioned else Set()
+        return self.partitioned
+
+    def maintain(self, session, date_id):
+        """
+        Makes sure there is a partition for *date_id*, and for the months
+        ahead of it, and removes those past the retention period.  Only
+        does any work the first time it is called for each month, so it
+        can be called before every write.
+
+        Returns a tuple of the (months added, months removed).
+        """
+        month = date_id // 100
+        if month == self.lastMonth:
+            return [], []
+        if self.lastMonth is None or month > self.lastMonth:
+            self.lastMonth = month
+
+        # the month being written is kept, even if it is past retention
+        removed = []
+        if self.retentionMonths is not None:
+            cutoff = addMonths(self.lastMonth, -self.retentionMonths)
+            removed = [m for m in sorted(self.months) if m < cutoff and m != month]
+
+        wanted = Set([addMonths(self.lastMonth, i) for i in range(self.monthsAhead + 1)])
+        wanted.add(month)
+        added = sorted(wanted - self.months)
+
+        for m in removed:
+            self.removePartition(session, m)
+        for m in added:
+            self.addPartition(session, m)
+
+        if len(added) + len(removed) > 0:
+            self.rebuildView(session)
+        return added, removed
+
+    def create(self, session, date_id):
+        """
+        Creates sfpark_avl as a partitioned table, with partitions for the
+        month of *date_id* and the months ahead of it.  sfpark_loc must
+        already exist.
+        """
+        dialect = session.get_bind().dialect.name
+        if dialect == 'postgresql':
+            session.execute(text(POSTGRESQL_TABLE % {'table' : TABLE}))
+            session.execute(text(POSTGRESQL_INDEX % {'table' : TABLE}))
+        elif dialect != 'sqlite':
+            raise ValueError("Partitioning %s is only supported on PostgreSQL "
+                             "and SQLite, not %s" % (TABLE, dialect))
+
+        # on SQLite, this creates the view, so the table exists from here
+        self.partitioned = True
+        self.insertsThroughView = dialect == 'sqlite'
+        self.maintain(session, date_id)
+
+    def addPartition(self, session, month):
+        """
+        Creates the partition for *month*, in the form YYYYMM.
+        """
+        dialect = session.get_bind().dialect.name
+        values = {'table'     : TABLE,
+                  'partition' : partitionName(month),
+                  'begin'     : month * 100 + 1,
+                  'end'       : addMonths(month, 1) * 100 + 1}
+        if dialect == 'postgresql':
+            session.execute(text(POSTGRESQL_PARTITION % values))
+        else:
+            session.execute(text(SQLITE_PARTITION % values))
+            session.execute(text(SQLITE_INDEX % values))
+            session.execute(text("INSERT INTO sqlite_sequence (name, seq) "
+                                 "VALUES (:name, :seq)"),
+                            {'name' : values['partition'], 'seq' : month * ID_OFFSET})
+        self.months.add(month)
+
+    def removePartition(self, session, month):
+        """
+        Drops or detaches the partition for *month*, in the form YYYYMM.
+        """
+        dialect = session.get_bind().dialect.name
+        partition = partitionName(month)
+        if dialect == 'postgresql':
+            if self.detachOld:
+                session.execute(text("ALTER TABLE %s DETACH PARTITION %s" % (TABLE, partition)))
+            else:
+                session.execute(text("DROP TABLE %s" % partition))
+        else:
+            # the view and trigger refer to it, so they go first
+            self.dropView(session)
+            if self.detachOld:
+                session.execute(text("ALTER TABLE %s RENAME TO %s_detached" % (partition, partition)))
+            else:
+                session.execute(text("DROP TABLE %s" % partition))
+        self.months.discard(month)
+
+    def dropView(self, session):
+        """
+        On SQLite, drops the view over the partitions, and its trigger.
+        """
+        session.execute(text("DROP VIEW IF EXISTS %s" % TABLE))
+
+    def rebuildView(self, session):
+        """
+        On SQLite, replaces the view over the partitions, and the trigger
+        that routes the rows written to it.  Rows for a month with no
+        partition are an error, rather than being dropped.
+        """
+        if session.get_bind().dialect.name != 'sqlite':
+            return
+
+        self.dropView(session)
+        if len(self.months) == 0:
+            return
+
+        columns = ', '.join(COLUMNS)
+        newColumns = ', '.join(['NEW.' + c for c in COLUMNS])
+        selects = []
+        inserts = []
+        conditions = []
+        for month in sorted(self.months):
+            partition = partitionName(month)
+            condition = "(NEW.date_id >= %i AND NEW.date_id < %i)" % (
+                month * 100 + 1, addMonths(month, 1) * 100 + 1)
+            selects.append("SELECT id, %s FROM %s" % (columns, partition))
+            inserts.append("INSERT INTO %s (%s) SELECT %s WHERE %s;" % (
+                partition, columns, newColumns, condition))
+            conditions.append(condition)
+
+        session.execute(text("CREATE VIEW %s AS %s" % (TABLE, " UNION ALL ".join(selects))))
+        session.execute(text(
+            "CREATE TRIGGER %s_insert INSTEAD OF INSERT ON %s BEGIN "
+            "SELECT RAISE(ABORT, 'no %s partition for date_id') WHERE NOT (%s); "
+            "%s END" % (TABLE, TABLE, TABLE, " OR ".join(conditions), " ".join(inserts))))
+
+
+def createPartitionedTable(engine, monthsAhead=1):
+    """
+    Creates sfpark_avl as a partitioned table, if it doesn't exist yet.
+    Raises a ValueError if it exists and is not partitioned.
+    """
+    session = sessionmaker(bind=engine)()
+    try:
+        partitions = AvailabilityPartitions(monthsAhead)
+        if not partitions.detect(session):
+            if engine.dialect.has_table(session.connection(), TABLE):
+                raise ValueError("%s already exists and is not partitioned.  Run "
+                                 "'sfpark_admin.py partition-availability' to "
+                                 "convert it." % TABLE)
+            today = datetime.date.today()
+            partitions.create(session, 10000*today.year + 100*today.month + today.day)
+        session.commit()
+    finally:
+        session.close()
+
+
+def partitionTable(session, monthsAhead=1):
+    """
+    Converts an existing sfpark_avl into a partitioned table, copying the
+    rows one month at a time.  The ids are renumbered.  Commits after
+    each month, and drops the old table at the end.
+
+    Returns the number of rows copied.
+    """
+    partitions = AvailabilityPartitions(monthsAhead)
+    if partitions.detect(session):
+        raise ValueError("%s is already partitioned" % TABLE)
+
+    dialect = session.get_bind().dialect.name
+    old = TABLE + '_unpartitioned'
+    session.execute(text("ALTER TABLE %s RENAME TO %s" % (TABLE, old)))
+    if dialect == 'postgresql':
+        # the new table's primary key would take the same name
+        session.execute(text("ALTER INDEX IF EXISTS %s_pkey RENAME TO %s_pkey" % (TABLE, old)))
+    months = [month for (month,) in session.execute(text(
+        "SELECT DISTINCT date_id / 100 FROM %s ORDER BY 1" % old))]
+    if len(months) > 0:
+        partitions.create(session, months[0] * 100 + 1)
+    else:
+        today = datetime.date.today()
+        partitions.create(session, 10000*today.year + 100*today.month + today.day)
+    session.commit()
+
+    columns = ', '.join(COLUMNS)
+    for month in months:
+        partitions.maintain(session, month * 100 + 1)
+        session.execute(text(
+            "INSERT INTO %s (%s) SELECT %s FROM %s "
+            "WHERE date_id >= :begin AND date_id < :end" % (TABLE, columns, columns, old)),
+            {'begin' : month * 100 + 1, 'end' : addMonths(month, 1) * 100 + 1})
+        session.commit()
+
+    # rowcount doesn't include rows inserted by a trigger
+    numRows = session.execute(text("SELECT count(*) FROM %s" % old)).scalar()
+    session.execute(text("DROP TABLE %s" % old))
+    session.commit()
+    return numRows
+
+
+def listPartitions(session):
+    """
+    Returns the months, as YYYYMM, that sfpark_avl has partitions for,
+    in order.
+    """
+    dialect = session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        names = session.execute(text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = :table"), {'table' : TABLE})
+    else:
+        names = session.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"))
+
+    months = []
+    for (name,) in names:
+        match = PARTITION_PATTERN.match(name)
+        if match is not None:
+            months.append(int(match.group(1)))
+    return sorted(months)
+
+
+def countPartitionRows(session, month):
+    """
+    Returns the number of rows in the partition for *month*.
+    """
+    return session.execute(text("SELECT count(*) FROM %s" % partitionName(month))).scalar()
+
+
+def partitionName(month):
+    """
+    Returns the name of the partition for *month*, in the form YYYYMM.
+    """
+    return '%s_%06i' % (TABLE, month)
+
+
+def addMonths(month, n):
+    """
+    Returns the month *n* months after *month*, both in the form YYYYMM.
+    """
+    i = (month // 100) * 12 + (month % 100 - 1) + n
+    return (i // 12) * 100 + i % 12 + 1
+
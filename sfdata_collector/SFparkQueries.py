@@ -0,0 +1,197 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import datetime
+
+from sqlalchemy import func, and_, or_
+
+from SFparkDataModels import SFparkAvailabilityRecord, SFparkRollupRecord
+from SFparkResponse import getDateId
+
+
+def getNewestAvailabilityTime(session, near=None):
+    """
+    Returns the newest availability_updated_timestamp in sfpark_avl, or
+    None if it is empty.
+
+    *near* is a time thought to be the newest, such as the one saved in a
+    checkpoint.  If there are rows at or after it, only the rows from its
+    day on are read, which the date_id index, or on a partitioned table
+    the partitions, limit to the last day or so, rather than the whole 
+    table.  Otherwise the whole table is read.
+    """
+    avl = SFparkAvailabilityRecord
+    query = session.query(func.max(avl.availability_updated_timestamp))
+    if near is not None:
+        newest = query.filter(avl.date_id >= getDateId(near)) \
+                      .filter(avl.availability_updated_timestamp >= near).scalar()
+        if newest is not None:
+            return newest
+    return query.scalar()
+
+
+def getLatestAvailability(session, lookbackMinutes=None, newest=None):
+    """
+    Returns a dictionary of loc_id -> (occ, oper) holding the most recent
+    availability stored for each location.
+
+    *lookbackMinutes* limits the search to rows within that many minutes
+    of the newest row in the table, *newest*, which is looked up if it 
+    isn't given.  When the collector runs in delta mode every location 
+    has a keyframe within that window, so this avoids scanning the whole
+    table.
+    """
+    avl = SFparkAvailabilityRecord
+
+    query = session.query(avl.loc_id,
+                          func.max(avl.availability_updated_timestamp).label('ts'))
+    if lookbackMinutes is not None:
+        if newest is None:
+            newest = getNewestAvailabilityTime(session)
+        if newest is None:
+            return {}
+        since = newest - datetime.timedelta(minutes=lookbackMinutes)
+        query = query.filter(avl.date_id >= getDateId(since)) \
+                     .filter(avl.availability_updated_timestamp >= since)
+    latest = query.group_by(avl.loc_id).subquery()
+
+    states = {}
+    for loc_id, occ, oper in session.query(avl.loc_id, avl.occ, avl.oper).join(
+            latest, and_(avl.loc_id == latest.c.loc_id,
+                         avl.availability_updated_timestamp == latest.c.ts)):
+        states[loc_id] = (occ, oper)
+    return states
+
+
+def getAvailabilitySeries(session, loc_id, start, end, maxAgeMinutes=65):
+    """
+    Rebuilds the minute-by-minute availability of a single location between
+    the datetimes *start* and *end*, inclusive.  Works the same whether the
+    rows were stored every minute or only on change (delta mode), because
+    each minute takes the values of the latest row at or before it.
+
+    *maxAgeMinutes* is the longest a stored value is carried forward.  In
+    delta mode this should be a little longer than the keyframe interval, 
+    so that minutes when the collector was not running come back as 
+    unknown rather than as a stale value.  Use None to carry values 
+    forward indefinitely.
+
+    Returns a list of (datetime, occ, oper) tuples, one per minute, with
+    occ and oper set to None where they are unknown.
+    """
+    avl = SFparkAvailabilityRecord
+    start = start.replace(second=0, microsecond=0)
+
+    # the last row before the range, which gives the state at the start
+    rows = []
+    first = session.query(avl.availability_updated_timestamp, avl.occ, avl.oper) \
+                   .filter(avl.loc_id == loc_id) \
+                   .filter(avl.availability_updated_timestamp <= start) \
+                   .order_by(avl.availability_updated_timestamp.desc()) \
+                   .first()
+    if first is not None:
+        rows.append(tuple(first))
+
+    rows.extend(session.query(avl.availability_updated_timestamp, avl.occ, avl.oper)
+                       .filter(avl.loc_id == loc_id)
+                       .filter(avl.availability_updated_timestamp > start)
+                       .filter(avl.availability_updated_timestamp <= end)
+                       .order_by(avl.availability_updated_timestamp))
+
+    if maxAgeMinutes is not None:
+        maxAge = datetime.timedelta(minutes=maxAgeMinutes)
+
+    series = []
+    i = -1
+    minute = start
+    while minute <= end:
+        while i+1 < len(rows) and rows[i+1][0] <= minute:
+            i += 1
+
+        if i < 0 or (maxAgeMinutes is not None and minute - rows[i][0] > maxAge):
+            series.append((minute, None, None))
+        else:
+            series.append((minute, rows[i][1], rows[i][2]))
+        minute += datetime.timedelta(minutes=1)
+
+    return series
+
+
+def getScheduleOn(session, model, date_id, loc_id=None):
+    """
+    Returns the rates or operating hours in effect on *date_id*, from the
+    version tables written in versioned mode.
+
+    *model* is SFparkRatesVersionRecord or SFparkOphrsVersionRecord.
+
+    *date_id* is the date, as an integer in the form YYYYMMDD.
+
+    *loc_id* limits the result to a single location.  Otherwise, every
+    location with a schedule on that date is included.
+
+    Returns a list of records, ordered by location, and within each
+    location in the order they came from SFpark.
+    """
+    query = session.query(model) \
+                   .filter(model.valid_from <= date_id) \
+                   .filter(or_(model.valid_to == None, model.valid_to > date_id))
+    if loc_id is not None:
+        query = query.filter(model.loc_id == loc_id)
+    return query.order_by(model.loc_id, model.id).all()
+
+
+def getOccupancy(session, bucketMinutes, start, end, loc_id=None):
+    """
+    Returns the occupancy of each location in each bucket between the
+    datetimes *start* and *end*, read from the rollups the collector
+    keeps with --rollup-minutes, or rebuilt with 'sfpark_admin.py
+    rebuild-rollups'.
+
+    *bucketMinutes* is the bucket size, which must be one of those kept.
+
+    *start* and *end* select the buckets that start within that range,
+    including *start* but not *end*.
+
+    *loc_id* limits the result to a single location.  Otherwise, every
+    location is included.
+
+    Returns a list of (loc_id, bucket_start, n, occ_avg, oper_avg, rate)
+    tuples, ordered by location and time, where n is the number of
+    snapshots, occ_avg and oper_avg are the average occupied and
+    operational spaces, and rate is the share of the operational spaces
+    occupied, or None if there were none.
+    """
+    rollup = SFparkRollupRecord
+    query = session.query(rollup.loc_id, rollup.bucket_start, rollup.n,
+                          rollup.occ_sum, rollup.oper_sum) \
+                   .filter(rollup.bucket_minutes == bucketMinutes) \
+                   .filter(rollup.bucket_start >= start) \
+                   .filter(rollup.bucket_start < end)
+    if loc_id is not None:
+        query = query.filter(rollup.loc_id == loc_id)
+
+    occupancy = []
+    for loc_id, bucket_start, n, occ_sum, oper_sum in query.order_by(
+            rollup.loc_id, rollup.bucket_start):
+        rate = None
+        if oper_sum > 0:
+            rate = float(occ_sum) / oper_sum
+        occupancy.append((loc_id, bucket_start, n, float(occ_sum) / n,
+                          float(oper_sum) / n, rate))
+    return occupancy
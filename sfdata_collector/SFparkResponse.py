@@ -0,0 +1,404 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import re
+import hashlib
+import calendar
+import datetime
+from array import array
+
+from SFparkDataModels import (SFparkLocationRecord, SFparkAvailabilityRecord,
+                              SFparkRatesRecord, SFparkOphrsRecord, parseTime)
+
+# stands in for a missing OCC or OPER in the integer columns
+MISSING = -1
+
+# the parts of an AVL record that describe the location, rather than its
+# availability, which are hashed to tell when a location has changed
+LOCATION_KEYS = ('TYPE', 'OSPID', 'BFID', 'NAME', 'DESC', 'INTER', 'TEL',
+                 'PTS', 'LOC')
+LOCATION_DEFAULTS = (u'',) * len(LOCATION_KEYS)
+
+# the UTC offset at the end of an AVAILABILITY_UPDATED_TIMESTAMP
+UTC_OFFSET_RE = re.compile(r'(?:([+-])(\d\d):?(\d\d)|Z)$')
+
+# the UTC offsets in San Francisco, where the service is.  Daylight time
+# runs from 2 AM on the second Sunday in March to 2 AM on the first 
+# Sunday in November, as it has since 2007
+PACIFIC_STANDARD = datetime.timedelta(hours=-8)
+PACIFIC_DAYLIGHT = datetime.timedelta(hours=-7)
+
+
+class SFparkResponse(object):
+    """
+    One successful response from the SFpark availability service, held
+    as columns rather than as the nested dictionaries that came out of
+    the json.  The AVL list is walked once, and every record type is
+    produced from the result.
+
+    There is one entry per AVL record in:
+        loc_ids    - the location ids
+        loc_hashes - a hash of the location's attributes, from
+                     locationHash()
+        occ, oper  - the occupied and operational spaces, or MISSING
+        locations  - a tuple of the LOCATION_KEYS values of each record,
+                     with None for those missing, which are only needed
+                     to write locations that are new or changed
+
+    Nothing else of the json is kept, so a response takes a small part of
+    the memory of the json it came from, and the json can be freed as
+    soon as it is parsed.  The attributes are __slots__, since there may
+    be many responses waiting to be written.
+
+    The RATES and OPHRS of all locations are flattened into tables of
+    their own, with the index of the AVL record each row came from in
+    rates_parent and ophrs_parent.  Times are parsed once per distinct
+    string, so rows with the same times share the same objects.  These
+    are only written once a day, so they can be left out, in which case
+    *pricing* is False.
+
+    updated_time is as the service gives it, in San Francisco time, as
+    it is stored.  utc_offset is the UTC offset it was given with, or 
+    None if it had none, for getUnixTime().
+    """
+
+    __slots__ = ('updated_time', 'utc_offset', 'date_id', 'pricing',
+                 'loc_ids', 'loc_hashes', 'occ', 'oper', 'locations',
+                 'rates_parent', 'rates_beg', 'rates_end', 'rates_rate',
+                 'rates_descr', 'rates_rq', 'rates_rr',
+                 'ophrs_parent', 'ophrs_from', 'ophrs_to', 'ophrs_beg',
+                 'ophrs_end')
+
+    def __init__(self, updated_time, pricing=True, utc_offset=None):
+        """
+        Constructor.  Creates an empty response for *updated_time*.
+        Normally built with fromJson().
+        """
+        self.updated_time = updated_time
+        self.utc_offset = utc_offset
+        self.date_id = getDateId(updated_time)
+        self.pricing = pricing
+
+        self.loc_ids = array('l')
+        self.loc_hashes = []
+        self.occ = array('l')
+        self.oper = array('l')
+        self.locations = []
+
+        self.rates_parent = array('l')
+        self.rates_beg = []
+        self.rates_end = []
+        self.rates_rate = []
+        self.rates_descr = []
+        self.rates_rq = []
+        self.rates_rr = []
+
+        self.ophrs_parent = array('l')
+        self.ophrs_from = []
+        self.ophrs_to = []
+        self.ophrs_beg = []
+        self.ophrs_end = []
+
+    @classmethod
+    def fromJson(cls, data, pricing=True):
+        """
+        Builds the columns from the parsed json response *data*, in a
+        single pass over the AVL records.  *data* must have a STATUS of
+        SUCCESS.  RATES and OPHRS are skipped unless *pricing* is True.
+        """
+        string_time = data["AVAILABILITY_UPDATED_TIMESTAMP"]
+        self = cls(parseUpdatedTime(string_time), pricing, parseUtcOffset(string_time))
+
+        for avl in data["AVL"]:
+            i = len(self.loc_ids)
+            self.loc_ids.append(getLocationId(avl))
+            self.loc_hashes.append(locationHash(avl))
+            self.occ.append(int(avl["OCC"]) if "OCC" in avl else MISSING)
+            self.oper.append(int(avl["OPER"]) if "OPER" in avl else MISSING)
+            self.locations.append(tuple(map(avl.get, LOCATION_KEYS)))
+
+            if not pricing:
+                continue
+
+            if "RATES" in avl:
+                if isinstance(avl["RATES"]["RS"], list):
+                    for rates_json in avl["RATES"]["RS"]:
+                        self.rates_parent.append(i)
+                        self.rates_beg.append(getTime(rates_json, "BEG"))
+                        self.rates_end.append(getTime(rates_json, "END"))
+                        if "RATE" in rates_json:
+                            self.rates_rate.append(float(rates_json["RATE"]))
+                        else:
+                            self.rates_rate.append(None)
+                        self.rates_descr.append(rates_json.get("DESC"))
+                        self.rates_rq.append(rates_json.get("RQ"))
+                        self.rates_rr.append(rates_json.get("RR"))
+
+            if "OPHRS" in avl:
+                if isinstance(avl["OPHRS"]["OPS"], list):
+                    for ophrs_json in avl["OPHRS"]["OPS"]:
+                        self.ophrs_parent.append(i)
+                        self.ophrs_from.append(ophrs_json.get("FROM"))
+                        self.ophrs_to.append(ophrs_json.get("TO"))
+                        self.ophrs_beg.append(getTime(ophrs_json, "BEG"))
+                        self.ophrs_end.append(getTime(ophrs_json, "END"))
+
+        return self
+
+    @classmethod
+    def merge(cls, responses, pricing=True):
+        """
+        Combines several responses as of the same time, such as the tiles
+        of one poll, into one.  A location in more than one is taken from
+        the first it is in, along with its RATES and OPHRS, which are
+        skipped unless *pricing* is True.
+        """
+        self = cls(responses[0].updated_time, pricing, responses[0].getUtcOffset())
+
+        # loc_id -> index in the merged response
+        merged = {}
+        for response in responses:
+            # index in response -> index in the merged response, of the
+            # locations taken from it
+            kept = {}
+            for i, loc_id in enumerate(response.loc_ids):
+                if loc_id in merged:
+                    continue
+                kept[i] = merged[loc_id] = len(self.loc_ids)
+                self.loc_ids.append(loc_id)
+                self.loc_hashes.append(response.loc_hashes[i])
+                self.occ.append(response.occ[i])
+                self.oper.append(response.oper[i])
+                self.locations.append(response.locations[i])
+
+            if not pricing:
+                continue
+
+            for j, parent in enumerate(response.rates_parent):
+                if parent in kept:
+                    self.rates_parent.append(kept[parent])
+                    self.rates_beg.append(response.rates_beg[j])
+                    self.rates_end.append(response.rates_end[j])
+                    self.rates_rate.append(response.rates_rate[j])
+                    self.rates_descr.append(response.rates_descr[j])
+                    self.rates_rq.append(response.rates_rq[j])
+                    self.rates_rr.append(response.rates_rr[j])
+
+            for j, parent in enumerate(response.ophrs_parent):
+                if parent in kept:
+                    self.ophrs_parent.append(kept[parent])
+                    self.ophrs_from.append(response.ophrs_from[j])
+                    self.ophrs_to.append(response.ophrs_to[j])
+                    self.ophrs_beg.append(response.ophrs_beg[j])
+                    self.ophrs_end.append(response.ophrs_end[j])
+
+        return self
+
+    def __len__(self):
+        return len(self.loc_ids)
+
+    def getUtcOffset(self):
+        """
+        Returns the UTC offset of updated_time, as given by the service, 
+        or if it wasn't, or the response was spooled before it was kept,
+        the one in force in San Francisco at the time. 
+        """
+        utc_offset = getattr(self, 'utc_offset', None)
+        if utc_offset is None:
+            return getPacificOffset(self.updated_time)
+        return utc_offset
+
+    def getUnixTime(self):
+        """
+        Returns updated_time as a unix time, which unlike updated_time 
+        can be compared with the clock of a computer in any time zone.
+        """
+        return toUnixTime(self.updated_time, self.getUtcOffset())
+
+    def getLocation(self, i):
+        """
+        Returns the location attributes of AVL record *i* as a dictionary,
+        in the form of the AVL record they came from.
+        """
+        return dict([(key, value) for key, value in zip(LOCATION_KEYS, self.locations[i])
+                     if value is not None])
+
+    def getState(self, i):
+        """
+        Returns the (occ, oper) of AVL record *i*, as they would be stored,
+        for checking whether a location has changed.
+        """
+        occ = self.occ[i]
+        oper = self.oper[i]
+        return (None if occ == MISSING else occ, None if oper == MISSING else oper)
+
+    def toRows(self, model, indices=None):
+        """
+        Returns the row dictionaries for *model*, one of the SFpark record
+        classes, ready for SFparkBulkWriter.insertRows().
+
+        For locations and availability, *indices* selects which AVL
+        records to use, and defaults to all of them.  Rates and operating
+        hours always include every row.
+        """
+        if model is SFparkLocationRecord:
+            if indices is None:
+                indices = xrange(len(self.loc_ids))
+            return [SFparkLocationRecord.toRow(self.loc_ids[i], self.getLocation(i))
+                    for i in indices]
+
+        elif model is SFparkAvailabilityRecord:
+            if indices is None:
+                indices = xrange(len(self.loc_ids))
+            date_id = self.date_id
+            updated_time = self.updated_time
+            return [{'loc_id'  : self.loc_ids[i],
+                     'date_id' : date_id,
+                     'availability_updated_timestamp' : updated_time,
+                     'occ'     : None if self.occ[i] == MISSING else self.occ[i],
+                     'oper'    : None if self.oper[i] == MISSING else self.oper[i]}
+                    for i in indices]
+
+        elif model is SFparkRatesRecord:
+            loc_ids = self.loc_ids
+            date_id = self.date_id
+            return [{'loc_id'  : loc_ids[parent],
+                     'date_id' : date_id,
+                     'begtime' : beg,
+                     'endtime' : end,
+                     'rate'    : rate,
+                     'descr'   : descr,
+                     'rq'      : rq,
+                     'rr'      : rr}
+                    for parent, beg, end, rate, descr, rq, rr in
+                    zip(self.rates_parent, self.rates_beg, self.rates_end,
+                        self.rates_rate, self.rates_descr, self.rates_rq,
+                        self.rates_rr)]
+
+        elif model is SFparkOphrsRecord:
+            loc_ids = self.loc_ids
+            date_id = self.date_id
+            return [{'loc_id'   : loc_ids[parent],
+                     'date_id'  : date_id,
+                     'from_day' : from_day,
+                     'to_day'   : to_day,
+                     'begtime'  : beg,
+                     'endtime'  : end}
+                    for parent, from_day, to_day, beg, end in
+                    zip(self.ophrs_parent, self.ophrs_from, self.ophrs_to,
+                        self.ophrs_beg, self.ophrs_end)]
+
+        else:
+            raise ValueError("Not an SFpark record type: %s" % model)
+
+
+def locationHash(avl):
+    """
+    Returns a hash of the location attributes of an AVL record, which
+    changes if the location is renamed or moved.
+    """
+    values = map(avl.get, LOCATION_KEYS, LOCATION_DEFAULTS)
+    return hashlib.md5(u'\x1f'.join(map(unicode, values)).encode('utf-8')).hexdigest()
+
+
+def getTime(json, key):
+    """
+    Returns the time in *json[key]*, or None if it isn't there.
+    """
+    if key in json:
+        return parseTime(json[key])
+    return None
+
+
+def getDateId(timestamp):
+    """
+    Returns the date id, an integer in the form YYYYMMDD, for *timestamp*.
+    """
+    return 10000*timestamp.year + 100*timestamp.month + timestamp.day
+
+
+def parseUpdatedTime(string_time):
+    """
+    Converts an AVAILABILITY_UPDATED_TIMESTAMP string, such as
+    2013-06-12T14:23:01.123-07:00, into a datetime.  The fractional
+    seconds and time zone are dropped.
+    """
+    return datetime.datetime.strptime(string_time.split('.')[0], "%Y-%m-%dT%H:%M:%S")
+
+
+def parseUtcOffset(string_time):
+    """
+    Returns the UTC offset at the end of an AVAILABILITY_UPDATED_TIMESTAMP
+    string as a timedelta, such as -7 hours for
+    2013-06-12T14:23:01.123-07:00, or None if it has none.
+    """
+    match = UTC_OFFSET_RE.search(string_time)
+    if match is None:
+        return None
+    sign, hours, minutes = match.groups()
+    if sign is None:
+        return datetime.timedelta(0)
+    offset = datetime.timedelta(hours=int(hours), minutes=int(minutes))
+    if sign == '-':
+        return -offset
+    return offset
+
+
+def getPacificOffset(local):
+    """
+    Returns the UTC offset in force in San Francisco at the naive local
+    time *local*.  The hour repeated when daylight time ends is taken as
+    standard time.
+    """
+    march = datetime.datetime(local.year, 3, 8, 2)
+    november = datetime.datetime(local.year, 11, 1, 2)
+    start = march + datetime.timedelta(days=(6 - march.weekday()) % 7)
+    end = november + datetime.timedelta(days=(6 - november.weekday()) % 7)
+    if start <= local < end:
+        return PACIFIC_DAYLIGHT
+    return PACIFIC_STANDARD
+
+
+def getPacificNow():
+    """
+    Returns the current time in San Francisco, as a naive datetime, to 
+    the second, whatever the time zone of this computer.
+    """
+    utc = datetime.datetime.utcnow().replace(microsecond=0)
+    return utc + getPacificOffset(utc + PACIFIC_STANDARD)
+
+
+def toUnixTime(local, utc_offset):
+    """
+    Returns the unix time of the naive datetime *local*, in the time zone
+    *utc_offset* from UTC.
+    """
+    return (calendar.timegm(local.timetuple()) + local.microsecond / 1e6 - 
+            utc_offset.days * 86400 - utc_offset.seconds)
+
+
+def getLocationId(avl):
+    """
+    Returns the location id for an AVL record, which is the OSPID for
+    off-street parking and the BFID for on-street parking.
+    """
+    if avl["TYPE"]=="OFF":
+        return int(avl["OSPID"])
+    else:
+        return int(avl["BFID"])
@@ -0,0 +1,300 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import datetime
+import itertools
+
+from SFparkDataModels import SFparkAvailabilityRecord, SFparkRollupRecord
+from SFparkResponse import MISSING, getDateId
+from SFparkBulkWriter import insertRows
+
+# bucket sizes kept by default, in minutes
+DEFAULT_BUCKETS = (15, 60)
+
+# minutes between writes of the buckets still being filled
+FLUSH_MINUTES = 5
+
+# rows read at a time when rebuilding
+REBUILD_CHUNK = 10000
+
+# positions in the list of aggregates kept for each location
+N, OCC_SUM, OCC_MIN, OCC_MAX, OPER_SUM, OPER_MIN, OPER_MAX = range(7)
+
+
+class OccupancyRollups(object):
+    """
+    Keeps the count, sum, min and max of occ and oper for each location in
+    time buckets of one or more sizes, in sfpark_avl_rollup.
+
+    Each snapshot is added to the open bucket of each size in memory.
+    When a snapshot arrives for a later bucket, the open one is complete,
+    and is written with all its locations at once.  So that the table
+    is never far behind, open buckets are also written every 
+    *flushMinutes*.  At startup, the open buckets are recomputed from 
+    sfpark_avl.  A bucket is written by deleting it and inserting it 
+    again, which works the same on any database.
+    """
+
+    def __init__(self, bucketMinutes=DEFAULT_BUCKETS, flushMinutes=FLUSH_MINUTES,
+                 writeMode='bulk'):
+        """
+        Constructor.
+
+        *bucketMinutes* is a list of bucket sizes, in minutes.  Each must
+        divide evenly into a day, so buckets don't cross midnight.
+
+        *flushMinutes* is how often to write the open buckets, or None
+        to only write buckets once they are complete.
+
+        *writeMode* is one of SFparkBulkWriter.WRITE_MODES.  The rollups
+        are written in bulk even in 'orm' mode.
+        """
+        for minutes in bucketMinutes:
+            if minutes <= 0 or 1440 % minutes != 0:
+                raise ValueError("Rollup buckets must divide evenly into a "
+                                 "day, not %s minutes" % minutes)
+        self.bucketMinutes = tuple(bucketMinutes)
+        self.flushMinutes = flushMinutes
+        self.writeMode = 'core' if writeMode == 'orm' else writeMode
+
+        # bucket size -> (bucket start, {loc_id -> aggregates}) of the open
+        # bucket of each size
+        self.open = {}
+
+        # (bucket size, bucket start, {loc_id -> aggregates}) of buckets
+        # complete but not yet written
+        self.closed = []
+
+        # the time of the last snapshot written
+        self.lastFlush = None
+
+    def initialize(self, session, lastUpdatedTime, keyframeMinutes=None):
+        """
+        Recomputes the open buckets, as of the newest availability
+        *lastUpdatedTime*, from the rows in sfpark_avl, so the snapshots 
+        already in them aren't lost.  *keyframeMinutes* is as for 
+        readSnapshots().
+        """
+        if lastUpdatedTime is None:
+            return
+
+        start = min([getBucketStart(lastUpdatedTime, minutes) 
+                     for minutes in self.bucketMinutes])
+        for snapshot in readSnapshots(session, start, lastUpdatedTime, 
+                                      keyframeMinutes):
+            self.addSnapshot(*snapshot)
+
+        # the buckets before the open ones were already written
+        self.closed = []
+        self.lastFlush = lastUpdatedTime
+
+    def add(self, response):
+        """
+        Adds every location in the SFparkResponse *response* to the open
+        buckets.
+        """
+        self.addSnapshot(response.updated_time, response.loc_ids,
+                         response.occ, response.oper)
+
+    def addSnapshot(self, timestamp, loc_ids, occs, opers):
+        """
+        Adds one snapshot, taken at *timestamp*, to the open buckets.
+        *loc_ids*, *occs* and *opers* are parallel sequences, with MISSING
+        for an unknown occ or oper.
+        """
+        for minutes in self.bucketMinutes:
+            start = getBucketStart(timestamp, minutes)
+            if minutes in self.open:
+                openStart, locations = self.open[minutes]
+                if start < openStart:
+                    # already written as complete
+                    continue
+                if start > openStart:
+                    self.closed.append((minutes, openStart, locations))
+                    locations = {}
+                    self.open[minutes] = (start, locations)
+            else:
+                locations = {}
+                self.open[minutes] = (start, locations)
+
+            for loc_id, occ, oper in itertools.izip(loc_ids, occs, opers):
+                if occ == MISSING or oper == MISSING:
+                    continue
+                aggregates = locations.get(loc_id)
+                if aggregates is None:
+                    locations[loc_id] = [1, occ, occ, occ, oper, oper, oper]
+                else:
+                    aggregates[N] += 1
+                    aggregates[OCC_SUM] += occ
+                    if occ < aggregates[OCC_MIN]: aggregates[OCC_MIN] = occ
+                    if occ > aggregates[OCC_MAX]: aggregates[OCC_MAX] = occ
+                    aggregates[OPER_SUM] += oper
+                    if oper < aggregates[OPER_MIN]: aggregates[OPER_MIN] = oper
+                    if oper > aggregates[OPER_MAX]: aggregates[OPER_MAX] = oper
+
+    def flush(self, session, timestamp, force=False):
+        """
+        Writes the buckets that are complete, and the open buckets if
+        *flushMinutes* have passed since they were last written as of the
+        snapshot at *timestamp*, or if *force* is True.  Writes within the
+        current transaction of *session*, and does not commit.
+
+        Returns the number of rows written.
+        """
+        buckets = self.closed
+        self.closed = []
+
+        if force or (self.flushMinutes is not None and (self.lastFlush is None or
+                timestamp - self.lastFlush >= datetime.timedelta(minutes=self.flushMinutes))):
+            for minutes in self.bucketMinutes:
+                if minutes in self.open:
+                    start, locations = self.open[minutes]
+                    buckets.append((minutes, start, locations))
+            self.lastFlush = timestamp
+
+        numRows = 0
+        table = SFparkRollupRecord.__table__
+        for minutes, start, locations in buckets:
+            session.execute(table.delete()
+                            .where(table.c.bucket_minutes == minutes)
+                            .where(table.c.bucket_start == start))
+            numRows += insertRows(session, SFparkRollupRecord,
+                                  makeRollupRows(minutes, start, locations),
+                                  self.writeMode)
+        return numRows
+
+
+def makeRollupRows(minutes, start, locations):
+    """
+    Returns the rows to write for one bucket, from a dictionary of loc_id
+    -> aggregates.
+    """
+    date_id = getDateId(start)
+    rows = []
+    for loc_id, aggregates in locations.iteritems():
+        rows.append({'loc_id'         : loc_id,
+                     'date_id'        : date_id,
+                     'bucket_minutes' : minutes,
+                     'bucket_start'   : start,
+                     'n'              : aggregates[N],
+                     'occ_sum'        : aggregates[OCC_SUM],
+                     'occ_min'        : aggregates[OCC_MIN],
+                     'occ_max'        : aggregates[OCC_MAX],
+                     'oper_sum'       : aggregates[OPER_SUM],
+                     'oper_min'       : aggregates[OPER_MIN],
+                     'oper_max'       : aggregates[OPER_MAX]})
+    return rows
+
+
+def getBucketStart(timestamp, minutes):
+    """
+    Returns the start of the bucket of *minutes* holding *timestamp*.
+    """
+    minuteOfDay = timestamp.hour * 60 + timestamp.minute
+    midnight = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    return midnight + datetime.timedelta(minutes=minuteOfDay // minutes * minutes)
+
+
+def readSnapshots(session, start, end, keyframeMinutes=None):
+    """
+    Reads the availability between the datetimes *start* and *end*,
+    inclusive, back from sfpark_avl as snapshots, in order.  Each distinct 
+    availability_updated_timestamp is taken as a snapshot.
+
+    If the availability was collected in delta mode, give its
+    *keyframeMinutes*, so that locations without a row in a snapshot carry
+    their last value forward, as they do in the collector, for up to a
+    little longer than the keyframe interval.
+
+    Yields (timestamp, loc_ids, occs, opers) for each snapshot, in the
+    form taken by OccupancyRollups.addSnapshot().
+    """
+    avl = SFparkAvailabilityRecord
+    columns = (avl.availability_updated_timestamp, avl.loc_id, avl.occ, avl.oper)
+
+    # in delta mode, the values carried into the range, with their times
+    maxAge = None
+    state = {}
+    if keyframeMinutes is not None:
+        maxAge = datetime.timedelta(minutes=keyframeMinutes + 5)
+        for timestamp, loc_id, occ, oper in session.query(*columns) \
+                .filter(avl.date_id >= getDateId(start - maxAge)) \
+                .filter(avl.availability_updated_timestamp >= start - maxAge) \
+                .filter(avl.availability_updated_timestamp < start) \
+                .order_by(avl.availability_updated_timestamp):
+            state[loc_id] = (timestamp, occ, oper)
+
+    # date_id narrows the search, and picks the partitions if there are any
+    query = session.query(*columns) \
+                   .filter(avl.date_id >= getDateId(start)) \
+                   .filter(avl.date_id <= getDateId(end)) \
+                   .filter(avl.availability_updated_timestamp >= start) \
+                   .filter(avl.availability_updated_timestamp <= end) \
+                   .order_by(avl.availability_updated_timestamp) \
+                   .yield_per(REBUILD_CHUNK)
+    for timestamp, rows in itertools.groupby(query, lambda row: row[0]):
+        if maxAge is None:
+            snapshot = [tuple(row[1:]) for row in rows]
+        else:
+            for seen, loc_id, occ, oper in rows:
+                state[loc_id] = (seen, occ, oper)
+            snapshot = [(loc_id, occ, oper)
+                        for loc_id, (seen, occ, oper) in state.iteritems()
+                        if timestamp - seen <= maxAge]
+
+        yield (timestamp,
+               [loc_id for loc_id, occ, oper in snapshot],
+               [MISSING if occ is None else occ for loc_id, occ, oper in snapshot],
+               [MISSING if oper is None else oper for loc_id, occ, oper in snapshot])
+
+
+def rebuildRollups(session, startDate, endDate, bucketMinutes=DEFAULT_BUCKETS,
+                   keyframeMinutes=None, writeMode='bulk'):
+    """
+    Recomputes the rollups of *bucketMinutes* from the rows in sfpark_avl,
+    for each day from the date ids *startDate* to *endDate*, inclusive,
+    replacing those already there.  Commits after each day.
+
+    *keyframeMinutes* is as for readSnapshots().
+
+    Returns the number of rollup rows written.
+    """
+    table = SFparkRollupRecord.__table__
+
+    numRows = 0
+    day = datetime.date(startDate // 10000, startDate // 100 % 100, startDate % 100)
+    end = datetime.date(endDate // 10000, endDate // 100 % 100, endDate % 100)
+    while day <= end:
+        date_id = getDateId(day)
+        midnight = datetime.datetime(day.year, day.month, day.day)
+
+        rollups = OccupancyRollups(bucketMinutes, flushMinutes=None, writeMode=writeMode)
+        for snapshot in readSnapshots(session, midnight,
+                midnight + datetime.timedelta(days=1, microseconds=-1), keyframeMinutes):
+            rollups.addSnapshot(*snapshot)
+
+        session.execute(table.delete()
+                        .where(table.c.date_id == date_id)
+                        .where(table.c.bucket_minutes.in_(list(bucketMinutes))))
+        numRows += rollups.flush(session, None, force=True)
+        session.commit()
+
+        day += datetime.timedelta(days=1)
+
+    return numRows
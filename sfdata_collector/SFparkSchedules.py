@@ -0,0 +1,253 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import bisect
+import hashlib
+import datetime
+import itertools
+
+from sqlalchemy import func, distinct
+
+from SFparkBulkWriter import insertRows
+
+# number of loc_ids in each UPDATE ... WHERE loc_id IN (...)
+UPDATE_CHUNK = 500
+
+# number of version rows to buffer before writing them, when migrating
+MIGRATE_CHUNK = 10000
+
+
+class ScheduleVersions(object):
+    """
+    Keeps the rates or operating hours of each location as versions, in
+    one of the version tables, SFparkRatesVersionRecord or
+    SFparkOphrsVersionRecord.  Each day's schedule for a location is
+    hashed, and a new version is only written when the hash differs from
+    the current one.
+    """
+
+    def __init__(self, model):
+        """
+        Constructor.
+
+        *model* is the version table to keep, SFparkRatesVersionRecord or
+        SFparkOphrsVersionRecord.
+        """
+        self.model = model
+
+        # loc_id -> sched_hash of the current version of each location
+        self.current = {}
+
+    def initialize(self, session):
+        """
+        Loads the hash of the current version of each location.
+        """
+        model = self.model
+        for loc_id, sched_hash in session.query(model.loc_id, model.sched_hash) \
+                                         .filter(model.valid_to == None) \
+                                         .distinct():
+            self.current[loc_id] = sched_hash
+
+    def update(self, session, date_id, loc_ids, dailyRows):
+        """
+        Compares one day's schedules with the current versions.  Any
+        current version that has changed is closed, with an UPDATE in the
+        current transaction of *session*, and the rows of the new versions
+        are returned, for the caller to insert.
+
+        *loc_ids* are all the locations in the response.  Those with no
+        rows in *dailyRows* no longer have a schedule, so their current
+        version is closed and nothing replaces it.
+
+        *dailyRows* are the row dictionaries for the day, as written to
+        the daily table, in order.
+        """
+        byLocation = groupRows(dailyRows)
+
+        closed = []
+        newRows = []
+        for loc_id in loc_ids:
+            rows = byLocation.get(loc_id)
+            if rows is None:
+                if loc_id in self.current:
+                    closed.append(loc_id)
+                    del self.current[loc_id]
+                continue
+
+            sched_hash = scheduleHash(rows, self.model.scheduleColumns)
+            if self.current.get(loc_id) == sched_hash:
+                continue
+
+            if loc_id in self.current:
+                closed.append(loc_id)
+            self.current[loc_id] = sched_hash
+            newRows.extend(makeVersionRows(self.model, rows, date_id, None, sched_hash))
+
+        closeVersions(session, self.model, closed, date_id)
+        return newRows
+
+
+def groupRows(rows):
+    """
+    Returns a dictionary of loc_id -> list of rows, keeping the order of
+    the rows within each location.
+    """
+    byLocation = {}
+    for row in rows:
+        loc_id = row['loc_id']
+        if loc_id in byLocation:
+            byLocation[loc_id].append(row)
+        else:
+            byLocation[loc_id] = [row]
+    return byLocation
+
+
+def scheduleHash(rows, columns):
+    """
+    Returns a hash of the values of *columns* in all of *rows*, which make
+    up the schedule of one location.  The values are normalized so that
+    rows read back from the database hash the same as rows parsed from
+    the json.
+    """
+    md5 = hashlib.md5()
+    for row in rows:
+        for column in columns:
+            value = row[column]
+            if value is None:
+                value = ''
+            elif isinstance(value, unicode):
+                value = value.encode('utf-8')
+            elif isinstance(value, (datetime.date, datetime.time)):
+                value = value.isoformat()
+            elif isinstance(value, float):
+                value = repr(value)
+            else:
+                value = str(value)
+            md5.update(value)
+            md5.update('\t')
+        md5.update('\n')
+    return md5.hexdigest()
+
+
+def makeVersionRows(model, rows, valid_from, valid_to, sched_hash):
+    """
+    Returns the rows for one version of one location's schedule in the
+    version table *model*, given its rows from the daily table.
+    """
+    versionRows = []
+    for row in rows:
+        versionRow = {'loc_id'     : row['loc_id'],
+                      'valid_from' : valid_from,
+                      'valid_to'   : valid_to,
+                      'sched_hash' : sched_hash}
+        for column in model.scheduleColumns:
+            versionRow[column] = row[column]
+        versionRows.append(versionRow)
+    return versionRows
+
+
+def closeVersions(session, model, loc_ids, date_id):
+    """
+    Sets valid_to to *date_id* for the current versions of *loc_ids*.
+    """
+    if len(loc_ids) == 0:
+        return
+
+    # ORM objects for the versions being closed may not be written yet
+    session.flush()
+
+    table = model.__table__
+    for i in range(0, len(loc_ids), UPDATE_CHUNK):
+        chunk = loc_ids[i:i+UPDATE_CHUNK]
+        session.execute(table.update()
+                        .where(table.c.loc_id.in_(chunk))
+                        .where(table.c.valid_to == None)
+                        .values(valid_to=date_id))
+
+
+def migrateToVersions(session, model, writeMode='bulk'):
+    """
+    Collapses the daily copies in the daily table for *model* into
+    versions, and writes them to the version table *model*, which must
+    be empty.  Does not change the daily table, and does not commit.
+
+    Days are compared in order for each location, and a new version
+    starts whenever a day's schedule differs from the day before.  If a
+    location is missing on a day that other locations have rows, its
+    schedule is taken to have ended that day, as it would have been when
+    collecting.  The last version of each location is left current,
+    unless it ended before the last day.
+
+    Returns a tuple of (daily rows read, version rows written).
+    """
+    daily = model.dailyModel
+    if session.query(func.count(model.id)).scalar() > 0:
+        raise ValueError("%s already has rows.  Migrate before collecting "
+                         "in versioned mode." % model.__tablename__)
+
+    # the days there are copies for, to tell when a version ends
+    dates = [date_id for (date_id,) in
+             session.query(distinct(daily.date_id)).order_by(daily.date_id)]
+
+    def nextDate(date_id):
+        i = bisect.bisect_right(dates, date_id)
+        if i < len(dates):
+            return dates[i]
+        return None
+
+    columns = ['loc_id', 'date_id'] + list(model.scheduleColumns)
+    query = session.query(*[getattr(daily, c) for c in columns]) \
+                   .order_by(daily.loc_id, daily.date_id, daily.id) \
+                   .yield_per(MIGRATE_CHUNK)
+
+    numRead = 0
+    numWritten = 0
+    buffered = []
+
+    # (loc_id, valid_from, sched_hash, rows, last date seen) of the 
+    # version being built
+    current = None
+
+    for (loc_id, date_id), group in itertools.groupby(query, lambda values: values[:2]):
+        rows = [dict(zip(columns, values)) for values in group]
+        numRead += len(rows)
+
+        sched_hash = scheduleHash(rows, model.scheduleColumns)
+        if current is not None:
+            valid_to = nextDate(current[4])
+            if current[0] == loc_id and current[2] == sched_hash and valid_to == date_id:
+                current = current[:4] + (date_id,)
+                continue
+
+            # the version before is finished, the day after it was last
+            # seen, which is this day if it is replaced by this one
+            buffered.extend(makeVersionRows(model, current[3], current[1],
+                                            valid_to, current[2]))
+            if len(buffered) >= MIGRATE_CHUNK:
+                numWritten += insertRows(session, model, buffered, writeMode)
+                buffered = []
+
+        current = (loc_id, date_id, sched_hash, rows, date_id)
+
+    if current is not None:
+        buffered.extend(makeVersionRows(model, current[3], current[1],
+                                        nextDate(current[4]), current[2]))
+    numWritten += insertRows(session, model, buffered, writeMode)
+
+    return numRead, numWritten
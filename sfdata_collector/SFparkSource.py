@@ -0,0 +1,859 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import re
+import sys
+import json
+import time
+import datetime
+from sets import Set
+from multiprocessing.pool import ThreadPool
+
+from sqlalchemy import func
+
+from DataSource import DataSource
+from SFparkDataModels import (SFparkLocationRecord, SFparkAvailabilityRecord,
+                              SFparkRollupRecord,
+                              SFparkRatesRecord, SFparkOphrsRecord, 
+                              SFparkRatesVersionRecord, SFparkOphrsVersionRecord,
+                              SFparkStringRecord, SFparkRatesCodedRecord,
+                              SFparkOphrsCodedRecord,
+                              recordsFromRows)
+from SFparkResponse import (SFparkResponse, getDateId, parseUpdatedTime,
+                            getLocationId, getPacificNow)
+from SFparkBulkWriter import insertRows, upsertRows
+from SFparkQueries import getLatestAvailability, getNewestAvailabilityTime
+from SFparkSchedules import ScheduleVersions
+from SFparkPartitions import AvailabilityPartitions
+from SFparkRollups import OccupancyRollups
+from SFparkSpatialIndex import LocationIndex, LOOKBACK_MINUTES
+from SFparkLatestCache import LatestAvailabilityCache
+from SFparkStrings import StringCodes
+
+# the SFpark availability service
+SFPARK_URL = 'http://api.sfpark.org/sfpark/rest/availabilityservice'
+
+# finds the top-level timestamp in the raw response, so we can tell
+# whether anything has changed without parsing the whole thing
+UPDATED_TIMESTAMP_RE = re.compile(r'"AVAILABILITY_UPDATED_TIMESTAMP"\s*:\s*"([^"]+)"')
+
+# the request for the whole city.  Tiles replace some of these
+DEFAULT_PARAMS = {'RADIUS':'50.0',        # Within 50 units of SF
+                  'UOM':'mile',           # Units in miles
+                  'RESPONSE':'json',      # Return in JSON format
+                  'TYPE':'all'}           # Both on-street and off-street
+
+# the kinds of location a tile can be limited to
+TILE_TYPES = ('on', 'off')
+
+# how times are written in the checkpoint
+STATE_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+class SFparkSource(DataSource):
+    """
+    Collects current parking availability, rates and operating hours
+    from the SFpark server.
+
+    For information on the SFPark API, please see:
+    http://sfpark.org/resources/sfpark-availability-service-api-reference/
+
+    For stored data structure, see SFparkDataModels.py
+    """
+
+    name = 'sfpark'
+    period = 60
+
+    # locations come first because the other tables refer to them.  In
+    # versioned mode, the version tables replace rates and ophrs, and with
+    # coded strings, the coded tables do
+    models = (SFparkLocationRecord, SFparkRatesRecord,
+              SFparkOphrsRecord, SFparkAvailabilityRecord)
+
+    def __init__(self, writeMode='bulk', keyframeMinutes=None, url=SFPARK_URL, 
+                 archive=None, versioned=False, retentionMonths=None, 
+                 detachOld=False, rollupMinutes=None, spatialIndex=False,
+                 latestCache=False, codedStrings=False, tiles=None):
+        """
+        Constructor.
+
+        *writeMode* is one of SFparkBulkWriter.WRITE_MODES.  'orm' adds one
+        ORM object per record to the session.  The others write each table
+        as a single bulk insert.
+
+        *keyframeMinutes* turns on delta mode when not None.  Availability is
+        then only stored for locations whose occ or oper have changed since
+        the last stored value, except every *keyframeMinutes*, when all
+        locations are stored.
+
+        *url* is the address of the availability service.
+        
+        *archive* is an optional SnapshotArchive, where the raw responses
+        are kept so they can be replayed later. 
+
+        *versioned* stores rates and operating hours in the version tables,
+        sfpark_rates_ver and sfpark_ophrs_ver, where a location's schedule
+        is only written when it changes, rather than in sfpark_rates and
+        sfpark_ophrs, which get a copy every day.  See SFparkSchedules.py.
+
+        *retentionMonths* and *detachOld* apply if sfpark_avl is 
+        partitioned by month, and say how many months before the current
+        one to keep, and whether older ones are detached rather than 
+        dropped.  See SFparkPartitions.py.
+
+        *rollupMinutes* is a list of bucket sizes, in minutes, to keep
+        occupancy rollups for in sfpark_avl_rollup, or None to keep none.
+        See SFparkRollups.py.
+
+        *spatialIndex* keeps a LocationIndex of the locations and their
+        latest availability in *index*, for nearest and within-radius
+        queries.  See SFparkSpatialIndex.py.
+
+        *latestCache* keeps a LatestAvailabilityCache of the locations and
+        their latest availability in *latest*, for AvailabilityApi to
+        serve, along with nearest and within-radius queries of the index,
+        if there is one.  See SFparkLatestCache.py.
+
+        *codedStrings* stores rates and operating hours in the coded 
+        tables, sfpark_rates_coded and sfpark_ophrs_coded, with each string
+        replaced by its code in sfpark_string, rather than in sfpark_rates
+        and sfpark_ophrs.  See SFparkStrings.py.  Not with *versioned*,
+        whose tables are small already.
+
+        *tiles* splits each poll into several smaller requests, made at
+        the same time, and merged into one response.  It is a list of
+        dictionaries of the request parameters of each tile, in place of
+        those for the whole city, such as LAT, LONG and RADIUS, or TYPE, 
+        as returned by parseTiles().  A location in more than one tile is
+        kept once.  
+        """
+        DataSource.__init__(self)
+        self.writeMode = writeMode
+        self.keyframeMinutes = keyframeMinutes
+        self.url = url
+        self.archive = archive
+
+        # the threads the tiles are fetched with, started at the first
+        # poll, and the (AVAILABILITY_UPDATED_TIMESTAMP string, 
+        # SFparkResponse, json or None) last parsed from each tile, by 
+        # index, which is used again while the tile hasn't changed.  The
+        # json is only kept for the archive
+        self.tiles = tiles
+        self.tilePool = None
+        self.tileResponses = {}
+        if tiles is not None:
+            self.stats['mixedTiles'] = 0
+
+        # whether the last request asked for rates and operating hours
+        self.pricingRequested = True
+
+        # where rates and operating hours go, and in versioned mode, the
+        # current version of each
+        self.versions = {}
+        self.strings = None
+        if versioned and codedStrings:
+            raise ValueError("Rates and operating hours can be versioned or "
+                             "coded, but not both")
+        if versioned:
+            self.scheduleModels = (SFparkRatesVersionRecord, SFparkOphrsVersionRecord)
+            for model in self.scheduleModels:
+                self.versions[model] = ScheduleVersions(model)
+        elif codedStrings:
+            self.scheduleModels = (SFparkRatesCodedRecord, SFparkOphrsCodedRecord)
+            self.strings = StringCodes()
+        else:
+            self.scheduleModels = (SFparkRatesRecord, SFparkOphrsRecord)
+        self.models = ((SFparkLocationRecord,) + self.scheduleModels + 
+                       (SFparkAvailabilityRecord,))
+        if codedStrings:
+            self.models = ((SFparkLocationRecord, SFparkStringRecord) + 
+                           self.models[1:])
+
+        # for tracking what we've stored previously to prevent keeping
+        # too many copies of the same data.  locationHashes has the hash
+        # of each stored location, from SFparkResponse.locationHash(), or
+        # None if it was read from the database and isn't known yet.
+        # lastDate is the last day whose schedules were written, and
+        # lastPricedDate the last whose schedules were committed, so they
+        # are parsed until they are in the database
+        self.locationHashes = {}
+        self.lastDate = 0
+        self.lastUpdatedTime = None
+        self.lastParsedTime = None
+        self.lastPricedDate = 0
+
+        # in delta mode, the last (occ, oper) stored for each loc_id, and
+        # the time of the last keyframe, when every location was stored
+        self.lastAvailability = {}
+        self.lastKeyframe = None
+
+        # the monthly partitions of sfpark_avl, if it has them
+        self.partitions = AvailabilityPartitions(retentionMonths=retentionMonths, 
+                                                 detachOld=detachOld)
+
+        # occupancy summarized by time bucket, from every snapshot
+        self.rollups = None
+        if rollupMinutes is not None:
+            self.rollups = OccupancyRollups(rollupMinutes, writeMode=writeMode)
+            self.models = self.models + (SFparkRollupRecord,)
+
+        # the locations and their latest availability, for spatial queries
+        self.index = None
+        if spatialIndex:
+            self.index = LocationIndex()
+        if latestCache:
+            self.latest = LatestAvailabilityCache(self.name, self.index)
+
+    def initialize(self, session, state=None):
+        """
+        Figure out what has already been written to the database so we 
+        don't do it again: the locations, the last day rates and operating
+        hours were written, and the time of the newest availability.
+
+        In delta mode, also load the last stored availability of each
+        location, so we don't repeat it, in versioned mode, the current
+        version of each schedule, and with coded strings, their codes.
+
+        If *state* from a checkpoint is given, it is used instead, as long
+        as it was saved in the same mode and its newest availability is 
+        the newest in the database.  
+
+        Responses as old as the newest availability aren't parsed again.
+        """
+        self.readDatabase(session, state)
+        if self.lastParsedTime is None:
+            self.lastParsedTime = self.lastUpdatedTime
+
+    def readDatabase(self, session, state=None):
+        """
+        Does the work of initialize(), apart from what parse() keeps,
+        which is left alone, so this can also be called by reset(), 
+        while the next poll is being parsed.
+
+        The newest availability, and the latest of each location, are 
+        read once, and shared by the rollups, index and cache.  With a 
+        checkpoint, only the rows from the day of its newest 
+        availability are read to check it.
+        """
+        near = None
+        if state is not None:
+            near = parseStateTime(state['lastUpdatedTime'])
+        self.lastUpdatedTime = getNewestAvailabilityTime(session, near)
+        self.partitions.detect(session)
+        if self.rollups is not None:
+            self.rollups.initialize(session, self.lastUpdatedTime, 
+                                    self.keyframeMinutes)
+
+        # in delta mode, the keyframe interval is the lookback, so the
+        # same availability does for lastAvailability
+        latest = {}
+        lookbackMinutes = self.keyframeMinutes or LOOKBACK_MINUTES
+        if self.lastUpdatedTime is not None and (self.index is not None or 
+            self.latest is not None or self.keyframeMinutes is not None):
+            latest = getLatestAvailability(session, lookbackMinutes, 
+                                           self.lastUpdatedTime)
+        if self.index is not None:
+            self.index.load(session, lookbackMinutes, self.lastUpdatedTime, 
+                            dict(latest))
+        if self.latest is not None:
+            self.latest.load(session, lookbackMinutes, self.lastUpdatedTime, 
+                             dict(latest))
+        if self.strings is not None:
+            self.strings.load(session)
+
+        if state is not None:
+            if self.setState(state):
+                return
+            print "Checkpoint for %s does not match the database, so reading " \
+                  "the state from the database" % self.name
+
+        # the hashes aren't stored, so each location is written once more,
+        # the first time it is seen, to be sure it's current
+        for (loc_id,) in session.query(SFparkLocationRecord.id):
+            self.locationHashes[loc_id] = None
+
+        # in versioned mode, another copy of the schedules is harmless, 
+        # since only the changes are written
+        if not self.versions:
+            self.lastDate = session.query(
+                func.max(self.scheduleModels[0].date_id)).scalar() or 0
+
+        self.lastPricedDate = self.lastDate
+
+        if self.keyframeMinutes is not None:
+            self.lastAvailability.update(latest)
+
+        for versions in self.versions.values():
+            versions.initialize(session)
+
+    def reset(self, session):
+        """
+        Forgets the locations, schedules, availability and rollups 
+        recorded by a write that was rolled back, and reads them from the 
+        database again, so they are written in full the next time.  What 
+        has been parsed is kept, since it is still waiting to be written.
+        """
+        self.locationHashes = {}
+        self.lastDate = 0
+        self.lastAvailability = {}
+        self.lastKeyframe = None
+        self.partitions.lastMonth = None
+        for model in self.versions.keys():
+            self.versions[model] = ScheduleVersions(model)
+        if self.rollups is not None:
+            self.rollups = OccupancyRollups(self.rollups.bucketMinutes, 
+                                            self.rollups.flushMinutes, 
+                                            self.writeMode)
+        self.readDatabase(session)
+
+    def getState(self):
+        """
+        Returns everything initialize() would otherwise read from the
+        database, for the checkpoint.
+        """
+        versions = {}
+        for model, modelVersions in self.versions.iteritems():
+            versions[model.__tablename__] = modelVersions.current
+
+        return {'delta'            : self.keyframeMinutes is not None,
+                'versioned'        : len(self.versions) > 0,
+                'coded'            : self.strings is not None,
+                'lastUpdatedTime'  : formatStateTime(self.lastUpdatedTime),
+                'lastDate'         : self.lastDate,
+                'locationHashes'   : self.locationHashes,
+                'lastKeyframe'     : formatStateTime(self.lastKeyframe),
+                'lastAvailability' : [(loc_id, occ, oper) for loc_id, (occ, oper)
+                                      in self.lastAvailability.iteritems()],
+                'versions'         : versions}
+
+    def setState(self, state):
+        """
+        Restores the state returned by getState(), if it was saved in the
+        same mode and matches the newest availability in the database,
+        which must already be in lastUpdatedTime.  Returns True if the 
+        state was used.
+
+        json turns the integer loc_id keys into strings, so they are
+        converted back.
+        """
+        if (state['delta'] != (self.keyframeMinutes is not None) or
+            state['versioned'] != (len(self.versions) > 0) or
+            state.get('coded', False) != (self.strings is not None) or
+            state['lastUpdatedTime'] != formatStateTime(self.lastUpdatedTime)):
+            return False
+
+        self.lastDate = state['lastDate']
+        self.lastPricedDate = self.lastDate
+        for loc_id, loc_hash in state['locationHashes'].iteritems():
+            self.locationHashes[int(loc_id)] = loc_hash
+        self.lastKeyframe = parseStateTime(state['lastKeyframe'])
+        for loc_id, occ, oper in state['lastAvailability']:
+            self.lastAvailability[loc_id] = (occ, oper)
+
+        for model, modelVersions in self.versions.iteritems():
+            for loc_id, sched_hash in state['versions'][model.__tablename__].iteritems():
+                modelVersions.current[int(loc_id)] = str(sched_hash)
+        return True
+
+    def fetch(self, fetcher):
+        """
+        Makes a single request to the SFpark server, using *fetcher*, and
+        returns the response, or None if the server says nothing has changed.
+
+        With tiles, makes a request for each tile instead, at the same 
+        time, and parses each as it arrives.  See fetchTiles().
+
+        Rates and operating hours are only asked for until they have been
+        committed for the day, since they are only written once a day.  
+        The day is San Francisco's, as the feed's timestamps are, 
+        whatever the time zone of this computer.
+        """
+        self.pricingRequested = getDateId(getPacificNow()) != self.lastPricedDate
+
+        # request data from the server
+        sfpark_params = dict(DEFAULT_PARAMS)
+        sfpark_params['PRICING'] = 'yes' if self.pricingRequested else 'no'
+
+        if self.tiles is not None:
+            return self.fetchTiles(fetcher, sfpark_params)
+        return fetcher.get(self.url, params=sfpark_params)
+
+    def fetchTiles(self, fetcher, sfpark_params):
+        """
+        Requests every tile at once, each from a thread of its own, over
+        the pooled connections of *fetcher*, and parses each with 
+        parseTile() as it arrives, while the rest are still coming.  
+        Returns a TiledFetch, or None if the server says nothing has
+        changed in any tile.  
+
+        If any tile fails, the exception of the first is raised once the
+        rest have been parsed, since the fetcher won't return them again
+        until they change.
+        """
+        if self.tilePool is None:
+            self.tilePool = ThreadPool(len(self.tiles))
+
+        def fetchTile(i):
+            params = dict(sfpark_params)
+            params.update(self.tiles[i])
+            try:
+                return i, fetcher.get(self.url, params=params), None
+            except Exception:
+                return i, None, sys.exc_info()
+
+        fetched = TiledFetch()
+        error = None
+        for i, r, excInfo in self.tilePool.imap_unordered(fetchTile, 
+                                                          range(len(self.tiles))):
+            if excInfo is not None:
+                error = error or excInfo
+                continue
+            if r is None:
+                continue
+            fetched.size += len(r.content)
+            if not self.parseTile(i, r.content):
+                fetched.failed = True
+        if error is not None:
+            raise error[0], error[1], error[2]
+        if fetched.size == 0:
+            return None
+        return fetched
+
+    def parseTile(self, i, content):
+        """
+        Parses the raw body of the response for tile *i* into an 
+        SFparkResponse, and keeps it in tileResponses, unless it has the
+        same AVAILABILITY_UPDATED_TIMESTAMP as the one already there, 
+        and that has the pricing asked for.  Prints the error and returns
+        False if the server returned one. 
+        """
+        match = UPDATED_TIMESTAMP_RE.search(content)
+        last = self.tileResponses.get(i)
+        if (match is not None and last is not None and last[0] == match.group(1) and
+            (last[1].pricing or not self.pricingRequested)):
+            return True
+
+        data = json.loads(content)
+        if data["STATUS"] != "SUCCESS":
+            print data["ERROR_CODE"] + " " + data["MESSAGE"]
+            return False
+
+        self.tileResponses[i] = (data["AVAILABILITY_UPDATED_TIMESTAMP"],
+                                 SFparkResponse.fromJson(data, self.pricingRequested),
+                                 data if self.archive is not None else None)
+        return True
+
+    def getResponseSize(self, response):
+        """
+        Returns the size in bytes of a response returned by fetch(), 
+        which is the total of the tiles that changed, with tiles.
+        """
+        if isinstance(response, TiledFetch):
+            return response.size
+        return DataSource.getResponseSize(self, response)
+
+    def parse(self, r):
+        """
+        Parses the json from a response returned by fetch() into an
+        SFparkResponse.  Returns None without parsing if it has the same
+        AVAILABILITY_UPDATED_TIMESTAMP as the last one parsed, and counts
+        it as skippedUnchanged, or if the server returned an error.
+        
+        If there is an archive, new responses are appended to it as they 
+        were received, before parsing. 
+
+        With tiles, merges the tiles already parsed.  See mergeTiles().
+        """
+        if isinstance(r, TiledFetch):
+            if r.failed:
+                return None
+            return self.mergeTiles()
+        return self.parseContent(r.content)
+
+    def parseContent(self, content):
+        """
+        Does the work of parse(), given the raw body of the response.
+        """
+        match = UPDATED_TIMESTAMP_RE.search(content)
+        if match is not None:
+            updated_time = parseUpdatedTime(match.group(1))
+            if updated_time == self.lastParsedTime:
+                self.stats['skippedUnchanged'] += 1
+                return None
+            self.lastParsedTime = updated_time
+            
+            if self.archive is not None: 
+                self.archive.append(updated_time, content)
+
+        return self.parseJson(json.loads(content))
+
+    def parseJson(self, data):
+        """
+        Converts the already-decoded json response *data* into an
+        SFparkResponse, or prints the error and returns None if the
+        request was not successful.
+        """
+        if data["STATUS"]=="SUCCESS":
+
+            # rates and operating hours are only written once a day, so
+            # they only need parsing until a response of the day that has
+            # them has been committed.  One that is dropped or rolled back
+            # leaves lastPricedDate as it was, so the next is parsed too
+            updated_time = parseUpdatedTime(data["AVAILABILITY_UPDATED_TIMESTAMP"])
+            date_id = getDateId(updated_time)
+            pricing = date_id != self.lastPricedDate and self.pricingRequested
+            return SFparkResponse.fromJson(data, pricing)
+        else:
+            print data["ERROR_CODE"] + " " + data["MESSAGE"]
+            return None
+
+    def mergeTiles(self):
+        """
+        Merges the latest response of every tile into one SFparkResponse,
+        as of their AVAILABILITY_UPDATED_TIMESTAMP.  Returns None if it is
+        the same as the last one parsed, and counts it as 
+        skippedUnchanged.  
+
+        The tiles are only merged once they all have the same timestamp,
+        so every snapshot stored is of a single refresh.  Otherwise, as 
+        when the server refreshed between the requests, this returns 
+        None, counts it in mixedTiles, and the next poll tries again, 
+        with the tiles that have since changed. 
+
+        If there is an archive, the merged json is appended to it, as if
+        it were a single response for the whole city. 
+        """
+        if len(self.tileResponses) < len(self.tiles):
+            return None
+        tiles = [self.tileResponses[i] for i in range(len(self.tiles))]
+        if len(Set([timestamp for timestamp, response, data in tiles])) > 1:
+            self.stats['mixedTiles'] += 1
+            return None
+
+        responses = [response for timestamp, response, data in tiles]
+        updated_time = responses[0].updated_time
+        if updated_time == self.lastParsedTime:
+            self.stats['skippedUnchanged'] += 1
+            return None
+        self.lastParsedTime = updated_time
+
+        date_id = getDateId(updated_time)
+        pricing = (date_id != self.lastPricedDate and 
+                   all([response.pricing for response in responses]))
+
+        if self.archive is not None:
+            self.archive.append(updated_time, 
+                                json.dumps(mergeTileJson([data for timestamp, response, data 
+                                                          in tiles])))
+
+        return SFparkResponse.merge(responses, pricing)
+
+    def write(self, session, response, timings=None, rowCounts=None):
+        """
+        Writes an SFparkResponse returned by parse() to the database, and
+        commits.  Returns the number of rows written.
+        """
+        return self.writeBatch(session, [response], timings, rowCounts)
+
+    def getDataTime(self, response):
+        """
+        Returns the AVAILABILITY_UPDATED_TIMESTAMP of an SFparkResponse.
+        """
+        return response.updated_time
+
+    def getStoredTime(self):
+        """
+        Returns the AVAILABILITY_UPDATED_TIMESTAMP of the newest
+        availability in the database.
+        """
+        return self.lastUpdatedTime
+
+    def getDataUnixTime(self, response):
+        """
+        Returns the AVAILABILITY_UPDATED_TIMESTAMP of an SFparkResponse as
+        a unix time, from the UTC offset it was given with.
+        """
+        return response.getUnixTime()
+        
+    def writeBatch(self, session, responses, timings=None, rowCounts=None):
+        """
+        Writes a list of SFparkResponses, in order, to the database in a
+        single transaction, and commits.  Returns the number of rows 
+        written. 
+
+        *timings* is an optional dictionary, for benchmarking, to which the
+        seconds spent in each step are added, keyed by 'prepare', 
+        'construct ' plus the model name, 'insert', 'rollups', 'commit',
+        'index' and 'latest'.
+
+        *rowCounts* is an optional dictionary to which the rows written
+        are added, keyed by table name.
+        """
+        if timings is None:
+            timings = {}
+        if rowCounts is None:
+            rowCounts = {}
+        t0 = time.time()
+
+        # (response, indices) to write for each record type
+        selections = {}
+        for model in self.models:
+            selections[model] = []
+        
+        for response in responses: 
+            self.selectRecords(response, selections)
+            if self.partitions.partitioned:
+                self.partitions.maintain(session, response.date_id)
+        t0 = addTime(timings, 'prepare', t0)
+
+        # write in dependency order, so locations exist before the
+        # records that refer to them
+        numRows = 0
+        for model in self.models:
+            if model in self.versions:
+                # one day at a time, because each day's changes close the
+                # versions written by the day before, so this is a 
+                # generator, to write each before working out the next
+                versions = self.versions[model]
+                chunks = (versions.update(session, response.date_id, response.loc_ids,
+                                          response.toRows(model.dailyModel))
+                          for response, indices in selections[model])
+            elif self.strings is not None and model in self.scheduleModels:
+                rows = []
+                for response, indices in selections[model]:
+                    rows.extend(self.strings.encode(session, model,
+                                                    response.toRows(model.dailyModel)))
+                chunks = [rows]
+            else:
+                rows = []
+                for response, indices in selections[model]:
+                    rows.extend(response.toRows(model, indices))
+                chunks = [rows]
+
+            # rows written through the SQLite view don't get their ids 
+            # back, which the ORM needs
+            writeMode = self.writeMode
+            if model is SFparkAvailabilityRecord and self.partitions.insertsThroughView:
+                writeMode = 'core'
+
+            for rows in chunks:
+                if writeMode == 'orm':
+                    objects = recordsFromRows(model, rows)
+                    t0 = addTime(timings, 'construct ' + model.__name__, t0)
+                    if model is SFparkLocationRecord:
+                        for obj in objects:
+                            session.merge(obj)
+                    else:
+                        session.add_all(objects)
+                else:
+                    t0 = addTime(timings, 'construct ' + model.__name__, t0)
+                    if model is SFparkLocationRecord:
+                        # changed locations are already in the table
+                        upsertRows(session, model, rows)
+                    else:
+                        insertRows(session, model, rows, writeMode)
+                t0 = addTime(timings, 'insert', t0)
+                numRows += len(rows)
+                addCount(rowCounts, model.__tablename__, len(rows))
+
+        # every snapshot counts in the rollups, even in delta mode
+        if self.rollups is not None:
+            for response in responses:
+                self.rollups.add(response)
+            numRollups = self.rollups.flush(session, responses[-1].updated_time)
+            numRows += numRollups
+            addCount(rowCounts, SFparkRollupRecord.__tablename__, numRollups)
+            t0 = addTime(timings, 'rollups', t0)
+
+        session.commit()
+        t0 = addTime(timings, 'commit', t0)
+
+        # only what has been committed is visible to queries
+        if self.index is not None:
+            for response, indices in selections[SFparkLocationRecord]:
+                self.index.update(response, indices)
+            t0 = addTime(timings, 'index', t0)
+        if self.latest is not None:
+            for response, indices in selections[SFparkLocationRecord]:
+                self.latest.update(response, indices)
+            addTime(timings, 'latest', t0)
+
+        # the schedules now in the database, so they needn't be parsed
+        # again today
+        for response, indices in selections[self.scheduleModels[0]]:
+            self.lastPricedDate = response.date_id
+
+        # the newest availability now in the database.  In delta mode, a
+        # response may not have changed anything
+        for response, indices in selections[SFparkAvailabilityRecord]:
+            if indices is None or len(indices) > 0:
+                self.lastUpdatedTime = response.updated_time
+        return numRows
+            
+    def changedLocations(self, response):
+        """
+        Returns the indices of the locations in *response* that are new, or
+        whose hash differs from the one stored, and records their new
+        hashes. 
+        """
+        changed = []
+        locationHashes = self.locationHashes
+        for i, (loc_id, loc_hash) in enumerate(zip(response.loc_ids, response.loc_hashes)):
+            if locationHashes.get(loc_id, 0) != loc_hash:
+                locationHashes[loc_id] = loc_hash
+                changed.append(i)
+        return changed
+
+    def selectRecords(self, response, selections): 
+        """
+        Works out which records of *response* need to be written, and adds
+        them to *selections*, a dictionary of lists by model, as a tuple of
+        the response and the indices to pass to its toRows() method. 
+        """
+        date_id = response.date_id
+
+        # locations are written when they are new or have changed
+        selections[SFparkLocationRecord].append((response, self.changedLocations(response)))
+
+        # update rates and operating hours once per day, from the first
+        # response of the day that has them
+        if date_id != self.lastDate and response.pricing:
+            self.lastDate = date_id
+            for model in self.scheduleModels:
+                selections[model].append((response, None))
+
+        # update availability every time, or in delta mode, only when
+        # it changes or a keyframe is due
+        if self.keyframeMinutes is None:
+            selections[SFparkAvailabilityRecord].append((response, None))
+            return
+
+        updated_time = response.updated_time
+        keyframe = True
+        if (self.lastKeyframe is None or
+            updated_time - self.lastKeyframe >= datetime.timedelta(minutes=self.keyframeMinutes)):
+            self.lastKeyframe = updated_time
+        else:
+            keyframe = False
+
+        changed = []
+        for i, loc_id in enumerate(response.loc_ids):
+            state = response.getState(i)
+            if not keyframe and self.lastAvailability.get(loc_id) == state:
+                continue
+            self.lastAvailability[loc_id] = state
+            changed.append(i)
+        selections[SFparkAvailabilityRecord].append((response, changed))
+
+
+class TiledFetch(object):
+    """
+    What SFparkSource.fetch() returns with tiles, which have already been
+    parsed into SFparkSource.tileResponses by the time it returns.  Holds
+    the bytes received, and whether any tile had an error. 
+    """
+
+    def __init__(self):
+        self.size = 0
+        self.failed = False
+
+
+def parseTiles(string):
+    """
+    Returns the list of tiles for SFparkSource, given as a string of tiles
+    separated by semicolons.  Each is either LAT,LONG,RADIUS, a circle 
+    with a radius in miles, or a TYPE, ON or OFF, for all the on-street
+    or off-street locations.  For example:
+
+        37.7946,-122.4017,1.0;37.7749,-122.4194,1.5
+        on;off
+
+    Raises a ValueError if a tile isn't in either form. 
+    """
+    tiles = []
+    for tile in string.split(';'):
+        parts = [part.strip() for part in tile.split(',')]
+        if len(parts) == 3:
+            try:
+                lat, lon, radius = [float(part) for part in parts]
+            except ValueError:
+                raise ValueError("Tile is not LAT,LONG,RADIUS: %s" % tile)
+            tiles.append({'LAT'    : '%.6f' % lat,
+                          'LONG'   : '%.6f' % lon,
+                          'RADIUS' : '%.3f' % radius})
+        elif len(parts) == 1 and parts[0].lower() in TILE_TYPES:
+            tiles.append({'TYPE' : parts[0].lower()})
+        else:
+            raise ValueError("Tile is not LAT,LONG,RADIUS or one of %s: %s" %
+                             (', '.join(TILE_TYPES), tile))
+    return tiles
+
+
+def mergeTileJson(tiles):
+    """
+    Returns the json responses of several tiles, *tiles*, as one, with
+    the AVL records of every tile, each location once, and everything 
+    else from the first.  
+    """
+    merged = dict(tiles[0])
+    merged["AVL"] = []
+    seen = Set()
+    for data in tiles:
+        for avl in data["AVL"]:
+            loc_id = getLocationId(avl)
+            if loc_id not in seen:
+                seen.add(loc_id)
+                merged["AVL"].append(avl)
+    if "NUM_RECORDS" in merged:
+        merged["NUM_RECORDS"] = str(len(merged["AVL"]))
+    return merged
+
+
+def formatStateTime(timestamp):
+    """
+    Converts a datetime, or None, to a string for the checkpoint.
+    """
+    if timestamp is None:
+        return None
+    return timestamp.strftime(STATE_TIME_FORMAT)
+
+
+def parseStateTime(string_time):
+    """
+    Converts a string from formatStateTime() back to a datetime, or None.
+    """
+    if string_time is None:
+        return None
+    return datetime.datetime.strptime(string_time, STATE_TIME_FORMAT)
+
+
+def addTime(timings, key, startTime):
+    """
+    Adds the seconds since *startTime* to *timings[key]*, and returns the
+    current time, so the next step can be timed from it.
+    """
+    now = time.time()
+    timings[key] = timings.get(key, 0.0) + now - startTime
+    return now
+
+
+def addCount(counts, key, n):
+    """
+    Adds *n* to *counts[key]*.
+    """
+    counts[key] = counts.get(key, 0) + n
@@ -0,0 +1,365 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import math
+import heapq
+import threading
+
+from SFparkDataModels import SFparkLocationRecord
+from SFparkResponse import MISSING
+from SFparkQueries import getLatestAvailability, getNewestAvailabilityTime
+
+# the latitude the coordinates are projected around.  Over a city, a flat
+# projection is accurate to well under a meter
+ORIGIN_LATITUDE = 37.77
+
+# meters per degree of latitude
+METERS_PER_DEGREE = 6371008.8 * math.pi / 180
+
+# the size of each grid cell, in meters.  About a block, so a query near
+# a location only looks at a handful of cells
+CELL_METERS = 200.0
+
+# minutes of availability read at startup when not in delta mode, when
+# every snapshot has every location
+LOOKBACK_MINUTES = 10
+
+
+class LocationIndex(object):
+    """
+    A spatial index of the SFpark locations, joined to their latest
+    availability, for answering "what's available near here" without
+    going to the database.
+
+    Off-street lots are points, at (lat1, lon1).  On-street block faces
+    are line segments, from (lat1, lon1) to (lat2, lon2), and distances
+    are to the nearest point on the segment, not its ends.
+
+    The coordinates are projected to meters on a plane, and each
+    location is listed in every cell of a square grid that its bounding
+    box touches.  nearest() searches outwards from the cell holding the
+    query point, ring by ring, and stops once no unsearched cell can hold
+    anything closer.  within() only looks at the cells overlapping the
+    circle.
+
+    The source updates the index after each commit, so it matches the
+    database, and any number of threads can query it at the same time.
+    """
+
+    def __init__(self, cellMeters=CELL_METERS, originLatitude=ORIGIN_LATITUDE):
+        """
+        Constructor.  Creates an empty index.
+        """
+        self.cellMeters = cellMeters
+        self.xScale = METERS_PER_DEGREE * math.cos(math.radians(originLatitude))
+        self.yScale = METERS_PER_DEGREE
+        self.lock = threading.Lock()
+
+        # loc_id -> (x1, y1, x2, y2) in meters, with the same ends for a point
+        self.shapes = {}
+
+        # (column, row) -> list of the loc_ids in that cell, and the cells
+        # of each loc_id
+        self.cells = {}
+        self.cellsOf = {}
+
+        # the columns and rows with any cells, as [min column, min row,
+        # max column, max row], so searches know when to stop
+        self.bounds = None
+
+        # loc_id -> (occ, oper), with None where they aren't known, and 
+        # the time of the newest availability
+        self.availability = {}
+        self.updatedTime = None
+
+    def __len__(self):
+        return len(self.shapes)
+
+    def load(self, session, lookbackMinutes=LOOKBACK_MINUTES, updatedTime=None,
+             availability=None):
+        """
+        Fills the index from the locations in the database, and their
+        latest availability, within *lookbackMinutes* of the newest.
+
+        The time of the newest availability, *updatedTime*, and the 
+        latest availability, *availability*, as from 
+        getLatestAvailability(), which the index keeps, are read from the 
+        database unless they are given, so a source loading several 
+        things at once only reads them once.
+        """
+        locations = session.query(SFparkLocationRecord.id, SFparkLocationRecord.lat1,
+                                  SFparkLocationRecord.lon1, SFparkLocationRecord.lat2,
+                                  SFparkLocationRecord.lon2).all()
+        if updatedTime is None:
+            updatedTime = getNewestAvailabilityTime(session)
+        if availability is None:
+            availability = getLatestAvailability(session, lookbackMinutes, updatedTime)
+
+        with self.lock:
+            self.shapes = {}
+            self.cells = {}
+            self.cellsOf = {}
+            self.bounds = None
+            for loc_id, lat1, lon1, lat2, lon2 in locations:
+                self.addShape(loc_id, lat1, lon1, lat2, lon2)
+            self.availability = availability
+            self.updatedTime = updatedTime
+
+    def setLocation(self, loc_id, lat1, lon1, lat2=None, lon2=None):
+        """
+        Adds a location, or moves it if it is already there.  Give only 
+        (lat1, lon1) for a point.
+        """
+        with self.lock:
+            self.removeShape(loc_id)
+            self.addShape(loc_id, lat1, lon1, lat2, lon2)
+
+    def removeLocation(self, loc_id):
+        """
+        Removes a location, if it is there.
+        """
+        with self.lock:
+            self.removeShape(loc_id)
+            self.availability.pop(loc_id, None)
+
+    def update(self, response, indices=()):
+        """
+        Brings the index up to date with an SFparkResponse that has been
+        written: moves the locations at *indices* of it, which are those
+        that are new or changed, and takes the availability of all of
+        them.
+        """
+        rows = response.toRows(SFparkLocationRecord, indices)
+        with self.lock:
+            for row in rows:
+                self.removeShape(row['id'])
+                self.addShape(row['id'], row['lat1'], row['lon1'],
+                              row['lat2'], row['lon2'])
+
+            availability = self.availability
+            for loc_id, occ, oper in zip(response.loc_ids, response.occ, response.oper):
+                availability[loc_id] = (None if occ == MISSING else occ,
+                                        None if oper == MISSING else oper)
+            self.updatedTime = response.updated_time
+
+    def nearest(self, lat, lon, k=5, maxMeters=None, minAvailable=None):
+        """
+        Returns the *k* locations nearest to (*lat*, *lon*), nearest
+        first, as a list of (meters, loc_id, occ, oper) tuples.
+
+        *maxMeters* leaves out locations further away than that.
+
+        *minAvailable* only includes locations known to have at least that
+        many operational spaces unoccupied.
+        """
+        x, y = self.project(lat, lon)
+        column, row = self.cellOf(x, y)
+
+        with self.lock:
+            if self.bounds is None:
+                return []
+            minColumn, minRow, maxColumn, maxRow = self.bounds
+            # the rings before firstRing miss the grid altogether
+            firstRing = max(0, minColumn - column, column - maxColumn,
+                            minRow - row, row - maxRow)
+            lastRing = max(column - minColumn, maxColumn - column,
+                           row - minRow, maxRow - row)
+            if maxMeters is not None:
+                lastRing = min(lastRing, int(maxMeters // self.cellMeters) + 1)
+
+            # a heap of the best k so far, as (-meters, loc_id)
+            best = []
+            seen = set()
+            for ring in xrange(firstRing, lastRing + 1):
+                # anything in this ring or beyond is at least this far
+                if len(best) == k and (ring - 1) * self.cellMeters >= -best[0][0]:
+                    break
+                for cell in ringCells(column, row, ring, self.bounds):
+                    for loc_id in self.cells.get(cell, ()):
+                        if loc_id in seen:
+                            continue
+                        seen.add(loc_id)
+                        if not self.isAvailable(loc_id, minAvailable):
+                            continue
+                        meters = segmentDistance(x, y, *self.shapes[loc_id])
+                        if maxMeters is not None and meters > maxMeters:
+                            continue
+                        if len(best) < k:
+                            heapq.heappush(best, (-meters, loc_id))
+                        elif meters < -best[0][0]:
+                            heapq.heapreplace(best, (-meters, loc_id))
+
+            return [self.result(-negMeters, loc_id)
+                    for negMeters, loc_id in sorted(best, reverse=True)]
+
+    def within(self, lat, lon, meters, minAvailable=None):
+        """
+        Returns every location within *meters* of (*lat*, *lon*), nearest
+        first, as a list of (meters, loc_id, occ, oper) tuples.
+
+        *minAvailable* is as for nearest().
+        """
+        x, y = self.project(lat, lon)
+        minColumn, minRow = self.cellOf(x - meters, y - meters)
+        maxColumn, maxRow = self.cellOf(x + meters, y + meters)
+
+        with self.lock:
+            if self.bounds is None:
+                return []
+
+            # only the cells that can hold anything, so a huge radius
+            # costs no more than the whole grid
+            minColumn = max(minColumn, self.bounds[0])
+            minRow = max(minRow, self.bounds[1])
+            maxColumn = min(maxColumn, self.bounds[2])
+            maxRow = min(maxRow, self.bounds[3])
+            if (maxColumn - minColumn + 1) * (maxRow - minRow + 1) > len(self.cells):
+                cells = [cell for cell in self.cells
+                         if minColumn <= cell[0] <= maxColumn and
+                            minRow <= cell[1] <= maxRow]
+            else:
+                cells = [(column, row) for column in xrange(minColumn, maxColumn + 1)
+                                       for row in xrange(minRow, maxRow + 1)]
+
+            found = {}
+            for cell in cells:
+                for loc_id in self.cells.get(cell, ()):
+                    if loc_id in found or not self.isAvailable(loc_id, minAvailable):
+                        continue
+                    distance = segmentDistance(x, y, *self.shapes[loc_id])
+                    if distance <= meters:
+                        found[loc_id] = distance
+
+            return [self.result(distance, loc_id) for loc_id, distance in
+                    sorted(found.iteritems(), key=lambda item: (item[1], item[0]))]
+
+    def project(self, lat, lon):
+        """
+        Returns the (x, y) in meters of a latitude and longitude.
+        """
+        return lon * self.xScale, lat * self.yScale
+
+    def cellOf(self, x, y):
+        """
+        Returns the (column, row) of the cell holding (x, y).
+        """
+        return int(math.floor(x / self.cellMeters)), int(math.floor(y / self.cellMeters))
+
+    def addShape(self, loc_id, lat1, lon1, lat2, lon2):
+        """
+        Adds a location to the grid.  Locations without coordinates are
+        left out.  Called with the lock held.
+        """
+        if lat1 is None or lon1 is None:
+            return
+        if lat2 is None or lon2 is None:
+            lat2, lon2 = lat1, lon1
+
+        x1, y1 = self.project(lat1, lon1)
+        x2, y2 = self.project(lat2, lon2)
+        self.shapes[loc_id] = (x1, y1, x2, y2)
+
+        minColumn, minRow = self.cellOf(min(x1, x2), min(y1, y2))
+        maxColumn, maxRow = self.cellOf(max(x1, x2), max(y1, y2))
+        cells = [(column, row) for column in xrange(minColumn, maxColumn + 1)
+                               for row in xrange(minRow, maxRow + 1)]
+        for cell in cells:
+            self.cells.setdefault(cell, []).append(loc_id)
+        self.cellsOf[loc_id] = cells
+
+        if self.bounds is None:
+            self.bounds = [minColumn, minRow, maxColumn, maxRow]
+        else:
+            self.bounds = [min(self.bounds[0], minColumn), min(self.bounds[1], minRow),
+                           max(self.bounds[2], maxColumn), max(self.bounds[3], maxRow)]
+
+    def removeShape(self, loc_id):
+        """
+        Removes a location from the grid.  The bounds are left as they
+        are, which only costs a search an extra ring or two.  Called with
+        the lock held.
+        """
+        for cell in self.cellsOf.pop(loc_id, ()):
+            self.cells[cell].remove(loc_id)
+            if len(self.cells[cell]) == 0:
+                del self.cells[cell]
+        self.shapes.pop(loc_id, None)
+
+    def isAvailable(self, loc_id, minAvailable):
+        """
+        Returns True if *loc_id* has at least *minAvailable* spaces free,
+        or if *minAvailable* is None.
+        """
+        if minAvailable is None:
+            return True
+        occ, oper = self.availability.get(loc_id, (None, None))
+        return occ is not None and oper is not None and oper - occ >= minAvailable
+
+    def result(self, meters, loc_id):
+        """
+        Returns the tuple for one location in the results of a query.
+        """
+        occ, oper = self.availability.get(loc_id, (None, None))
+        return (meters, loc_id, occ, oper)
+
+
+def ringCells(column, row, ring, bounds):
+    """
+    Returns the cells on the square ring *ring* cells out from (column,
+    row), or just that cell for ring 0, that are within *bounds*, as
+    [min column, min row, max column, max row].
+    """
+    minColumn, minRow, maxColumn, maxRow = bounds
+    if ring == 0:
+        return [(column, row)]
+    cells = []
+    top = row - ring
+    bottom = row + ring
+    for c in xrange(max(column - ring, minColumn), min(column + ring, maxColumn) + 1):
+        if top >= minRow:
+            cells.append((c, top))
+        if bottom <= maxRow:
+            cells.append((c, bottom))
+    left = column - ring
+    right = column + ring
+    for r in xrange(max(row - ring + 1, minRow), min(row + ring - 1, maxRow) + 1):
+        if left >= minColumn:
+            cells.append((left, r))
+        if right <= maxColumn:
+            cells.append((right, r))
+    return cells
+
+
+def segmentDistance(x, y, x1, y1, x2, y2):
+    """
+    Returns the distance from the point (x, y) to the line segment from
+    (x1, y1) to (x2, y2), which may be a single point.
+    """
+    dx = x2 - x1
+    dy = y2 - y1
+    lengthSquared = dx * dx + dy * dy
+    if lengthSquared == 0:
+        return math.hypot(x - x1, y - y1)
+
+    t = ((x - x1) * dx + (y - y1) * dy) / lengthSquared
+    if t < 0:
+        t = 0.0
+    elif t > 1:
+        t = 1.0
+    return math.hypot(x - (x1 + t * dx), y - (y1 + t * dy))
@@ -0,0 +1,162 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from sqlalchemy import inspect, select, func, distinct
+
+from SFparkDataModels import (SFparkStringRecord, SFparkRatesCodedRecord,
+                              SFparkOphrsCodedRecord)
+
+# the coded tables, each with a view named for its daily table plus
+# _decoded, that shows its rows with the strings, as in the daily table
+CODED_MODELS = (SFparkRatesCodedRecord, SFparkOphrsCodedRecord)
+
+
+class StringCodes(object):
+    """
+    The codes of the strings in sfpark_string, kept in memory so that
+    the strings in each day's rates and operating hours can be replaced
+    by their codes without a query.  A string that hasn't been seen is
+    added to sfpark_string, in the current transaction, the first time
+    it comes up.
+    """
+
+    def __init__(self):
+        # string -> code
+        self.codes = {}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def load(self, session):
+        """
+        Reads every code from sfpark_string, replacing any already held,
+        which may be from a transaction that was rolled back.
+        """
+        self.codes = dict((value, code) for code, value in
+                          session.query(SFparkStringRecord.id,
+                                        SFparkStringRecord.value))
+
+    def getCode(self, session, value):
+        """
+        Returns the code of the string *value*, adding it to sfpark_string
+        if it is new.  None stays None.
+        """
+        if value is None:
+            return None
+        code = self.codes.get(value)
+        if code is not None:
+            return code
+
+        # another collector may have added it since they were loaded
+        table = SFparkStringRecord.__table__
+        code = session.execute(select([table.c.id])
+                               .where(table.c.value == value)).scalar()
+        if code is None:
+            result = session.execute(table.insert().values(value=value))
+            code = result.inserted_primary_key[0]
+        self.codes[value] = code
+        return code
+
+    def encode(self, session, model, rows):
+        """
+        Replaces the strings in *rows*, row dictionaries for the daily
+        table of the coded table *model*, with their codes, in place.
+        Returns the rows.
+        """
+        for row in rows:
+            for column, codeColumn in model.codedColumns:
+                row[codeColumn] = self.getCode(session, row.pop(column))
+        return rows
+
+
+def getDecodedView(model):
+    """
+    Returns the name of the view of the coded table *model*.
+    """
+    return model.dailyModel.__tablename__ + '_decoded'
+
+
+def createDecodedViews(engine):
+    """
+    Creates the views sfpark_rates_decoded and sfpark_ophrs_decoded, if
+    they don't exist, which show the rows of the coded tables with their
+    strings, in the columns of sfpark_rates and sfpark_ophrs, for anyone
+    reading the database by hand.
+    """
+    existing = inspect(engine).get_view_names()
+    for model in CODED_MODELS:
+        name = getDecodedView(model)
+        if name in existing:
+            continue
+
+        columns = []
+        for column in model.dailyModel.__table__.columns:
+            if column.name in model.__table__.columns:
+                columns.append('c.%s' % column.name)
+            else:
+                columns.append('%s.value AS %s' % (column.name, column.name))
+        joins = ['LEFT JOIN %s %s ON %s.id = c.%s' %
+                 (SFparkStringRecord.__tablename__, column, column, codeColumn)
+                 for column, codeColumn in model.codedColumns]
+        engine.execute('CREATE VIEW %s AS SELECT %s FROM %s c %s' %
+                       (name, ', '.join(columns), model.__tablename__,
+                        ' '.join(joins)))
+
+
+def migrateToCodes(session, model, codes):
+    """
+    Copies every row of the daily table for the coded table *model*
+    into *model*, which must be empty, with the strings replaced by
+    their codes, adding any that are new to sfpark_string.  The copy is
+    a single INSERT ... SELECT, so the rows never leave the database.
+    Does not change the daily table, and does not commit.
+
+    *codes* is the StringCodes to add the strings to.
+
+    Returns the number of rows copied.
+    """
+    daily = model.dailyModel
+    if session.query(func.count(model.id)).scalar() > 0:
+        raise ValueError("%s already has rows.  Migrate before collecting "
+                         "with coded strings." % model.__tablename__)
+
+    for column, codeColumn in model.codedColumns:
+        for (value,) in session.query(distinct(getattr(daily, column))):
+            codes.getCode(session, value)
+
+    dailyTable = daily.__table__
+    stringTable = SFparkStringRecord.__table__
+    columns = []
+    values = []
+    source = dailyTable
+    for column in dailyTable.columns:
+        if column.name == 'id':
+            continue
+        if column.name in model.__table__.columns:
+            columns.append(column.name)
+            values.append(column)
+    for column, codeColumn in model.codedColumns:
+        strings = stringTable.alias(column)
+        source = source.outerjoin(strings, strings.c.value == dailyTable.c[column])
+        columns.append(codeColumn)
+        values.append(strings.c.id)
+
+    query = select(values).select_from(source).order_by(dailyTable.c.id)
+    result = session.execute(model.__table__.insert().from_select(columns, query))
+    return result.rowcount
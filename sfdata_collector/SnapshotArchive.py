@@ -0,0 +1,252 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import re
+import gzip
+import zlib
+import struct
+import datetime
+import threading
+
+# each frame starts with a magic string, and the lengths of the key and
+# the payload that follow it
+FRAME_MAGIC = 'SNAP'
+FRAME_HEADER = struct.Struct('>4sII')
+
+# format of the keys, which are the upstream timestamps
+KEY_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+# the date in the name of an archive file
+ARCHIVE_DATE = re.compile(r'-(\d{8})\.snap\.gz$')
+
+
+class SnapshotArchive(object):
+    """
+    An append-only archive of raw responses, so they can be re-parsed
+    later.  There is one file per day, named PREFIX-YYYYMMDD.snap.gz, in
+    *directory*.
+
+    Each response is written as a frame holding its upstream timestamp
+    and the raw bytes, compressed as a gzip member of its own.  A gzip
+    file made of several members reads back as one stream, so the whole
+    file can be read sequentially with readFrames().  Beside each file is
+    an index, PREFIX-YYYYMMDD.snap.idx, with a line for each frame giving
+    the timestamp, and the offset and length of its member, so a single
+    response can also be read directly with find().
+
+    A frame is indexed only after it is completely written, and readers
+    stop at a partly written frame.  If the collector crashes in the 
+    middle of an append, the partial frame is cut off before the next 
+    one is written to the same file, and so is a partly written line at
+    the end of the index, so the next line starts on a line of its own.
+    """
+
+    def __init__(self, directory, prefix):
+        """
+        Constructor.
+
+        *directory* is where the archive files go.  It is created if it
+        doesn't exist.
+
+        *prefix* starts each file name, normally the name of the source.
+        """
+        self.directory = directory
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        
+        # path -> the end of the last complete frame in that file
+        self.ends = {}
+        
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def pathFor(self, timestamp):
+        """
+        Returns the path of the archive file holding *timestamp*.
+        """
+        return os.path.join(self.directory, '%s-%s.snap.gz' %
+                            (self.prefix, timestamp.strftime('%Y%m%d')))
+
+    def append(self, timestamp, payload):
+        """
+        Adds the raw bytes of a response to the archive.
+
+        *timestamp* is the upstream update time of the response, as a
+        datetime, which determines which file it goes in.
+        """
+        key = timestamp.strftime(KEY_FORMAT)
+        path = self.pathFor(timestamp)
+
+        with self.lock:
+            if path not in self.ends:
+                repairIndex(path)
+                self.ends[path] = 0
+                for indexKey, offset, length in readIndex(path):
+                    self.ends[path] = offset + length
+            offset = self.ends[path]
+
+            if not os.path.exists(path):
+                open(path, 'wb').close()
+            f = open(path, 'r+b')
+            try:
+                f.truncate(offset)
+                f.seek(offset)
+                gz = gzip.GzipFile(fileobj=f, mode='wb')
+                gz.write(FRAME_HEADER.pack(FRAME_MAGIC, len(key), len(payload)))
+                gz.write(key)
+                gz.write(payload)
+                gz.close()
+                f.flush()
+                length = f.tell() - offset
+            finally:
+                f.close()
+
+            idx = open(indexPath(path), 'a')
+            try:
+                idx.write('%s\t%i\t%i\n' % (key, offset, length))
+            finally:
+                idx.close()
+            self.ends[path] = offset + length
+
+    def find(self, timestamp):
+        """
+        Returns the raw response with the upstream update time
+        *timestamp*, or None if it is not in the archive.
+        """
+        key = timestamp.strftime(KEY_FORMAT)
+        path = self.pathFor(timestamp)
+
+        for indexKey, offset, length in readIndex(path):
+            if indexKey == key:
+                f = open(path, 'rb')
+                try:
+                    f.seek(offset)
+                    for frameKey, payload in readFrames(f):
+                        return payload
+                finally:
+                    f.close()
+        return None
+
+
+def indexPath(path):
+    """
+    Returns the path of the index for the archive file *path*.
+    """
+    return path[:-len('.gz')] + '.idx'
+
+
+def readIndex(path):
+    """
+    Returns a list of (key, offset, length) for each frame in the
+    archive file *path*, in the order they were written.
+    """
+    entries = []
+    if not os.path.exists(indexPath(path)):
+        return entries
+
+    idx = open(indexPath(path), 'r')
+    try:
+        for line in idx:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) == 3:
+                entries.append((fields[0], int(fields[1]), int(fields[2])))
+    finally:
+        idx.close()
+    return entries
+
+
+def repairIndex(path):
+    """
+    Cuts off a partly written line at the end of the index for the
+    archive file *path*, left by a crash in the middle of an append.
+    """
+    if not os.path.exists(indexPath(path)):
+        return
+
+    idx = open(indexPath(path), 'r+b')
+    try:
+        content = idx.read()
+        if content and not content.endswith('\n'):
+            idx.truncate(content.rfind('\n') + 1)
+    finally:
+        idx.close()
+
+
+def readFrames(f):
+    """
+    Generates (timestamp, payload) for each frame in the archive file *f*,
+    which is either a path or a file object positioned at the start of
+    a frame.  The timestamp is a datetime.  Stops quietly at a frame that
+    was only partly written.
+    """
+    if isinstance(f, basestring):
+        gz = gzip.open(f, 'rb')
+    else:
+        gz = gzip.GzipFile(fileobj=f, mode='rb')
+
+    try:
+        while True:
+            try:
+                header = gz.read(FRAME_HEADER.size)
+                if len(header) < FRAME_HEADER.size:
+                    return
+                magic, keyLength, payloadLength = FRAME_HEADER.unpack(header)
+                if magic != FRAME_MAGIC:
+                    raise ValueError("Corrupt archive frame in %s" % gz.name)
+                key = gz.read(keyLength)
+                payload = gz.read(payloadLength)
+                if len(payload) < payloadLength:
+                    return
+            except (EOFError, IOError, struct.error, zlib.error):
+                return
+            yield datetime.datetime.strptime(key, KEY_FORMAT), payload
+    finally:
+        gz.close()
+
+
+def listArchiveFiles(directory, prefix, startDate=None, endDate=None):
+    """
+    Returns the paths of the archive files in *directory* for *prefix*,
+    in date order.  *startDate* and *endDate* are optional date ids, in
+    the form YYYYMMDD, that limit the files to that range, inclusive.
+    """
+    pattern = re.compile(r'^%s-(\d{8})\.snap\.gz$' % re.escape(prefix))
+
+    files = []
+    for name in os.listdir(directory):
+        match = pattern.match(name)
+        if match is None:
+            continue
+        date_id = int(match.group(1))
+        if startDate is not None and date_id < startDate:
+            continue
+        if endDate is not None and date_id > endDate:
+            continue
+        files.append((date_id, os.path.join(directory, name)))
+
+    files.sort()
+    return [path for date_id, path in files]
+
+
+def getArchiveDate(path):
+    """
+    Returns the date id, in the form YYYYMMDD, of the archive file *path*.
+    """
+    return int(ARCHIVE_DATE.search(os.path.basename(path)).group(1))
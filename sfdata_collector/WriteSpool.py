@@ -0,0 +1,330 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import re
+import zlib
+import struct
+import cPickle
+import threading
+
+# each frame starts with a magic string, and the length of the payload,
+# which is the pickled data, compressed
+FRAME_MAGIC = 'SPL1'
+FRAME_HEADER = struct.Struct('>4sI')
+
+# the name of a segment file, NAME-SEQUENCE.spool
+SEGMENT_PATTERN = re.compile(r'^(.+)-(\d{10})\.spool$')
+
+# a new segment is started once the last one is this big, so the
+# segments already written can be deleted while catching up
+SEGMENT_BYTES = 64 * 1024 * 1024
+
+
+class Segment(object):
+    """
+    One spool file, and how much of it has been committed to the
+    database.
+    """
+
+    def __init__(self, path, sealed):
+        self.path = path
+
+        # True once nothing more will be appended
+        self.sealed = sealed
+
+        # complete frames written, and the number and end offset of those
+        # committed, which are kept in the .done file beside it
+        self.frames = 0
+        self.done = 0
+        self.doneOffset = 0
+
+    def finished(self):
+        return self.sealed and self.done >= self.frames
+
+
+class WriteSpool(object):
+    """
+    A local, append-only spool of the data parsed by each source, so that
+    polling carries on at its usual pace whatever the state of the
+    database.  The fetch threads append to the spool, and the writers
+    drain it into the database when they can, in batches.
+
+    Each source has a series of segment files, NAME-SEQUENCE.spool, in
+    *directory*.  Each parsed item is pickled, compressed, and appended
+    as a frame, and the file is synced before append() returns.  A new
+    segment is started when the last one is all written to the database,
+    or grows past SEGMENT_BYTES.  The writers read frames up to the last
+    complete one, even from the segment still being appended to.
+    
+    Beside each segment is a .done file with the number of frames
+    committed to the database, and where they end, which is updated
+    after each commit.  A segment is deleted once it has all been
+    committed.  If the collector stops between a commit and the update,
+    that batch is read again at the next startup, and the writers skip
+    what the source says is already stored.  See 
+    DataSource.getStoredTime().
+
+    The spool holds pickled objects, so it should be drained by the same
+    version of the collector that wrote it.
+    """
+
+    def __init__(self, directory):
+        """
+        Constructor.  Picks up whatever is left in *directory* from the
+        last run, to be written first.  The directory is created if it
+        doesn't exist.
+        """
+        self.directory = directory
+        self.lock = threading.Lock()
+
+        # source name -> list of Segments, oldest first
+        self.segments = {}
+
+        # source name -> open file of the last segment, if not sealed
+        self.files = {}
+
+        self.nextSequence = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        found = []
+        for name in os.listdir(directory):
+            match = SEGMENT_PATTERN.match(name)
+            if match is not None:
+                found.append((int(match.group(2)), match.group(1), name))
+        for sequence, sourceName, name in sorted(found):
+            segment = Segment(os.path.join(directory, name), True)
+            segment.frames = countFrames(segment.path)
+            segment.done, segment.doneOffset = readDone(segment.path)
+            self.segments.setdefault(sourceName, []).append(segment)
+            self.nextSequence = sequence + 1
+        for name in self.segments.keys():
+            self.removeFinished(name)
+
+    def append(self, name, data):
+        """
+        Adds *data*, parsed by the source called *name*, to the end of its
+        spool.
+        """
+        payload = zlib.compress(cPickle.dumps(data, cPickle.HIGHEST_PROTOCOL), 1)
+
+        with self.lock:
+            f = self.files.get(name)
+            if f is not None:
+                segment = self.segments[name][-1]
+                if segment.done >= segment.frames or f.tell() >= SEGMENT_BYTES:
+                    self.seal(name)
+                    self.removeFinished(name)
+                    f = None
+            if f is None:
+                path = os.path.join(self.directory, '%s-%010i.spool' %
+                                    (name, self.nextSequence))
+                self.nextSequence += 1
+                f = open(path, 'ab')
+                self.files[name] = f
+                self.segments.setdefault(name, []).append(Segment(path, False))
+
+            f.write(FRAME_HEADER.pack(FRAME_MAGIC, len(payload)))
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+            self.segments[name][-1].frames += 1
+
+    def pending(self, name):
+        """
+        Returns the number of items from the source called *name* not yet
+        committed.
+        """
+        with self.lock:
+            return sum([s.frames - s.done for s in self.segments.get(name, [])])
+
+    def read(self, name, maxItems):
+        """
+        Returns up to *maxItems* of the oldest items from the source called
+        *name* not yet committed, and a position to pass to commit() once
+        they have been.  Returns an empty list if there are none.
+
+        The items stay in the spool until commit() is called, so if
+        writing them fails, the next read() returns them again.
+        """
+        # frames appended after this are left for the next read
+        with self.lock:
+            segments = [(s, s.frames) for s in self.segments.get(name, [])
+                        if s.frames > s.done]
+
+        items = []
+        position = []
+        for segment, frames in segments:
+            if len(items) >= maxItems:
+                break
+            f = open(segment.path, 'rb')
+            try:
+                f.seek(segment.doneOffset)
+                done = segment.done
+                for payload in readFrames(f):
+                    items.append(cPickle.loads(zlib.decompress(payload)))
+                    done += 1
+                    if len(items) >= maxItems or done >= frames:
+                        break
+                position.append((segment, done, f.tell()))
+            finally:
+                f.close()
+        return items, position
+
+    def commit(self, name, position):
+        """
+        Records that the items returned by read() with *position* have
+        been committed, and deletes the segments that are finished.
+        """
+        with self.lock:
+            for segment, done, offset in position:
+                segment.done = done
+                segment.doneOffset = offset
+                if not segment.finished():
+                    writeDone(segment.path, done, offset)
+
+            self.removeFinished(name)
+
+    def removeFinished(self, name):
+        """
+        Deletes the segments for the source called *name* that have all
+        been committed.  Called with the lock held.
+        """
+        segments = self.segments.get(name, [])
+        for segment in [s for s in segments if s.finished()]:
+            removeSegment(segment.path)
+            segments.remove(segment)
+
+    def seal(self, name):
+        """
+        Closes the segment being appended to for the source called *name*,
+        so the next append() starts a new one.  Called with the lock held.
+        """
+        f = self.files.pop(name, None)
+        if f is not None:
+            f.close()
+            self.segments[name][-1].sealed = True
+
+    def close(self):
+        """
+        Closes the open segments.  What is left in them is written at the
+        next startup.
+        """
+        with self.lock:
+            for name in self.files.keys():
+                self.seal(name)
+                self.removeFinished(name)
+
+
+def readFrames(f):
+    """
+    Generates the payload of each frame in the open file *f*, from its
+    current position.  Stops quietly at a frame that was only partly 
+    written. 
+    """
+    while True:
+        header = f.read(FRAME_HEADER.size)
+        if len(header) < FRAME_HEADER.size:
+            return
+        magic, length = FRAME_HEADER.unpack(header)
+        if magic != FRAME_MAGIC:
+            raise ValueError("Corrupt spool frame in %s" % f.name)
+        payload = f.read(length)
+        if len(payload) < length:
+            return
+        yield payload
+
+
+def countFrames(path):
+    """
+    Returns the number of complete frames in the segment *path*, reading
+    only their headers.
+    """
+    size = os.path.getsize(path)
+    frames = 0
+    f = open(path, 'rb')
+    try:
+        while True:
+            header = f.read(FRAME_HEADER.size)
+            if len(header) < FRAME_HEADER.size:
+                break
+            magic, length = FRAME_HEADER.unpack(header)
+            if magic != FRAME_MAGIC or f.tell() + length > size:
+                break
+            f.seek(length, os.SEEK_CUR)
+            frames += 1
+    finally:
+        f.close()
+    return frames
+
+
+def donePath(path):
+    """
+    Returns the path of the .done file for the segment *path*.
+    """
+    return path + '.done'
+
+
+def readDone(path):
+    """
+    Returns the (frames, offset) committed from the segment *path*, or
+    (0, 0) if none have been.
+    """
+    if not os.path.exists(donePath(path)):
+        return 0, 0
+    f = open(donePath(path), 'r')
+    try:
+        fields = f.read().split()
+    finally:
+        f.close()
+    if len(fields) != 2:
+        return 0, 0
+    return int(fields[0]), int(fields[1])
+
+
+def writeDone(path, done, offset):
+    """
+    Replaces the .done file of the segment *path*.
+    """
+    tempPath = donePath(path) + '.tmp'
+    f = open(tempPath, 'w')
+    try:
+        f.write('%i %i\n' % (done, offset))
+        f.flush()
+        os.fsync(f.fileno())
+    finally:
+        f.close()
+
+    # Windows won't rename over an existing file
+    try:
+        os.rename(tempPath, donePath(path))
+    except OSError:
+        os.remove(donePath(path))
+        os.rename(tempPath, donePath(path))
+
+
+def removeSegment(path):
+    """
+    Deletes the segment *path* and its .done file.
+    """
+    for p in (path, donePath(path)):
+        if os.path.exists(p):
+            os.remove(p)
@@ -0,0 +1,368 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import math
+import time
+import gzip
+import json
+import random
+import urlparse
+import datetime
+import optparse
+import threading
+import BaseHTTPServer
+import SocketServer
+from cStringIO import StringIO
+
+from SFparkResponse import getPacificOffset, getPacificNow
+
+USAGE = r"""
+
+ python sfpark_stubserver.py [options]
+
+ Serves made-up responses in the same form as the SFpark availability
+ service, for testing and benchmarking the collector without touching
+ the real server.  Point the collector at it with, for example:
+
+    http://localhost:8080/sfpark/rest/availabilityservice
+
+ Responses are gzip compressed if the client asks, and carry ETag and
+ Last-Modified headers, which change each time the data are refreshed.
+ TYPE=on or off, and LAT, LONG and RADIUS, in miles, limit the locations
+ returned, as they do on the real service.
+
+ options:
+
+ --port=N              Port to listen on (default 8080)
+ --locations=N         Number of locations in each response (default 5000)
+ --pricing-fraction=F  Fraction of locations with RATES and OPHRS (default 1.0)
+ --change-fraction=F   Fraction of locations whose occupancy changes at
+                       each refresh (default 0.1)
+ --refresh-seconds=N   Seconds between refreshes of the data.  Use 0 to
+                       refresh on every request (default 60)
+ --seed=N              Random seed, so runs can be repeated (default 0)
+"""
+
+# values that the SFpark service uses, for making realistic responses
+RATE_TIMES = ('12:00 AM', '7:00 AM', '9:00 AM', '12:00 PM', '3:00 PM',
+              '6:00 PM', '9:00 PM')
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.000"
+
+# miles per degree of latitude, for the RADIUS of a request
+MILES_PER_DEGREE = 69.05
+
+
+class SyntheticSFpark(object):
+    """
+    A made-up city of SFpark locations whose occupancy changes over time.
+    The locations and their schedules depend only on *seed*, so every
+    instance with the same arguments describes the same city.
+    """
+
+    def __init__(self, numLocations=5000, pricingFraction=1.0,
+                 changeFraction=0.1, seed=0,
+                 startTime=datetime.datetime(2013, 6, 1, 12, 0, 0)):
+        """
+        Constructor.
+
+        *numLocations* is the number of locations in each response.
+
+        *pricingFraction* is the fraction of locations that have RATES and
+        OPHRS.
+
+        *changeFraction* is the fraction of locations whose occupancy
+        changes each time advance() is called.
+
+        *startTime* is the initial AVAILABILITY_UPDATED_TIMESTAMP.
+        """
+        self.changeFraction = changeFraction
+        self.rand = random.Random(seed)
+        self.updatedTime = startTime
+
+        rand = random.Random(seed)
+        self.locations = []
+        self.occ = []
+        for i in range(numLocations):
+            lon = -122.5 + 0.15 * rand.random()
+            lat = 37.70 + 0.11 * rand.random()
+            oper = rand.randint(1, 40)
+
+            if rand.random() < 0.1:
+                avl = {'TYPE'  : 'OFF',
+                       'OSPID' : str(1000 + i),
+                       'NAME'  : 'Garage %i' % i,
+                       'DESC'  : '%i Market St' % i,
+                       'INTER' : 'Market St and %i Ave' % (i % 40),
+                       'TEL'   : '(415) 555-%04i' % (i % 10000),
+                       'PTS'   : '1',
+                       'LOC'   : '%.8f,%.8f' % (lon, lat)}
+            else:
+                avl = {'TYPE'  : 'ON',
+                       'BFID'  : str(100000 + i),
+                       'NAME'  : '%i Ave (%i - %i)' % (i % 40, i, i+99),
+                       'PTS'   : '2',
+                       'LOC'   : '%.8f,%.8f,%.8f,%.8f' %
+                                 (lon, lat, lon + 0.001, lat + 0.001)}
+            avl['OPER'] = str(oper)
+
+            if rand.random() < pricingFraction:
+                rates = []
+                for j in range(len(RATE_TIMES) - 1):
+                    rates.append({'BEG'  : RATE_TIMES[j],
+                                  'END'  : RATE_TIMES[j+1],
+                                  'RATE' : '%.2f' % (0.25 * rand.randint(0, 24)),
+                                  'RQ'   : 'Per hour'})
+                avl['RATES'] = {'RS' : rates}
+
+                avl['OPHRS'] = {'OPS' : [{'FROM' : 'Monday',
+                                          'TO'   : 'Friday',
+                                          'BEG'  : '7:00 AM',
+                                          'END'  : '6:00 PM'},
+                                         {'FROM' : 'Saturday',
+                                          'BEG'  : '9:00 AM',
+                                          'END'  : '6:00 PM'}]}
+
+            self.locations.append(avl)
+            self.occ.append(rand.randint(0, oper))
+
+    def advance(self, updatedTime=None):
+        """
+        Moves on to the next refresh.  The occupancy of *changeFraction*
+        of the locations changes, and the updated time becomes
+        *updatedTime*, or one minute later if it is not given.
+        """
+        if updatedTime is None:
+            updatedTime = self.updatedTime + datetime.timedelta(minutes=1)
+        self.updatedTime = updatedTime
+
+        numChanged = int(round(self.changeFraction * len(self.locations)))
+        for i in self.rand.sample(xrange(len(self.locations)), numChanged):
+            oper = int(self.locations[i]['OPER'])
+            self.occ[i] = self.rand.randint(0, oper)
+
+    def response(self, pricing=True, area=None):
+        """
+        Returns the current state as a dictionary with the same structure
+        as the parsed json response from the SFpark availability service.
+        RATES and OPHRS are left out if *pricing* is False, as they are
+        when a request has PRICING=no.
+
+        *area* is an optional (type, lat, lon, radius) to limit the 
+        locations to, with any of them None to not limit by it.  *type* 
+        is 'ON' or 'OFF', and the radius is in miles from the first point
+        of each location's LOC.
+        """
+        avlList = []
+        for avl, occ in zip(self.locations, self.occ):
+            if area is not None and not inArea(avl, area):
+                continue
+            if pricing:
+                avl = dict(avl)
+            else:
+                avl = dict([(key, value) for key, value in avl.iteritems()
+                            if key not in ('RATES', 'OPHRS')])
+            avl['OCC'] = str(occ)
+            avlList.append(avl)
+
+        timestamp = formatTimestamp(self.updatedTime)
+        return {'STATUS' : 'SUCCESS',
+                'AVAILABILITY_UPDATED_TIMESTAMP' : timestamp,
+                'AVAILABILITY_REQUEST_TIMESTAMP' : timestamp,
+                'NUM_RECORDS' : str(len(avlList)),
+                'MESSAGE' : 'Synthetic response',
+                'AVL' : avlList}
+
+
+class StubRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Answers GET requests with the current state of the server's
+    SyntheticSFpark, whatever the path.
+    """
+
+    def do_GET(self):
+        server = self.server
+        params = urlparse.parse_qs(urlparse.urlparse(self.path).query)
+        pricing = params.get('PRICING', ['yes'])[0].lower() != 'no'
+        gzipped = 'gzip' in self.headers.get('Accept-Encoding', '')
+
+        try:
+            area = getArea(params)
+        except ValueError:
+            self.send_error(400)
+            return
+
+        etag, lastModified, body = server.getBody(pricing, gzipped, area)
+
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', lastModified)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    An HTTP server standing in for the SFpark availability service.  The
+    data are refreshed every *refreshSeconds*, or on every request if it
+    is 0.  Encoded responses are cached between refreshes, so serving
+    them is cheap compared to the collector's work.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port, synthetic, refreshSeconds=60, verbose=False):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port),
+                                           StubRequestHandler)
+        self.synthetic = synthetic
+        self.refreshSeconds = refreshSeconds
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.lastRefresh = time.time()
+        self.cache = {}
+
+    def getBody(self, pricing, gzipped, area=None):
+        """
+        Returns (etag, last-modified, body) for the current data, in 
+        *area*, as for SyntheticSFpark.response().
+        """
+        with self.lock:
+            now = time.time()
+            if self.refreshSeconds == 0 or now - self.lastRefresh >= self.refreshSeconds:
+                if self.refreshSeconds == 0 or len(self.cache) > 0:
+                    self.synthetic.advance()
+                self.lastRefresh = now
+                self.cache = {}
+
+            key = (pricing, gzipped, area)
+            if key not in self.cache:
+                body = json.dumps(self.synthetic.response(pricing, area))
+                if gzipped:
+                    buf = StringIO()
+                    gz = gzip.GzipFile(fileobj=buf, mode='wb')
+                    gz.write(body)
+                    gz.close()
+                    body = buf.getvalue()
+
+                updated = self.synthetic.updatedTime
+                etag = '"%s-%i"' % (updated.strftime('%Y%m%d%H%M%S'), pricing)
+                lastModified = updated.strftime('%a, %d %b %Y %H:%M:%S GMT')
+                self.cache[key] = (etag, lastModified, body)
+
+            return self.cache[key]
+
+    def url(self):
+        return 'http://127.0.0.1:%i/sfpark/rest/availabilityservice' % self.server_port
+
+
+def formatTimestamp(local):
+    """
+    Returns the naive San Francisco time *local* as an
+    AVAILABILITY_UPDATED_TIMESTAMP, with the UTC offset then in force.
+    """
+    offset = getPacificOffset(local)
+    return local.strftime(TIMESTAMP_FORMAT) + '-%02i:00' % (-offset.days * 24 - 
+                                                          offset.seconds // 3600)
+
+
+def getArea(params):
+    """
+    Returns the (type, lat, lon, radius) that the parsed query string 
+    *params* limits the locations to, or None for all of them.  Raises a
+    ValueError if a number doesn't parse.
+    """
+    locType = params.get('TYPE', ['all'])[0].upper()
+    if locType not in ('ON', 'OFF'):
+        locType = None
+    lat = lon = radius = None
+    if 'LAT' in params and 'LONG' in params:
+        lat = float(params['LAT'][0])
+        lon = float(params['LONG'][0])
+        radius = float(params.get('RADIUS', ['0.5'])[0])
+    if locType is None and lat is None:
+        return None
+    return (locType, lat, lon, radius)
+
+
+def inArea(avl, area):
+    """
+    Returns True if the AVL record *avl* is within *area*, from getArea().
+    """
+    locType, lat, lon, radius = area
+    if locType is not None and avl['TYPE'] != locType:
+        return False
+    if lat is not None:
+        point = avl['LOC'].split(',')
+        dx = (float(point[0]) - lon) * MILES_PER_DEGREE * math.cos(math.radians(lat))
+        dy = (float(point[1]) - lat) * MILES_PER_DEGREE
+        if math.sqrt(dx*dx + dy*dy) > radius:
+            return False
+    return True
+
+
+def startStubServer(synthetic, refreshSeconds=60, port=0):
+    """
+    Starts a StubServer in a background thread, and returns it.  With
+    *port* 0, any free port is used, which is available from the server's
+    url() method.
+    """
+    server = StubServer(port, synthetic, refreshSeconds)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+if __name__ == "__main__":
+
+    parser = optparse.OptionParser(usage=USAGE)
+    parser.add_option('--port', dest='port', type='int', default=8080)
+    parser.add_option('--locations', dest='locations', type='int', default=5000)
+    parser.add_option('--pricing-fraction', dest='pricingFraction', type='float',
+                      default=1.0)
+    parser.add_option('--change-fraction', dest='changeFraction', type='float',
+                      default=0.1)
+    parser.add_option('--refresh-seconds', dest='refreshSeconds', type='float',
+                      default=60)
+    parser.add_option('--seed', dest='seed', type='int', default=0)
+    (options, args) = parser.parse_args()
+
+    synthetic = SyntheticSFpark(options.locations, options.pricingFraction,
+                                options.changeFraction, options.seed,
+                                getPacificNow())
+    server = StubServer(options.port, synthetic, options.refreshSeconds, verbose=True)
+    print "Serving %i synthetic locations at %s" % (options.locations, server.url())
+    print "Press Ctrl-C to quit."
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
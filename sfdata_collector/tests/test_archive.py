@@ -0,0 +1,170 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import json
+import shutil
+import datetime
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from SFparkDataModels import (Base, SFparkLocationRecord, SFparkAvailabilityRecord,
+                              SFparkRatesRecord, SFparkOphrsRecord)
+from SFparkSource import SFparkSource
+from SnapshotArchive import (SnapshotArchive, readFrames, readIndex, indexPath,
+                             listArchiveFiles, getArchiveDate)
+from sfpark_replay import replayFile
+from sfpark_stubserver import SyntheticSFpark
+
+LOCATIONS = 10
+POLLS = 5
+DAY = datetime.datetime(2013, 6, 1, 12)
+MODELS = (SFparkLocationRecord, SFparkAvailabilityRecord, SFparkRatesRecord, SFparkOphrsRecord)
+
+
+class SnapshotArchiveTest(unittest.TestCase):
+    """
+    Raw responses archived a file a day, read back in order or one at
+    a time, and replayed into the database.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def appendPolls(self, archive, start, polls):
+        for i in range(polls):
+            archive.append(start + datetime.timedelta(minutes=i), 'poll %i' % i)
+
+    def readKeys(self, path):
+        return [timestamp for timestamp, payload in readFrames(path)]
+
+    def testRotation(self):
+        archive = SnapshotArchive(self.directory, 'test')
+        for day in range(3):
+            self.appendPolls(archive, DAY + datetime.timedelta(days=day), POLLS)
+
+        paths = listArchiveFiles(self.directory, 'test')
+        self.assertEqual([getArchiveDate(path) for path in paths],
+                         [20130601, 20130602, 20130603])
+        self.assertEqual(listArchiveFiles(self.directory, 'test', 20130602, 20130602),
+                         paths[1:2])
+        self.assertEqual(listArchiveFiles(self.directory, 'other'), [])
+
+        second = DAY + datetime.timedelta(days=1)
+        self.assertEqual(self.readKeys(paths[1]),
+                         [second + datetime.timedelta(minutes=i) for i in range(POLLS)])
+        self.assertEqual([key for key, offset, length in readIndex(paths[1])],
+                         [(second + datetime.timedelta(minutes=i)).strftime('%Y-%m-%dT%H:%M:%S')
+                          for i in range(POLLS)])
+        self.assertEqual(archive.find(second + datetime.timedelta(minutes=3)), 'poll 3')
+        self.assertEqual(archive.find(second + datetime.timedelta(minutes=POLLS)), None)
+
+        # a new archive on the same directory carries on at the end
+        archive = SnapshotArchive(self.directory, 'test')
+        archive.append(second + datetime.timedelta(minutes=POLLS), 'poll %i' % POLLS)
+        self.assertEqual(len(self.readKeys(paths[1])), POLLS + 1)
+        self.assertEqual(archive.find(second + datetime.timedelta(minutes=POLLS)),
+                         'poll %i' % POLLS)
+
+    def testTornFrame(self):
+        # a crash in the middle of a frame leaves it partly written
+        archive = SnapshotArchive(self.directory, 'test')
+        self.appendPolls(archive, DAY, POLLS)
+        path = archive.pathFor(DAY)
+        f = open(path, 'ab')
+        f.write('\x1f\x8b\x08\x00partial')
+        f.close()
+        self.assertEqual(len(self.readKeys(path)), POLLS)
+
+        archive = SnapshotArchive(self.directory, 'test')
+        archive.append(DAY + datetime.timedelta(minutes=POLLS), 'after')
+        self.assertEqual(len(self.readKeys(path)), POLLS + 1)
+        self.assertEqual(archive.find(DAY + datetime.timedelta(minutes=POLLS)), 'after')
+
+    def testTornIndex(self):
+        # a crash in the middle of an index line leaves it partly written
+        archive = SnapshotArchive(self.directory, 'test')
+        self.appendPolls(archive, DAY, POLLS)
+        path = archive.pathFor(DAY)
+        idx = open(indexPath(path), 'a')
+        idx.write('2013-06-01T12:05:00\t12')
+        idx.close()
+
+        archive = SnapshotArchive(self.directory, 'test')
+        archive.append(DAY + datetime.timedelta(minutes=POLLS), 'after')
+        self.assertEqual(len(readIndex(path)), POLLS + 1)
+        self.assertEqual(len(self.readKeys(path)), POLLS + 1)
+        for i in range(POLLS):
+            self.assertEqual(archive.find(DAY + datetime.timedelta(minutes=i)), 'poll %i' % i)
+
+        # the next frame is written after the last, not over it
+        archive = SnapshotArchive(self.directory, 'test')
+        archive.append(DAY + datetime.timedelta(minutes=POLLS + 1), 'later')
+        self.assertEqual(len(self.readKeys(path)), POLLS + 2)
+        self.assertEqual(archive.find(DAY + datetime.timedelta(minutes=POLLS)), 'after')
+
+    def countRows(self, session):
+        return [session.query(model).count() for model in MODELS]
+
+    def testReplay(self):
+        # the collector archives what it parses
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        source = SFparkSource(archive=SnapshotArchive(self.directory, SFparkSource.name))
+        source.initialize(session)
+        synthetic = SyntheticSFpark(LOCATIONS, changeFraction=0.3)
+        for i in range(POLLS):
+            source.write(session, source.parseContent(json.dumps(synthetic.response())))
+            synthetic.advance()
+        collected = self.countRows(session)
+        self.assertEqual(collected[1], LOCATIONS * POLLS)
+
+        # replaying the archive gives the same rows, once
+        dbstring = 'sqlite:///%s' % os.path.join(self.directory, 'replay.db')
+        replayEngine = create_engine(dbstring)
+        Base.metadata.create_all(replayEngine)
+        paths = listArchiveFiles(self.directory, SFparkSource.name)
+        self.assertEqual(len(paths), 1)
+        job = (dbstring, paths[0], 2, 'bulk', None, False, False)
+        path, numResponses, numRows, seconds = replayFile(job)
+        self.assertEqual(numResponses, POLLS)
+        replayed = sessionmaker(bind=replayEngine)()
+        self.assertEqual(self.countRows(replayed), collected)
+        replayed.close()
+
+        path, numResponses, numRows, seconds = replayFile(job)
+        self.assertEqual((numResponses, numRows), (0, 0))
+        replayed = sessionmaker(bind=replayEngine)()
+        self.assertEqual(self.countRows(replayed), collected)
+        replayed.close()
+        replayEngine.dispose()
+
+
+if __name__ == '__main__':
+    unittest.main()
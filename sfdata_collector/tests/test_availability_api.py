@@ -0,0 +1,175 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from SFparkDataModels import Base
+from SFparkSource import SFparkSource
+from SFparkSpatialIndex import segmentDistance
+from AvailabilityApi import AvailabilityApi
+from sfpark_stubserver import SyntheticSFpark
+
+
+class NearbyTest(unittest.TestCase):
+    """
+    Nearest and within-radius queries through AvailabilityApi, against 
+    the locations written to an in-memory database.
+    """
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        self.synthetic = SyntheticSFpark(500, changeFraction=0.3)
+
+        self.source = SFparkSource(spatialIndex=True, latestCache=True)
+        self.source.initialize(self.session)
+        self.api = AvailabilityApi({'sfpark' : self.source.latest})
+        self.poll()
+
+    def tearDown(self):
+        self.session.close()
+
+    def poll(self):
+        data = json.loads(json.dumps(self.synthetic.response()))
+        self.source.write(self.session, self.source.parseJson(data))
+        self.synthetic.advance()
+
+    def getJson(self, path, query):
+        status, etag, body = self.api.get(path, query)
+        self.assertEqual(status, 200)
+        return json.loads(body)
+
+    def bruteForce(self, lat, lon, minAvailable=None):
+        """
+        Returns the (meters, loc_id) of every location, nearest first.
+        """
+        index = self.source.index
+        x, y = index.project(lat, lon)
+        return sorted((segmentDistance(x, y, *shape), loc_id)
+                      for loc_id, shape in index.shapes.items()
+                      if index.isAvailable(loc_id, minAvailable))
+
+    def testNearest(self):
+        rand = random.Random(1)
+        for i in range(50):
+            lat = 37.70 + 0.11 * rand.random()
+            lon = -122.5 + 0.15 * rand.random()
+            k = rand.choice([1, 5, 20])
+            found = self.getJson('/sfpark/nearest', {'lat' : str(lat), 'lon' : str(lon),
+                                                     'k' : str(k)})
+            expected = self.bruteForce(lat, lon)[:k]
+            self.assertEqual(found['count'], k)
+            self.assertEqual([location['id'] for location in found['locations']],
+                             [loc_id for meters, loc_id in expected])
+            meters = [location['meters'] for location in found['locations']]
+            self.assertEqual(meters, sorted(meters))
+
+    def testWithin(self):
+        rand = random.Random(2)
+        for i in range(50):
+            lat = 37.70 + 0.11 * rand.random()
+            lon = -122.5 + 0.15 * rand.random()
+            radius = rand.choice([50, 300, 1000])
+            minAvailable = rand.choice([None, 3])
+            query = {'lat' : str(lat), 'lon' : str(lon), 'radius' : str(radius)}
+            if minAvailable is not None:
+                query['min_available'] = str(minAvailable)
+            found = self.getJson('/sfpark/within', query)
+            expected = [loc_id for meters, loc_id in self.bruteForce(lat, lon, minAvailable)
+                        if meters <= radius]
+            self.assertEqual([location['id'] for location in found['locations']],
+                             expected)
+
+    def testBadQueries(self):
+        for path, query in (('/sfpark/nearest', {'lat' : '37.78'}),
+                            ('/sfpark/nearest', {'lat' : '37.78', 'lon' : 'west'}),
+                            ('/sfpark/nearest', {'lat' : '37.78', 'lon' : '-122.4', 'k' : '0'}),
+                            ('/sfpark/nearest', {'lat' : '37.78', 'lon' : '-122.4', 'x' : '1'}),
+                            ('/sfpark/within', {'lat' : '37.78', 'lon' : '-122.4'}),
+                            ('/sfpark/within', {'lat' : '37.78', 'lon' : '-122.4',
+                                                'radius' : 'inf'}),
+                            ('/sfpark/within', {'lat' : 'inf', 'lon' : '-122.4',
+                                                'radius' : '100'}),
+                            ('/sfpark/within', {'lat' : '37.78', 'lon' : 'nan',
+                                                'radius' : '100'}),
+                            ('/sfpark/within', {'lat' : '1e308', 'lon' : '-122.4',
+                                                'radius' : '100'}),
+                            ('/sfpark/within', {'lat' : '37.78', 'lon' : '-122.4',
+                                                'radius' : '-5'}),
+                            ('/sfpark/nearest', {'lat' : '37.78', 'lon' : '-122.4',
+                                                 'k' : '-3'}),
+                            ('/sfpark/nearest', {'lat' : '37.78', 'lon' : '-122.4',
+                                                 'k' : 'inf'}),
+                            ('/sfpark/nearest', {'lat' : '37.78', 'lon' : '-1e308'})):
+            self.assertEqual(self.api.get(path, query)[0], 400)
+        self.assertEqual(self.api.get('/sfpark/farthest', {})[0], 404)
+
+    def testHugeQueries(self):
+        # a radius or a point far beyond the locations only searches the 
+        # cells that hold any, so is as quick as one across the city
+        everything = self.bruteForce(37.7, -122.4)
+        start = time.time()
+        found = self.getJson('/sfpark/within', {'lat' : '37.7', 'lon' : '-122.4',
+                                                'radius' : '200000000'})
+        self.assertEqual([location['id'] for location in found['locations']],
+                         [loc_id for meters, loc_id in everything])
+        found = self.getJson('/sfpark/nearest', {'lat' : '-60', 'lon' : '100',
+                                                 'k' : '3'})
+        self.assertEqual([location['id'] for location in found['locations']],
+                         [loc_id for meters, loc_id in self.bruteForce(-60, 100)[:3]])
+        found = self.getJson('/sfpark/within', {'lat' : '-60', 'lon' : '100',
+                                                'radius' : '1000'})
+        self.assertEqual(found['count'], 0)
+        self.assertLess(time.time() - start, 0.5)
+
+    def testWithoutIndex(self):
+        source = SFparkSource(latestCache=True)
+        source.initialize(self.session)
+        api = AvailabilityApi({'sfpark' : source.latest})
+        query = {'lat' : '37.78', 'lon' : '-122.4', 'radius' : '500'}
+        self.assertEqual(api.get('/sfpark/nearest', query)[0], 404)
+        self.assertEqual(api.get('/sfpark/within', query)[0], 404)
+
+    def testUpdatedByWrites(self):
+        query = {'lat' : '37.78', 'lon' : '-122.4', 'k' : '10'}
+        before = self.getJson('/sfpark/nearest', query)
+        self.poll()
+        after = self.getJson('/sfpark/nearest', query)
+        self.assertNotEqual(after['updated'], before['updated'])
+
+        latest = dict([(location['id'], location)
+                       for location in self.getJson('/sfpark/locations', {})['locations']])
+        for location in after['locations']:
+            self.assertEqual(location['occ'], latest[location['id']]['occ'])
+            self.assertEqual(location['oper'], latest[location['id']]['oper'])
+
+
+if __name__ == '__main__':
+    unittest.main()
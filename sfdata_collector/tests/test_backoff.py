@@ -0,0 +1,99 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Backoff import Backoff
+from DataSource import DataSource
+from WriteSpool import WriteSpool
+from CollectorPipeline import SpoolDrainerThread
+
+
+class FlakySpool(WriteSpool):
+    """
+    A WriteSpool whose first *failures* reads raise an error.
+    """
+
+    def __init__(self, directory, failures):
+        WriteSpool.__init__(self, directory)
+        self.failures = failures
+
+    def read(self, name, maxItems):
+        if self.failures > 0:
+            self.failures -= 1
+            raise IOError("Can't read the spool")
+        return WriteSpool.read(self, name, maxItems)
+
+
+class BackoffTest(unittest.TestCase):
+
+    def testLongOutage(self):
+        backoff = Backoff(1.0, 300.0)
+        for attempt in (0, 10, 1023, 1024, 5000, 10 ** 6):
+            self.assertTrue(0 <= backoff.delay(attempt) <= 300.0)
+
+        backoff.failures = 5000
+        self.assertTrue(0 <= backoff.failed() <= 300.0)
+        self.assertEqual(backoff.failures, 5001)
+
+
+class SpoolDrainerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testSurvivesErrors(self):
+        source = DataSource()
+        source.name = 'test'
+        spool = FlakySpool(self.directory, 3)
+        for i in range(5):
+            spool.append(source.name, i)
+
+        written = []
+        drainer = SpoolDrainerThread('drain-test', [source], spool,
+                                     lambda item: written.extend(item[1]),
+                                     2, Backoff(0.001, 0.01))
+        drainer.start()
+        try:
+            deadline = time.time() + 10
+            while len(written) < 5 and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertTrue(drainer.is_alive())
+        finally:
+            drainer.stopEvent.set()
+            drainer.wakeEvent.set()
+            drainer.join(10)
+
+        self.assertEqual(written, range(5))
+        self.assertEqual(drainer.errors, 3)
+        self.assertEqual(spool.pending(source.name), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import json
+import datetime
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+from SFparkDataModels import (Base, SFparkLocationRecord, SFparkAvailabilityRecord,
+                              SFparkRatesRecord, SFparkOphrsRecord)
+from SFparkSource import SFparkSource
+from SFparkBulkWriter import resolveWriteMode, copyRows, copyValue
+from sfpark_stubserver import SyntheticSFpark
+
+# the tables written each poll
+MODELS = (SFparkLocationRecord, SFparkRatesRecord, SFparkOphrsRecord,
+          SFparkAvailabilityRecord)
+
+
+def makeSession():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)()
+
+
+def readTable(session, model):
+    """
+    Returns every row of the table of *model*, without the ids of the
+    tables whose ids are only row numbers, sorted.
+    """
+    table = model.__table__
+    columns = [c for c in table.columns
+               if model is SFparkLocationRecord or c.name != 'id']
+    return sorted([tuple(row) for row in session.execute(select(columns))])
+
+
+class WriteModeTest(unittest.TestCase):
+    """
+    Every write mode stores the same rows.
+    """
+
+    def collect(self, writeMode, polls=3):
+        session = makeSession()
+        source = SFparkSource(writeMode=writeMode)
+        source.initialize(session)
+        synthetic = SyntheticSFpark(30, changeFraction=0.3)
+        for i in range(polls):
+            data = json.loads(json.dumps(synthetic.response()))
+            source.write(session, source.parseJson(data))
+            synthetic.advance()
+        return session
+
+    def testSameRows(self):
+        expected = self.collect('orm')
+        for writeMode in ('core', 'bulk'):
+            session = self.collect(writeMode)
+            for model in MODELS:
+                rows = readTable(session, model)
+                self.assertTrue(len(rows) > 0)
+                self.assertEqual(rows, readTable(expected, model),
+                                 "%s %s" % (writeMode, model.__tablename__))
+            session.close()
+        self.assertEqual(len(readTable(expected, SFparkAvailabilityRecord)), 90)
+
+    def testBatchMatchesSingleWrites(self):
+        expected = self.collect('bulk')
+        session = makeSession()
+        source = SFparkSource()
+        source.initialize(session)
+        synthetic = SyntheticSFpark(30, changeFraction=0.3)
+        responses = []
+        for i in range(3):
+            responses.append(source.parseJson(json.loads(json.dumps(synthetic.response()))))
+            synthetic.advance()
+        source.writeBatch(session, responses)
+        for model in MODELS:
+            self.assertEqual(readTable(session, model), readTable(expected, model))
+
+    def testResolve(self):
+        session = makeSession()
+        self.assertEqual(resolveWriteMode(session, 'bulk'), 'core')
+        self.assertEqual(resolveWriteMode(session, 'orm'), 'orm')
+
+
+class CopyTest(unittest.TestCase):
+    """
+    The COPY text sent to PostgreSQL, through a stand-in connection.
+    """
+
+    def testValues(self):
+        self.assertEqual(copyValue(None), '\\N')
+        self.assertEqual(copyValue(3), '3')
+        self.assertEqual(copyValue(0.1), '0.1')
+        self.assertEqual(copyValue(datetime.datetime(2013, 6, 1, 12, 0, 5)),
+                         '2013-06-01T12:00:05')
+        self.assertEqual(copyValue(datetime.time(7, 30)), '07:30:00')
+        self.assertEqual(copyValue('a\tb\nc\\d\re'), 'a\\tb\\nc\\\\d\\re')
+        self.assertEqual(copyValue(u'caf\xe9'), 'caf\xc3\xa9')
+
+    def testCopyRows(self):
+        cursor = CopyCursor()
+        rows = [{'loc_id' : 1, 'date_id' : 20130601, 'occ' : 2, 'oper' : None,
+                 'availability_updated_timestamp' : datetime.datetime(2013, 6, 1, 12)},
+                {'loc_id' : 2, 'date_id' : 20130601, 'occ' : 0, 'oper' : 4,
+                 'availability_updated_timestamp' : datetime.datetime(2013, 6, 1, 12)}]
+        copyRows(CopySession(cursor), SFparkAvailabilityRecord.__table__, rows)
+        self.assertEqual(cursor.sql, 'COPY sfpark_avl (loc_id, date_id, '
+                         'availability_updated_timestamp, occ, oper) FROM STDIN')
+        self.assertEqual(cursor.data, '1\t20130601\t2013-06-01T12:00:00\t2\t\\N\n'
+                                      '2\t20130601\t2013-06-01T12:00:00\t0\t4\n')
+        self.assertTrue(cursor.closed)
+
+
+class CopyCursor(object):
+
+    def __init__(self):
+        self.sql = None
+        self.data = None
+        self.closed = False
+
+    def copy_expert(self, sql, buf):
+        self.sql = sql
+        self.data = buf.read()
+
+    def close(self):
+        self.closed = True
+
+
+class CopySession(object):
+    """
+    Has just enough of a Session for copyRows(): its connection's DBAPI
+    connection gives out *cursor*.
+    """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def connection(self):
+        return CopyConnection(self.cursor)
+
+
+class CopyConnection(object):
+
+    def __init__(self, cursor):
+        self.connection = self
+        self.cursorObject = cursor
+
+    def cursor(self):
+        return self.cursorObject
+
+
+if __name__ == '__main__':
+    unittest.main()
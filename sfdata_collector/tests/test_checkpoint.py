@@ -0,0 +1,140 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from SFparkDataModels import Base
+from SFparkSource import SFparkSource
+from CollectorCheckpoint import CollectorCheckpoint
+from sfpark_stubserver import SyntheticSFpark
+
+
+class CheckpointTest(unittest.TestCase):
+    """
+    Restarting a source from a checkpoint, against an in-memory database.
+    """
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        Base.metadata.create_all(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'checkpoint.json')
+        self.synthetic = SyntheticSFpark(50, changeFraction=0.2)
+
+        # the SQL run on the connection, while recording
+        self.statements = None
+        event.listen(self.engine, 'before_cursor_execute', self.record)
+
+    def tearDown(self):
+        self.session.close()
+        shutil.rmtree(self.directory)
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        if self.statements is not None:
+            self.statements.append(statement)
+
+    def collect(self, source, checkpoint, polls):
+        for i in range(polls):
+            data = json.loads(json.dumps(self.synthetic.response()))
+            source.write(self.session, source.parseJson(data))
+            checkpoint.save(source)
+            self.synthetic.advance()
+
+    def makeSource(self):
+        return SFparkSource(keyframeMinutes=15, spatialIndex=True, latestCache=True)
+
+    def testBoundedStartup(self):
+        source = self.makeSource()
+        source.initialize(self.session)
+        self.collect(source, CollectorCheckpoint(self.path), 5)
+
+        self.statements = []
+        restarted = self.makeSource()
+        restarted.initialize(self.session, CollectorCheckpoint(self.path).getState('sfpark'))
+        self.assertEqual(restarted.lastUpdatedTime, source.lastUpdatedTime)
+        self.assertEqual(restarted.lastAvailability, source.lastAvailability)
+
+        # every read of sfpark_avl is limited to the last day
+        reads = [statement for statement in self.statements if 'sfpark_avl' in statement]
+        self.assertTrue(len(reads) > 0)
+        for statement in reads:
+            self.assertTrue('date_id >=' in statement, statement)
+
+    def testRestore(self):
+        source = self.makeSource()
+        source.initialize(self.session)
+        self.collect(source, CollectorCheckpoint(self.path), 3)
+
+        restarted = self.makeSource()
+        restarted.initialize(self.session, CollectorCheckpoint(self.path).getState('sfpark'))
+        self.assertEqual(restarted.getState(), source.getState())
+
+        # nothing has changed, so no location is written again
+        rowCounts = {}
+        data = json.loads(json.dumps(self.synthetic.response()))
+        restarted.write(self.session, restarted.parseJson(data), rowCounts=rowCounts)
+        self.assertEqual(rowCounts.get('sfpark_loc', 0), 0)
+
+    def testStale(self):
+        # a write after the last save leaves the checkpoint behind the
+        # database, so it isn't used
+        source = self.makeSource()
+        source.initialize(self.session)
+        self.collect(source, CollectorCheckpoint(self.path), 2)
+        data = json.loads(json.dumps(self.synthetic.response()))
+        source.write(self.session, source.parseJson(data))
+
+        restarted = self.makeSource()
+        restarted.initialize(self.session, CollectorCheckpoint(self.path).getState('sfpark'))
+        self.assertEqual(restarted.lastUpdatedTime, source.lastUpdatedTime)
+
+        # read from the database, so every location is written once more
+        self.assertEqual(restarted.locationHashes.values(), [None] * 50)
+        self.assertEqual(restarted.lastAvailability, source.lastAvailability)
+
+    def testOtherMode(self):
+        source = self.makeSource()
+        source.initialize(self.session)
+        self.collect(source, CollectorCheckpoint(self.path), 1)
+
+        restarted = SFparkSource(versioned=True)
+        restarted.initialize(self.session)
+        self.assertEqual(restarted.lastUpdatedTime, source.lastUpdatedTime)
+        self.assertFalse(restarted.setState(CollectorCheckpoint(self.path).getState('sfpark')))
+
+    def testUnreadable(self):
+        f = open(self.path, 'w')
+        f.write('{"version": ')
+        f.close()
+        self.assertEqual(CollectorCheckpoint(self.path).getState('sfpark'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import json
+import shutil
+import datetime
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from SFparkDataModels import Base, SFparkAvailabilityRecord, SFparkLocationRecord
+from SFparkSource import SFparkSource
+from SFparkCompaction import AvailabilityCompactor
+from SFparkQueries import getAvailabilitySeries
+from sfpark_stubserver import SyntheticSFpark
+
+LOCATIONS = 30
+POLLS = 20
+CHUNK = 7
+DAYS = (20130601, 20130602)
+NEW_LOCATIONS = (10 ** 7, 10 ** 7 + 1)
+
+
+class Stopped(Exception):
+    pass
+
+
+class StoppingCompactor(AvailabilityCompactor):
+    """
+    An AvailabilityCompactor that stops part way through its *chunks*'th
+    chunk, as if the job were killed.
+    """
+
+    def __init__(self, chunks, **kwargs):
+        AvailabilityCompactor.__init__(self, **kwargs)
+        self.chunks = chunks
+
+    def compactChunk(self, *args):
+        result = AvailabilityCompactor.compactChunk(self, *args)
+        self.chunks -= 1
+        if self.chunks == 0:
+            raise Stopped()
+        return result
+
+
+class CompactionTest(unittest.TestCase):
+    """
+    Compacting sfpark_avl leaves the same availability, and a run that
+    is stopped carries on from its checkpoint.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.directory, 'compaction.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def collect(self):
+        """
+        Returns a session on two days of synthetic history, with one
+        snapshot stored twice.
+        """
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        source = SFparkSource()
+        source.initialize(session)
+        synthetic = SyntheticSFpark(LOCATIONS, changeFraction=0.2)
+        self.starts = []
+        for date_id in DAYS:
+            start = datetime.datetime(date_id // 10000, date_id // 100 % 100, date_id % 100, 12)
+            self.starts.append(start)
+            synthetic.advance(start)
+            for i in range(POLLS):
+                response = source.parseJson(json.loads(json.dumps(synthetic.response())))
+                source.write(session, response)
+                if i == 3:
+                    source.write(session, response)
+                synthetic.advance()
+        return session
+
+    def readSeries(self, session):
+        loc_ids = [loc_id for (loc_id,) in session.query(SFparkLocationRecord.id)
+                                                  .order_by(SFparkLocationRecord.id)]
+        return [getAvailabilitySeries(session, loc_id, start,
+                                      start + datetime.timedelta(minutes=POLLS - 1))
+                for loc_id in loc_ids for start in self.starts]
+
+    def readIds(self, session):
+        return sorted([id for (id,) in session.query(SFparkAvailabilityRecord.id)])
+
+    def countRows(self, session, table='sfpark_avl'):
+        return session.execute(text("SELECT count(*) FROM %s" % table)).scalar()
+
+    def addLocations(self, session):
+        """
+        Adds locations with a row that repeats the one before it every
+        minute of both days.
+        """
+        session.execute(SFparkLocationRecord.__table__.insert(),
+                        [{'id' : loc_id, 'parktype' : 'ON', 'name' : 'New %i' % loc_id}
+                         for loc_id in NEW_LOCATIONS])
+        rows = []
+        for loc_id in NEW_LOCATIONS:
+            for start in self.starts:
+                for i in range(POLLS):
+                    rows.append({'loc_id' : loc_id,
+                                 'date_id' : int(start.strftime('%Y%m%d')),
+                                 'availability_updated_timestamp' :
+                                     start + datetime.timedelta(minutes=i),
+                                 'occ' : 1, 'oper' : 2})
+        session.execute(SFparkAvailabilityRecord.__table__.insert(), rows)
+        session.commit()
+
+    def testSameSeries(self):
+        session = self.collect()
+        before = self.readSeries(session)
+        numRows = self.countRows(session)
+
+        compactor = AvailabilityCompactor(moveTo='sfpark_avl_removed', chunkLocations=CHUNK)
+        totals = compactor.run(session, DAYS[0], DAYS[-1])
+        self.assertEqual(totals['scanned'], numRows)
+        self.assertEqual(totals['duplicates'], LOCATIONS * len(DAYS))
+        self.assertTrue(totals['repeats'] > numRows / 2)
+        self.assertEqual(self.countRows(session) + self.countRows(session, 'sfpark_avl_removed'),
+                         numRows)
+        self.assertEqual(self.readSeries(session), before)
+
+        # compacting again removes nothing more
+        totals = AvailabilityCompactor(chunkLocations=CHUNK).run(session, DAYS[0], DAYS[-1])
+        self.assertEqual(totals['duplicates'] + totals['repeats'], 0)
+
+    def testResume(self):
+        whole = self.collect()
+        AvailabilityCompactor(chunkLocations=CHUNK).run(whole, DAYS[0], DAYS[-1])
+
+        session = self.collect()
+        compactor = StoppingCompactor(3, chunkLocations=CHUNK, checkpoint=self.checkpoint)
+        self.assertRaises(Stopped, compactor.run, session, DAYS[0], DAYS[-1])
+        session.rollback()
+        self.assertEqual(compactor.position[0], DAYS[0])
+
+        # locations added while it was stopped come after those done
+        self.addLocations(session)
+        original = self.countRows(session)
+
+        resumed = AvailabilityCompactor(chunkLocations=CHUNK, checkpoint=self.checkpoint)
+        resumed.run(session, DAYS[0], DAYS[-1])
+        self.assertEqual(resumed.position, (DAYS[-1], NEW_LOCATIONS[-1]))
+
+        # the same rows are left as by a run that wasn't stopped, and one
+        # each for the new locations
+        avl = SFparkAvailabilityRecord
+        kept = sorted([id for (id,) in session.query(avl.id)
+                                             .filter(~avl.loc_id.in_(NEW_LOCATIONS))])
+        self.assertEqual(kept, self.readIds(whole))
+        self.assertEqual(session.query(avl).filter(avl.loc_id.in_(NEW_LOCATIONS)).count(),
+                         len(NEW_LOCATIONS) * len(DAYS))
+        self.assertTrue(self.countRows(session) < original)
+
+    def testOtherKeyframe(self):
+        # a checkpoint made with another keyframe interval isn't used
+        session = self.collect()
+        compactor = StoppingCompactor(2, chunkLocations=CHUNK, checkpoint=self.checkpoint)
+        self.assertRaises(Stopped, compactor.run, session, DAYS[0], DAYS[-1])
+        session.rollback()
+        other = AvailabilityCompactor(keyframeMinutes=15, checkpoint=self.checkpoint)
+        self.assertRaises(ValueError, other.run, session, DAYS[0], DAYS[-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import json
+import datetime
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+
+from SFparkDataModels import Base, SFparkAvailabilityRecord
+from SFparkSource import SFparkSource
+from SFparkQueries import getAvailabilitySeries, getLatestAvailability
+from sfpark_stubserver import SyntheticSFpark
+
+LOCATIONS = 40
+KEYFRAME_MINUTES = 5
+POLLS = 12
+
+
+class DeltaTest(unittest.TestCase):
+    """
+    Delta mode stores only the changes, and keyframes, from which the
+    same availability can be rebuilt as if every row had been stored.
+    """
+
+    def collect(self, keyframeMinutes):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        source = SFparkSource(keyframeMinutes=keyframeMinutes)
+        source.initialize(session)
+        synthetic = SyntheticSFpark(LOCATIONS, changeFraction=0.2)
+        self.start = synthetic.updatedTime
+        for i in range(POLLS):
+            data = json.loads(json.dumps(synthetic.response()))
+            source.write(session, source.parseJson(data))
+            synthetic.advance()
+        return session
+
+    def countByTime(self, session):
+        avl = SFparkAvailabilityRecord
+        return dict(session.query(avl.availability_updated_timestamp, func.count(avl.id))
+                           .group_by(avl.availability_updated_timestamp))
+
+    def testKeyframes(self):
+        session = self.collect(KEYFRAME_MINUTES)
+        counts = self.countByTime(session)
+        for i in range(POLLS):
+            timestamp = self.start + datetime.timedelta(minutes=i)
+            if i % KEYFRAME_MINUTES == 0:
+                self.assertEqual(counts[timestamp], LOCATIONS)
+            else:
+                # about a fifth change each minute
+                self.assertTrue(0 < counts.get(timestamp, 0) < LOCATIONS / 2, 
+                                "%s: %s" % (timestamp, counts.get(timestamp)))
+
+    def testSameSeries(self):
+        full = self.collect(None)
+        delta = self.collect(KEYFRAME_MINUTES)
+        end = self.start + datetime.timedelta(minutes=POLLS - 1)
+        loc_ids = [loc_id for (loc_id,) in 
+                   full.query(SFparkAvailabilityRecord.loc_id).distinct()]
+        self.assertEqual(len(loc_ids), LOCATIONS)
+        for loc_id in loc_ids:
+            self.assertEqual(getAvailabilitySeries(delta, loc_id, self.start, end),
+                             getAvailabilitySeries(full, loc_id, self.start, end))
+        self.assertEqual(getLatestAvailability(delta, KEYFRAME_MINUTES),
+                         getLatestAvailability(full, 1))
+
+    def testRestart(self):
+        # a restarted source reads the last state stored of each location
+        session = self.collect(KEYFRAME_MINUTES)
+        source = SFparkSource(keyframeMinutes=KEYFRAME_MINUTES)
+        source.initialize(session)
+        self.assertEqual(source.lastAvailability, 
+                         getLatestAvailability(session))
+        self.assertEqual(len(source.lastAvailability), LOCATIONS)
+
+
+if __name__ == '__main__':
+    unittest.main()
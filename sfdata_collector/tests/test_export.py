@@ -0,0 +1,92 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import json
+import datetime
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from SFparkDataModels import Base
+from SFparkSource import SFparkSource
+from sfpark_export import TABLES, SCHEDULE_MODELS, getScheduleQuery
+from sfpark_stubserver import SyntheticSFpark
+
+# the days collected, and one before them
+DATE_IDS = (20130601, 20130602)
+BEFORE = 20130531
+
+
+class ScheduleExportTest(unittest.TestCase):
+    """
+    Rates and operating hours come out of the export the same, however
+    the collector stored them.
+    """
+
+    def collect(self, **options):
+        """
+        Returns a session on an in-memory database with a poll of each
+        day in DATE_IDS written by an SFparkSource with *options*.
+        """
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        source = SFparkSource(**options)
+        source.initialize(session)
+        synthetic = SyntheticSFpark(20)
+        for i in range(len(DATE_IDS)):
+            data = json.loads(json.dumps(synthetic.response()))
+            source.write(session, source.parseJson(data))
+            synthetic.advance(synthetic.updatedTime + datetime.timedelta(days=1))
+        return session
+
+    def export(self, session, name, date_id):
+        """
+        Returns the rows exported for one day of *name*, from the first
+        of its tables with any, as the export reads them.
+        """
+        model = TABLES[name]
+        names = [c.name for c in model.__table__.columns
+                 if c.name not in ('id', 'date_id')]
+        for storedModel in (model,) + SCHEDULE_MODELS[name]:
+            rows = session.execute(getScheduleQuery(storedModel, names, date_id)).fetchall()
+            if len(rows) > 0:
+                return sorted([tuple(row) for row in rows])
+        return []
+
+    def testStorageModes(self):
+        daily = self.collect()
+        for options in ({'versioned' : True}, {'codedStrings' : True}):
+            stored = self.collect(**options)
+            for name in SCHEDULE_MODELS:
+                for date_id in DATE_IDS:
+                    expected = self.export(daily, name, date_id)
+                    self.assertTrue(len(expected) > 0)
+                    self.assertEqual(self.export(stored, name, date_id), expected,
+                                     "%s %s %i" % (options, name, date_id))
+                self.assertEqual(self.export(stored, name, BEFORE), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
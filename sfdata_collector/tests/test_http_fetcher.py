@@ -0,0 +1,94 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from HttpFetcher import HttpFetcher
+from SFparkSource import SFparkSource
+from sfpark_stubserver import SyntheticSFpark, StubServer
+
+
+class ConditionalFetchTest(unittest.TestCase):
+    """
+    Fetching from the stub server, which refreshes only when told to.
+    """
+
+    def setUp(self):
+        self.server = StubServer(0, SyntheticSFpark(50), refreshSeconds=3600)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.fetcher = HttpFetcher(retries=0)
+
+    def tearDown(self):
+        self.fetcher.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def refresh(self):
+        # the next request finds the refresh due
+        self.server.lastRefresh = 0
+
+    def testNotModified(self):
+        params = {'PRICING' : 'no'}
+        first = self.fetcher.get(self.server.url(), params)
+        self.assertNotEqual(first, None)
+        self.assertEqual(self.fetcher.get(self.server.url(), params), None)
+        self.assertEqual(self.fetcher.stats['notModified'], 1)
+
+        # other parameters have validators of their own
+        self.assertNotEqual(self.fetcher.get(self.server.url(), {'PRICING' : 'yes'}), None)
+
+        self.refresh()
+        second = self.fetcher.get(self.server.url(), params)
+        self.assertNotEqual(second, None)
+        self.assertNotEqual(second.content, first.content)
+        self.assertEqual(self.fetcher.stats['requests'], 4)
+
+    def testCompressed(self):
+        self.fetcher.get(self.server.url())
+        stats = self.fetcher.stats
+        self.assertTrue(0 < stats['bytesTransferred'] < stats['bytesDecoded'] / 2,
+                        stats)
+
+    def testSkipUnchanged(self):
+        # a body with the timestamp of the last one parsed isn't parsed 
+        # again, even if the server sent it in full
+        source = SFparkSource()
+        fetcher = HttpFetcher(retries=0)
+        try:
+            content = fetcher.get(self.server.url()).content
+            self.assertNotEqual(source.parseContent(content), None)
+            self.assertEqual(source.parseContent(content), None)
+            self.assertEqual(source.stats['skippedUnchanged'], 1)
+
+            self.refresh()
+            content = fetcher.get(self.server.url()).content
+            self.assertNotEqual(source.parseContent(content), None)
+        finally:
+            fetcher.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import json
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+
+from SFparkDataModels import Base, SFparkAvailabilityRecord
+from SFparkSource import SFparkSource
+from CollectorLeases import LeaseCoordinator, CollectorLeaseRecord, LeaseLost
+from sfpark_stubserver import SyntheticSFpark
+
+NAMES = ['a', 'b', 'c', 'd']
+LOCATIONS = 10
+
+
+class LeaseTest(unittest.TestCase):
+    """
+    Two collectors sharing the sources through collector_lease, with
+    each poll written once whichever of them writes it.
+    """
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        self.first = LeaseCoordinator(NAMES, 'first')
+        self.second = LeaseCoordinator(NAMES, 'second')
+
+    def tearDown(self):
+        self.session.close()
+
+    def expire(self, coordinator):
+        # as if the node had stopped renewing its leases a while ago
+        table = CollectorLeaseRecord.__table__
+        self.session.execute(table.update()
+                             .where(table.c.owner == coordinator.nodeId)
+                             .values(expires=0.0))
+        self.session.commit()
+
+    def getHighWater(self, name):
+        table = CollectorLeaseRecord.__table__
+        return self.session.query(table.c.high_water).filter(table.c.name == name).scalar()
+
+    def share(self):
+        self.first.refresh(self.session)
+        self.second.refresh(self.session)
+        self.first.refresh(self.session)
+        self.second.refresh(self.session)
+
+    def testShare(self):
+        gained, lost = self.first.refresh(self.session)
+        self.assertEqual(gained, NAMES)
+
+        # the first node gives up what is beyond its share once the second
+        # announces itself, and the second takes it
+        self.assertEqual(self.second.refresh(self.session), ([], []))
+        gained, lost = self.first.refresh(self.session)
+        self.assertEqual(len(lost), 2)
+        gained, lost = self.second.refresh(self.session)
+        self.assertEqual(len(gained), 2)
+        self.assertEqual(len(self.first.owned & self.second.owned), 0)
+        self.assertEqual(sorted(self.first.owned | self.second.owned), NAMES)
+
+    def testTakeover(self):
+        self.share()
+        taken = sorted(self.first.owned)
+        self.expire(self.first)
+        gained, lost = self.second.refresh(self.session)
+        self.assertEqual(gained, taken)
+        self.assertEqual(sorted(self.second.owned), NAMES)
+
+        # the first node can't write what it no longer holds
+        source = SFparkSource()
+        source.name = taken[0]
+        self.assertRaises(LeaseLost, self.first.hold, self.session, source, [])
+        self.session.rollback()
+        self.assertFalse(self.first.owns(taken[0]))
+
+    def testReleaseAll(self):
+        self.share()
+        self.first.releaseAll(self.session)
+        self.second.refresh(self.session)
+        self.assertEqual(sorted(self.second.owned), NAMES)
+
+    def testHighWater(self):
+        self.first.refresh(self.session)
+        name = NAMES[0]
+        synthetic = SyntheticSFpark(LOCATIONS)
+        parser = SFparkSource()
+        responses = []
+        for i in range(8):
+            responses.append(parser.parseJson(json.loads(json.dumps(synthetic.response()))))
+            synthetic.advance()
+
+        def write(coordinator, items):
+            source = SFparkSource()
+            source.name = name
+            source.initialize(self.session)
+            items = coordinator.hold(self.session, source, items)
+            if len(items) > 0:
+                source.writeBatch(self.session, items)
+            else:
+                self.session.commit()
+            return items
+
+        self.assertEqual(write(self.first, responses[:5]), responses[:5])
+        self.assertEqual(self.getHighWater(name), responses[4].updated_time)
+
+        # both nodes fetched the same polls around the takeover
+        self.expire(self.first)
+        self.second.refresh(self.session)
+        self.assertEqual(write(self.second, responses[3:]), responses[5:])
+        self.assertEqual(self.second.stats['duplicates'], 2)
+        self.assertEqual(self.getHighWater(name), responses[7].updated_time)
+
+        avl = SFparkAvailabilityRecord
+        counts = dict(self.session.query(avl.availability_updated_timestamp, func.count(avl.id))
+                                  .group_by(avl.availability_updated_timestamp))
+        self.assertEqual(sorted(counts), [r.updated_time for r in responses])
+        self.assertEqual(set(counts.values()), set([LOCATIONS]))
+
+    def testRolledBack(self):
+        # the high water mark is only raised if the write commits
+        self.first.refresh(self.session)
+        source = SFparkSource()
+        source.name = NAMES[0]
+        response = source.parseJson(SyntheticSFpark(LOCATIONS).response())
+        self.first.hold(self.session, source, [response])
+        self.session.rollback()
+        self.assertEqual(self.getHighWater(NAMES[0]), None)
+        self.assertEqual(self.first.hold(self.session, source, [response]), [response])
+
+
+if __name__ == '__main__':
+    unittest.main()
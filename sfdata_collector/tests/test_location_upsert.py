@@ -0,0 +1,109 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import json
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from SFparkDataModels import Base, SFparkLocationRecord
+from SFparkSource import SFparkSource
+from SFparkBulkWriter import upsertRows, genericUpsertRows
+from sfpark_stubserver import SyntheticSFpark
+
+
+class LocationUpsertTest(unittest.TestCase):
+    """
+    Locations are only written when they are new or have changed, and
+    then replace the row already there.
+    """
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        self.synthetic = SyntheticSFpark(30)
+        self.source = SFparkSource()
+        self.source.initialize(self.session)
+
+    def tearDown(self):
+        self.session.close()
+
+    def poll(self):
+        rowCounts = {}
+        data = json.loads(json.dumps(self.synthetic.response()))
+        self.source.write(self.session, self.source.parseJson(data), rowCounts=rowCounts)
+        self.synthetic.advance()
+        return rowCounts.get('sfpark_loc', 0)
+
+    def getName(self, loc_id):
+        return self.session.query(SFparkLocationRecord.name) \
+                           .filter(SFparkLocationRecord.id == loc_id).scalar()
+
+    def testChangedOnly(self):
+        self.assertEqual(self.poll(), 30)
+        self.assertEqual(self.poll(), 0)
+
+        location = self.synthetic.locations[2]
+        location['NAME'] = 'Renamed'
+        self.assertEqual(self.poll(), 1)
+        self.assertEqual(self.getName(100002), 'Renamed')
+        self.assertEqual(self.session.query(SFparkLocationRecord).count(), 30)
+
+    def testRestart(self):
+        # the hashes aren't stored, so every location is written once 
+        # more after a restart, then only the changes
+        self.poll()
+        self.source = SFparkSource()
+        self.source.initialize(self.session)
+        self.assertEqual(self.poll(), 30)
+        self.assertEqual(self.poll(), 0)
+
+    def testGenericUpsert(self):
+        # the fallback for databases without ON CONFLICT does the same
+        self.poll()
+        table = SFparkLocationRecord.__table__
+        rows = [dict(row) for row in self.session.execute(table.select().limit(3))]
+        rows[0]['name'] = 'Changed'
+        newRow = dict(rows[1])
+        newRow['id'] = 999999
+        genericUpsertRows(self.session, table, rows + [newRow])
+        self.assertEqual(self.getName(rows[0]['id']), 'Changed')
+        self.assertEqual(self.getName(999999), rows[1]['name'])
+        self.assertEqual(self.session.query(SFparkLocationRecord).count(), 31)
+
+    def testRepeatedKey(self):
+        # ON CONFLICT can't change a row twice, so only the last is kept,
+        # whichever way it is written
+        self.poll()
+        table = SFparkLocationRecord.__table__
+        row = dict(self.session.execute(table.select().limit(1)).first())
+        first = dict(row, name='First')
+        last = dict(row, name='Last')
+        self.assertEqual(upsertRows(self.session, SFparkLocationRecord, [first, last]), 1)
+        self.assertEqual(self.getName(row['id']), 'Last')
+
+
+if __name__ == '__main__':
+    unittest.main()
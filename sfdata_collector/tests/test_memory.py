@@ -0,0 +1,117 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import json
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, Session
+
+from SFparkDataModels import Base
+from SFparkSource import SFparkSource
+from CollectorPipeline import CollectorPipeline
+from ProcessMemory import getRss, countObjects, formatBytes
+from sfpark_stubserver import SyntheticSFpark
+
+LOCATIONS = 20
+CYCLES = 10
+
+
+class RecordingSession(Session):
+    """
+    A Session that remembers whether it was closed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        Session.__init__(self, *args, **kwargs)
+        self.closed = False
+
+    def close(self):
+        Session.close(self)
+        self.closed = True
+
+
+class WriterSessionTest(unittest.TestCase):
+    """
+    Each write has a session of its own, closed afterwards, so nothing
+    piles up from one write to the next.
+    """
+
+    def testSessionPerWrite(self):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        sessions = []
+        factory = sessionmaker(bind=engine, class_=RecordingSession)
+        def Session():
+            session = factory()
+            sessions.append(session)
+            return session
+
+        source = SFparkSource('orm')
+        session = Session()
+        source.initialize(session)
+        session.close()
+
+        pipeline = CollectorPipeline([source], None, Session, fetchWorkers=1, writeWorkers=1)
+        write = pipeline.makeWriter()
+        synthetic = SyntheticSFpark(LOCATIONS, changeFraction=0.2)
+        counts = []
+        for i in range(CYCLES):
+            data = json.loads(json.dumps(synthetic.response()))
+            write((source, [source.parseJson(data)]))
+            counts.append(pipeline.memory['sessionObjects'][source.name])
+            synthetic.advance()
+
+        self.assertEqual(len(sessions), CYCLES + 1)
+        for session in sessions:
+            self.assertTrue(session.closed)
+            self.assertEqual(len(session.identity_map), 0)
+        self.assertEqual(pipeline.stats[(source.name, 'write')].count, CYCLES)
+
+        # nothing is left in the session from one write to the next
+        self.assertEqual(counts, [counts[0]] * CYCLES)
+        self.assertTrue(counts[0] <= LOCATIONS, counts)
+
+        # the process is only measured when the stats are read
+        self.assertEqual(pipeline.memory['objects'], 0)
+        memory = pipeline.getStats()['memory']
+        self.assertTrue(memory['objects'] > 0)
+        self.assertTrue('memory:' in pipeline.formatStats())
+
+
+class ProcessMemoryTest(unittest.TestCase):
+
+    def testMeasures(self):
+        rss = getRss()
+        if rss is not None:
+            self.assertTrue(rss > 1024 * 1024, rss)
+        self.assertTrue(countObjects() > 1000)
+
+    def testFormatBytes(self):
+        self.assertEqual(formatBytes(None), 'unknown')
+        self.assertEqual(formatBytes(0), '0.0 MB')
+        self.assertEqual(formatBytes(3 * 1048576 + 524288), '3.5 MB')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from CollectorMetrics import CollectorMetrics
+from PollSchedule import PollSchedule
+
+
+class StatsPipeline(object):
+    """
+    Stands in for a CollectorPipeline, returning fixed stats.
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def getStats(self):
+        return self.stats
+
+
+def makeStats(missed, dropped, polls={}):
+    return {'missed'            : {'sfpark' : missed},
+            'polls'             : polls,
+            'writeQueueDepth'   : [0],
+            'writeQueueDropped' : [dropped],
+            'spoolPending'      : {},
+            'memory'            : {'rss' : None, 'objects' : 0, 'sessionObjects' : {}},
+            'leases'            : {}}
+
+
+class MetricsTest(unittest.TestCase):
+
+    def getTypes(self, text):
+        """
+        Returns the type of each metric in the Prometheus *text*, by name.
+        """
+        types = {}
+        for line in text.splitlines():
+            if line.startswith('# TYPE '):
+                name, type = line.split()[2:]
+                types[name] = type
+        return types
+
+    def testPipelineCounts(self):
+        # counts kept by the pipeline are counters, whose totals are 
+        # given as they are
+        metrics = CollectorMetrics()
+        metrics.pipeline = StatsPipeline(makeStats(3, 7))
+        text = metrics.format()
+        types = self.getTypes(text)
+        self.assertEqual(types['sfdata_missed_polls_total'], 'counter')
+        self.assertEqual(types['sfdata_write_queue_dropped_total'], 'counter')
+        self.assertTrue('sfdata_missed_polls_total{source="sfpark"} 3' in text)
+        self.assertTrue('sfdata_write_queue_dropped_total{queue="0"} 7' in text)
+
+        metrics.pipeline = StatsPipeline(makeStats(5, 7))
+        self.assertTrue('sfdata_missed_polls_total{source="sfpark"} 5' in metrics.format())
+
+    def testScheduleCounts(self):
+        schedule = PollSchedule(60)
+        schedule.stats['wasted'] = 4
+        schedule.stats['missed'] = 2
+        metrics = CollectorMetrics()
+        metrics.pipeline = StatsPipeline(makeStats(0, 0, {'sfpark' : schedule}))
+        text = metrics.format()
+        types = self.getTypes(text)
+        self.assertEqual(types['sfdata_wasted_polls_total'], 'counter')
+        self.assertEqual(types['sfdata_missed_refreshes_total'], 'counter')
+        self.assertTrue('sfdata_wasted_polls_total{source="sfpark"} 4' in text)
+        self.assertTrue('sfdata_missed_refreshes_total{source="sfpark"} 2' in text)
+
+    def testCounterNames(self):
+        for name, type in self.getTypes(CollectorMetrics().format()).iteritems():
+            self.assertEqual(type == 'counter', name.endswith('_total'), name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import json
+import datetime
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.exc import DatabaseError
+
+from SFparkDataModels import Base, SFparkAvailabilityRecord
+from SFparkSource import SFparkSource
+from SFparkPartitions import (AvailabilityPartitions, partitionTable, listPartitions,
+                              countPartitionRows, addMonths, TABLE)
+from sfpark_stubserver import SyntheticSFpark
+
+LOCATIONS = 10
+
+
+class PartitionTest(unittest.TestCase):
+    """
+    sfpark_avl split by month on SQLite, where the months are tables of
+    their own behind a view.
+    """
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        tables = [table for table in Base.metadata.sorted_tables if table.name != TABLE]
+        Base.metadata.create_all(engine, tables=tables)
+        self.session = sessionmaker(bind=engine)()
+        self.synthetic = SyntheticSFpark(LOCATIONS)
+
+    def tearDown(self):
+        self.session.close()
+
+    def partition(self, date_id):
+        AvailabilityPartitions().create(self.session, date_id)
+        self.session.commit()
+
+    def collect(self, source, days):
+        for day in days:
+            self.synthetic.advance(datetime.datetime.combine(day, datetime.time(12)))
+            data = json.loads(json.dumps(self.synthetic.response()))
+            source.write(self.session, source.parseJson(data))
+
+    def readRows(self):
+        table = SFparkAvailabilityRecord.__table__
+        return sorted([tuple(row)[1:] for row in self.session.execute(select([table]))])
+
+    def testMaintain(self):
+        self.partition(20130601)
+        self.assertEqual(listPartitions(self.session), [201306, 201307])
+
+        source = SFparkSource(retentionMonths=1)
+        source.initialize(self.session)
+        self.assertTrue(source.partitions.partitioned)
+        self.collect(source, [datetime.date(2013, 6, 1), datetime.date(2013, 7, 1)])
+        self.assertEqual(listPartitions(self.session), [201306, 201307, 201308])
+        self.assertEqual(countPartitionRows(self.session, 201306), LOCATIONS)
+        self.assertEqual(countPartitionRows(self.session, 201307), LOCATIONS)
+
+        # June is past retention once August is written
+        self.collect(source, [datetime.date(2013, 8, 1)])
+        self.assertEqual(listPartitions(self.session), [201307, 201308, 201309])
+        self.assertEqual(len(self.readRows()), 2 * LOCATIONS)
+
+        # the ids are unique across the months
+        ids = [id for (id,) in self.session.execute(text("SELECT id FROM %s" % TABLE))]
+        self.assertEqual(len(set(ids)), len(ids))
+
+    def testDetach(self):
+        self.partition(20130601)
+        source = SFparkSource(retentionMonths=0, detachOld=True)
+        source.initialize(self.session)
+        self.collect(source, [datetime.date(2013, 6, 1), datetime.date(2013, 7, 1)])
+        self.assertEqual(listPartitions(self.session), [201307, 201308])
+        detached = self.session.execute(text(
+            "SELECT count(*) FROM sfpark_avl_201306_detached")).scalar()
+        self.assertEqual(detached, LOCATIONS)
+
+    def testNoPartition(self):
+        # rows for a month with no partition are an error, not lost
+        self.partition(20130601)
+        self.session.execute(SFparkAvailabilityRecord.__table__.insert(),
+                             [{'loc_id' : 1, 'date_id' : 20130615, 'occ' : 1, 'oper' : 2}])
+        self.assertRaises(DatabaseError, self.session.execute,
+                          SFparkAvailabilityRecord.__table__.insert(),
+                          [{'loc_id' : 1, 'date_id' : 20131215, 'occ' : 1, 'oper' : 2}])
+
+    def testConvert(self):
+        SFparkAvailabilityRecord.__table__.create(self.session.connection())
+        source = SFparkSource()
+        source.initialize(self.session)
+        self.collect(source, [datetime.date(2013, 5, 31), datetime.date(2013, 6, 1),
+                              datetime.date(2013, 6, 2)])
+        before = self.readRows()
+
+        self.assertEqual(partitionTable(self.session), 3 * LOCATIONS)
+        # the month ahead of the newest row is ready as well
+        self.assertEqual(listPartitions(self.session), [201305, 201306, 201307])
+        self.assertEqual(self.readRows(), before)
+        self.assertTrue(AvailabilityPartitions().detect(self.session))
+
+    def testAddMonths(self):
+        self.assertEqual(addMonths(201312, 1), 201401)
+        self.assertEqual(addMonths(201301, -1), 201212)
+        self.assertEqual(addMonths(201306, -18), 201112)
+
+
+if __name__ == '__main__':
+    unittest.main()
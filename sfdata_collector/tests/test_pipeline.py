@@ -0,0 +1,220 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import time
+import Queue
+import shutil
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.orm import sessionmaker
+
+from Backoff import Backoff
+from DataSource import DataSource
+from WriteSpool import WriteSpool
+from CollectorPipeline import (CollectorPipeline, DropOldestQueue, StageStats,
+                               SchedulerThread)
+
+PERIOD = 0.2
+FETCH_SECONDS = 0.5
+
+
+class TickSource(DataSource):
+    name = 'tick'
+    period = PERIOD
+
+
+class CountingSource(DataSource):
+    """
+    A trivial source whose polls are numbered, and which keeps each list
+    of items it is asked to write.  *failing* is 'fetch' or 'write' for
+    a source whose fetches or writes always fail.
+    """
+
+    period = 0.05
+
+    def __init__(self, name, failing=None):
+        DataSource.__init__(self)
+        self.name = name
+        self.failing = failing
+        self.polls = 0
+        self.written = []
+
+    def fetch(self, fetcher):
+        if self.failing == 'fetch':
+            raise IOError("Can't reach %s" % self.name)
+        self.polls += 1
+        return (self.name, self.polls)
+
+    def write(self, session, data, timings=None, rowCounts=None):
+        self.writeBatch(session, [data])
+
+    def writeBatch(self, session, items, timings=None, rowCounts=None):
+        if self.failing == 'write':
+            raise IOError("Can't write %s" % self.name)
+        self.written.append(list(items))
+
+
+class RecordingQueue(DropOldestQueue):
+    """
+    A DropOldestQueue that keeps the time each item was put.
+    """
+
+    def __init__(self, maxsize):
+        DropOldestQueue.__init__(self, maxsize)
+        self.times = []
+
+    def put(self, item):
+        self.times.append(time.time())
+        DropOldestQueue.put(self, item)
+
+
+class DropOldestQueueTest(unittest.TestCase):
+
+    def testDropsOldest(self):
+        queue = DropOldestQueue(3)
+        for i in range(5):
+            queue.put(i)
+        self.assertEqual(queue.dropped, 2)
+        self.assertEqual(queue.qsize(), 3)
+        self.assertEqual([queue.get(0) for i in range(3)], [2, 3, 4])
+        self.assertRaises(Queue.Empty, queue.get, 0.01)
+        self.assertEqual(queue.dropped, 2)
+
+
+class StageStatsTest(unittest.TestCase):
+
+    def testLatencies(self):
+        stats = StageStats()
+        self.assertEqual(stats.meanLatency(), 0.0)
+        for latency in (1.0, 3.0, 2.0):
+            stats.record(latency)
+        self.assertEqual((stats.count, stats.lastLatency, stats.maxLatency),
+                         (3, 2.0, 3.0))
+        self.assertEqual(stats.meanLatency(), 2.0)
+
+
+class SchedulerTest(unittest.TestCase):
+    """
+    A slow fetch doesn't shift the schedule.  The polls due while it is
+    still going are skipped and counted, and the rest stay on the times
+    set at the start.
+    """
+
+    def testSlowFetch(self):
+        source = TickSource()
+        queue = RecordingQueue(0)
+        scheduler = SchedulerThread([source], queue)
+        stopEvent = threading.Event()
+
+        def fetch():
+            while not stopEvent.is_set():
+                try:
+                    polled = queue.get(0.05)
+                except Queue.Empty:
+                    continue
+                time.sleep(FETCH_SECONDS)
+                scheduler.done(polled)
+        fetcher = threading.Thread(target=fetch)
+
+        fetcher.start()
+        scheduler.start()
+        try:
+            time.sleep(10 * PERIOD + PERIOD / 2)
+        finally:
+            scheduler.stopEvent.set()
+            scheduler.wakeEvent.set()
+            scheduler.join(5)
+            stopEvent.set()
+            fetcher.join(5)
+
+        # a poll every third period, each on the schedule
+        start = queue.times[0]
+        self.assertTrue(3 <= len(queue.times) <= 5, queue.times)
+        for putTime in queue.times:
+            periods = (putTime - start) / PERIOD
+            self.assertTrue(abs(periods - round(periods)) < 0.25, periods)
+        polls = len(queue.times) + scheduler.missed[source.name]
+        self.assertTrue(10 <= polls <= 12, polls)
+
+
+class DispatchTest(unittest.TestCase):
+    """
+    Several sources through one pipeline, each written only with its own
+    data, whatever happens to the others.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def runPipeline(self, sources, spool=None):
+        pipeline = CollectorPipeline(sources, None, sessionmaker(), fetchWorkers=2,
+                                     writeWorkers=1, spool=spool, spoolBatch=3,
+                                     backoff=Backoff(0.001, 0.01))
+        pipeline.start()
+        time.sleep(0.5)
+        pipeline.stop()
+        return pipeline
+
+    def checkWritten(self, source):
+        self.assertTrue(len(source.written) > 3, source.written)
+        items = [item for batch in source.written for item in batch]
+        self.assertEqual(items, [(source.name, n) for n in range(1, len(items) + 1)])
+
+    def testOwnWrites(self):
+        first = CountingSource('first')
+        second = CountingSource('second')
+        self.runPipeline([first, second])
+        self.checkWritten(first)
+        self.checkWritten(second)
+
+    def testFailingSource(self):
+        good = CountingSource('good')
+        unreachable = CountingSource('unreachable', 'fetch')
+        unwritable = CountingSource('unwritable', 'write')
+        pipeline = self.runPipeline([unreachable, unwritable, good])
+        self.checkWritten(good)
+        self.assertTrue(pipeline.stats[('unreachable', 'fetch')].errors > 3)
+        self.assertTrue(pipeline.stats[('unwritable', 'write')].errors > 3)
+        self.assertEqual(unwritable.written, [])
+
+    def testSpool(self):
+        # sources sharing a spool drainer
+        spool = WriteSpool(self.directory)
+        good = CountingSource('good')
+        other = CountingSource('other')
+        unwritable = CountingSource('unwritable', 'write')
+        self.runPipeline([unwritable, good, other], spool)
+        self.checkWritten(good)
+        self.checkWritten(other)
+        self.assertEqual(spool.pending(good.name), 0)
+        self.assertTrue(spool.pending(unwritable.name) > 0)
+        spool.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
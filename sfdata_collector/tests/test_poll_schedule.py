@@ -0,0 +1,153 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import random
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PollSchedule import PollSchedule, MAX_SECONDS
+
+CADENCE = 60.0
+PUBLISH_SECONDS = 20.0
+PERIOD = 15.0
+HOUR = 3600.0
+
+
+class Upstream(object):
+    """
+    A service that refreshes every CADENCE seconds, stamped on the
+    minute, and publishes each refresh PUBLISH_SECONDS later, give or
+    take *jitter*, until the unix time *stopTime*.
+    """
+
+    def __init__(self, jitter=4.0, stopTime=None, seed=0):
+        rand = random.Random(seed)
+        self.publishTimes = {}
+        self.jitter = lambda: rand.uniform(0, jitter)
+        self.stopTime = stopTime
+
+    def latest(self, now):
+        """
+        Returns the timestamp of the newest refresh that can be fetched at
+        *now*, or None.
+        """
+        dataTime = (now // CADENCE) * CADENCE
+        if self.stopTime is not None:
+            dataTime = min(dataTime, (self.stopTime // CADENCE) * CADENCE)
+        while dataTime >= 0:
+            if dataTime not in self.publishTimes:
+                self.publishTimes[dataTime] = dataTime + PUBLISH_SECONDS + self.jitter()
+            if self.publishTimes[dataTime] <= now:
+                return dataTime
+            dataTime -= CADENCE
+        return None
+
+
+class PollScheduleTest(unittest.TestCase):
+    """
+    PollSchedule against a simulated upstream, with the polls made when
+    it says, as the collector's scheduler does.
+    """
+
+    def poll(self, schedule, upstream, start, end):
+        """
+        Polls *upstream* from the unix time *start* until *end*.  Returns
+        the times of the polls.
+        """
+        now = start
+        times = []
+        while now < end:
+            times.append(now)
+            dataTime = upstream.latest(now)
+            fresh = dataTime is not None and dataTime > schedule.lastDataTime
+            schedule.observe(now, fresh, dataTime if fresh else None)
+            nextTime = schedule.nextTime(now)
+            if nextTime is None or nextTime <= now:
+                nextTime = now + schedule.period
+            now = nextTime
+        return times
+
+    def testCadence(self):
+        # every period, the cadence is learned but the polls stay the same
+        schedule = PollSchedule(PERIOD)
+        times = self.poll(schedule, Upstream(), 0.0, HOUR)
+        self.assertEqual(schedule.cadence, CADENCE)
+        self.assertEqual(len(times), HOUR / PERIOD)
+        self.assertEqual(schedule.stats['missed'], 0)
+        self.assertEqual(schedule.stats['fresh'], HOUR / CADENCE)
+        self.assertTrue(schedule.stats['wasted'] > schedule.stats['fresh'])
+
+    def testAdaptive(self):
+        # once learned, nearly every poll finds a refresh, soon after it
+        schedule = PollSchedule(PERIOD, adaptive=True)
+        upstream = Upstream()
+        self.poll(schedule, upstream, 0.0, HOUR)
+        self.assertEqual(schedule.cadence, CADENCE)
+        self.assertTrue(PUBLISH_SECONDS <= schedule.delay <= PUBLISH_SECONDS + 8, 
+                        schedule.delay)
+
+        before = dict(schedule.stats)
+        self.poll(schedule, upstream, HOUR, 2 * HOUR)
+        fresh = schedule.stats['fresh'] - before['fresh']
+        wasted = schedule.stats['wasted'] - before['wasted']
+        self.assertEqual(fresh, HOUR / CADENCE)
+        self.assertEqual(schedule.stats['missed'], 0)
+        self.assertTrue(wasted < 0.25 * fresh, wasted)
+        lag = (schedule.stats['totalLag'] - before['totalLag']) / fresh
+        self.assertTrue(lag < PUBLISH_SECONDS + 10, lag)
+
+    def testBacksOff(self):
+        # a night with no refreshes costs few polls, and the first
+        # refresh in the morning is still found
+        schedule = PollSchedule(PERIOD, adaptive=True)
+        upstream = Upstream(stopTime=HOUR)
+        self.poll(schedule, upstream, 0.0, HOUR)
+        times = self.poll(schedule, upstream, HOUR, 3 * HOUR)
+        gaps = [b - a for a, b in zip(times, times[1:])]
+        self.assertTrue(max(gaps) <= MAX_SECONDS)
+        self.assertTrue(len(times) < 2 * HOUR / MAX_SECONDS + 15, len(times))
+
+        upstream.stopTime = None
+        times = self.poll(schedule, upstream, times[-1] + gaps[-1], 4 * HOUR)
+        self.assertTrue(schedule.stats['lastLag'] < PUBLISH_SECONDS + 10)
+
+    def testMissed(self):
+        schedule = PollSchedule(CADENCE)
+        for dataTime in (0.0, 60.0, 120.0):
+            schedule.observe(dataTime + PUBLISH_SECONDS, True, dataTime)
+        self.assertEqual(schedule.stats['missed'], 0)
+
+        # three minutes between polls, so the two refreshes between them
+        # were never seen
+        schedule.observe(300.0 + PUBLISH_SECONDS, True, 300.0)
+        self.assertEqual(schedule.stats['missed'], 2)
+
+        # a refresh the upstream skipped isn't counted when the polls 
+        # were close enough to have seen it
+        schedule.observe(360.0 + PUBLISH_SECONDS, False)
+        schedule.observe(390.0 + PUBLISH_SECONDS, False)
+        schedule.observe(420.0 + PUBLISH_SECONDS, True, 420.0)
+        self.assertEqual(schedule.stats['missed'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
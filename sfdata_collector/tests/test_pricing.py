@@ -0,0 +1,139 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import json
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from SFparkDataModels import Base, SFparkRatesRecord, SFparkOphrsRecord
+from SFparkSource import SFparkSource
+from SFparkResponse import getPacificNow
+from sfpark_stubserver import SyntheticSFpark
+
+# the day SyntheticSFpark starts on
+DATE_ID = 20130601
+
+# the rates and operating hours of each location that SyntheticSFpark
+# gives them to
+RATES = 6
+OPHRS = 2
+
+
+class PricingTest(unittest.TestCase):
+    """
+    Rates and operating hours are parsed until they have been committed
+    for the day, however the responses that had them were lost. 
+    """
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        self.synthetic = SyntheticSFpark(20, changeFraction=0.5)
+        self.source = SFparkSource()
+        self.source.initialize(self.session)
+
+    def tearDown(self):
+        self.session.close()
+
+    def parse(self):
+        data = json.loads(json.dumps(self.synthetic.response()))
+        self.synthetic.advance()
+        return self.source.parseJson(data)
+
+    def countSchedules(self):
+        return [self.session.query(model).filter(model.date_id == DATE_ID).count()
+                for model in (SFparkRatesRecord, SFparkOphrsRecord)]
+
+    def testDroppedResponse(self):
+        # the first priced response never reaches the writer
+        self.assertTrue(self.parse().pricing)
+
+        response = self.parse()
+        self.assertTrue(response.pricing)
+        self.source.write(self.session, response)
+        self.assertEqual(self.countSchedules(), [20 * RATES, 20 * OPHRS])
+        self.assertFalse(self.parse().pricing)
+
+    def testRolledBackResponse(self):
+        response = self.parse()
+        self.assertTrue(response.pricing)
+
+        def fail():
+            raise IOError("Lost the database")
+        commit = self.session.commit
+        self.session.commit = fail
+        self.assertRaises(IOError, self.source.write, self.session, response)
+        self.session.commit = commit
+        self.session.rollback()
+        self.source.reset(self.session)
+
+        response = self.parse()
+        self.assertTrue(response.pricing)
+        self.source.write(self.session, response)
+        self.assertEqual(self.countSchedules(), [20 * RATES, 20 * OPHRS])
+
+    def testRestart(self):
+        self.source.write(self.session, self.parse())
+        source = SFparkSource()
+        source.initialize(self.session)
+        source.lastParsedTime = None
+        data = json.loads(json.dumps(self.synthetic.response()))
+        self.assertFalse(source.parseJson(data).pricing)
+
+    def testRequestedUntilCommitted(self):
+        synthetic = SyntheticSFpark(20, startTime=getPacificNow())
+        fetcher = ParamsFetcher()
+
+        self.source.fetch(fetcher)
+        self.assertEqual(fetcher.params['PRICING'], 'yes')
+        self.assertTrue(self.source.parseJson(synthetic.response()).pricing)
+
+        # the response was dropped, so the next request asks again
+        self.source.fetch(fetcher)
+        self.assertEqual(fetcher.params['PRICING'], 'yes')
+        synthetic.advance()
+        self.source.write(self.session, self.source.parseJson(synthetic.response()))
+
+        self.source.fetch(fetcher)
+        self.assertEqual(fetcher.params['PRICING'], 'no')
+
+
+class ParamsFetcher(object):
+    """
+    Stands in for an HttpFetcher, keeping the parameters of the last
+    request, and saying nothing has changed.
+    """
+
+    def __init__(self):
+        self.params = None
+
+    def get(self, url, params=None):
+        self.params = params
+        return None
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import json
+import datetime
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from SFparkDataModels import Base, SFparkAvailabilityRecord
+from SFparkSource import SFparkSource
+from SFparkRollups import OccupancyRollups, rebuildRollups
+from SFparkQueries import getOccupancy
+from sfpark_stubserver import SyntheticSFpark
+
+LOCATIONS = 20
+POLLS = 40
+BUCKETS = [15, 60]
+KEYFRAME_MINUTES = 5
+
+
+class RollupTest(unittest.TestCase):
+    """
+    The rollups kept as the collector runs match those rebuilt afterwards
+    from sfpark_avl, across restarts and in delta mode.
+    """
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        self.synthetic = SyntheticSFpark(LOCATIONS, changeFraction=0.3)
+        self.start = self.synthetic.updatedTime
+        self.end = self.start + datetime.timedelta(hours=1)
+
+    def tearDown(self):
+        self.session.close()
+
+    def makeSource(self, keyframeMinutes=None):
+        source = SFparkSource(rollupMinutes=BUCKETS, keyframeMinutes=keyframeMinutes)
+        source.initialize(self.session)
+        return source
+
+    def collect(self, source, polls):
+        for i in range(polls):
+            data = json.loads(json.dumps(self.synthetic.response()))
+            source.write(self.session, source.parseJson(data))
+            self.synthetic.advance()
+
+    def finish(self, source):
+        # the open buckets are only written every few minutes
+        source.rollups.flush(self.session, None, force=True)
+        self.session.commit()
+
+    def readOccupancy(self):
+        return dict((minutes, getOccupancy(self.session, minutes, self.start, self.end))
+                    for minutes in BUCKETS)
+
+    def rebuild(self, keyframeMinutes=None):
+        date_id = int(self.start.strftime('%Y%m%d'))
+        rebuildRollups(self.session, date_id, date_id, BUCKETS, keyframeMinutes)
+        return self.readOccupancy()
+
+    def testLive(self):
+        source = self.makeSource()
+        self.collect(source, POLLS)
+        self.finish(source)
+        live = self.readOccupancy()
+
+        # one row per location in each bucket, with a snapshot a minute
+        self.assertEqual([n for loc_id, start, n, occ, oper, rate in live[15]
+                          if loc_id == live[15][0][0]], [15, 15, 10])
+        self.assertEqual(len(live[60]), LOCATIONS)
+        self.assertEqual(live, self.rebuild())
+
+    def testFlushed(self):
+        # the open buckets are written as they fill, not only at the end
+        source = self.makeSource()
+        self.collect(source, 12)
+        written = getOccupancy(self.session, 15, self.start, self.end)
+        self.assertEqual(len(written), LOCATIONS)
+        self.assertTrue(all(n >= 10 for loc_id, start, n, occ, oper, rate in written))
+
+    def testRestart(self):
+        source = self.makeSource()
+        self.collect(source, 20)
+        # the restarted source picks up the open buckets from sfpark_avl
+        restarted = self.makeSource()
+        self.collect(restarted, POLLS - 20)
+        self.finish(restarted)
+        self.assertEqual(self.readOccupancy(), self.rebuild())
+
+    def testDelta(self):
+        source = self.makeSource(KEYFRAME_MINUTES)
+        self.collect(source, POLLS)
+        self.finish(source)
+        live = self.readOccupancy()
+        self.assertEqual(len(live[60]), LOCATIONS)
+        self.assertTrue(self.session.query(SFparkAvailabilityRecord).count() 
+                        < LOCATIONS * POLLS)
+        self.assertEqual(live, self.rebuild(KEYFRAME_MINUTES))
+
+    def testBuckets(self):
+        self.assertRaises(ValueError, OccupancyRollups, [7])
+        self.assertRaises(ValueError, OccupancyRollups, [0])
+
+
+if __name__ == '__main__':
+    unittest.main()
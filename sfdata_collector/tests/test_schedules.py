@@ -0,0 +1,124 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import json
+import datetime
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from SFparkDataModels import Base, SFparkRatesVersionRecord, SFparkOphrsVersionRecord
+from SFparkSource import SFparkSource
+from SFparkQueries import getScheduleOn
+from SFparkSchedules import migrateToVersions
+from sfpark_stubserver import SyntheticSFpark
+
+VERSION_MODELS = (SFparkRatesVersionRecord, SFparkOphrsVersionRecord)
+FIRST_DATE_ID = 20130601
+DAYS = 4
+
+
+class ScheduleVersionTest(unittest.TestCase):
+    """
+    Versioned schedules give the same schedule on each day as the daily
+    copies, while only storing the changes.
+    """
+
+    def collect(self, versioned):
+        """
+        Collects DAYS days, with the rates of one location changing on 
+        the second day, and another losing its schedule on the third.
+        """
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        source = SFparkSource(versioned=versioned)
+        source.initialize(session)
+
+        synthetic = SyntheticSFpark(20)
+        changed = synthetic.locations[3]
+        ended = synthetic.locations[5]
+        for day in range(DAYS):
+            if day == 1:
+                changed['RATES']['RS'][0]['RATE'] = '9.75'
+            if day == 2:
+                del ended['RATES']
+                del ended['OPHRS']
+            data = json.loads(json.dumps(synthetic.response()))
+            source.write(session, source.parseJson(data))
+            synthetic.advance(synthetic.updatedTime + datetime.timedelta(days=1))
+        return session
+
+    def readDaily(self, session, model, date_id):
+        columns = ['loc_id'] + list(model.scheduleColumns)
+        daily = model.dailyModel
+        return [tuple(row) for row in session.query(*[getattr(daily, c) for c in columns])
+                                             .filter(daily.date_id == date_id)
+                                             .order_by(daily.loc_id, daily.id)]
+
+    def readVersions(self, session, model, date_id):
+        return [tuple([getattr(record, c) for c in ['loc_id'] + list(model.scheduleColumns)])
+                for record in getScheduleOn(session, model, date_id)]
+
+    def testSameSchedules(self):
+        daily = self.collect(False)
+        versioned = self.collect(True)
+        for model in VERSION_MODELS:
+            for date_id in range(FIRST_DATE_ID, FIRST_DATE_ID + DAYS):
+                expected = self.readDaily(daily, model, date_id)
+                self.assertTrue(len(expected) > 0)
+                self.assertEqual(self.readVersions(versioned, model, date_id), expected)
+
+    def testOnlyChangesStored(self):
+        versioned = self.collect(True)
+        model = SFparkRatesVersionRecord
+        versions = versioned.query(model.loc_id, model.valid_from, model.valid_to) \
+                          .distinct().all()
+        # a version for each location, plus the changed one's second
+        self.assertEqual(len(versions), 21)
+        self.assertTrue((100003, FIRST_DATE_ID, FIRST_DATE_ID + 1) in versions)
+        self.assertTrue((100003, FIRST_DATE_ID + 1, None) in versions)
+        self.assertTrue((100005, FIRST_DATE_ID, FIRST_DATE_ID + 2) in versions)
+
+    def testRestart(self):
+        versioned = self.collect(True)
+        source = SFparkSource(versioned=True)
+        source.initialize(versioned)
+        for model in VERSION_MODELS:
+            self.assertEqual(len(source.versions[model].current), 19)
+
+    def testMigrate(self):
+        daily = self.collect(False)
+        versioned = self.collect(True)
+        for model in VERSION_MODELS:
+            migrateToVersions(daily, model)
+            columns = ['loc_id', 'valid_from', 'valid_to', 'sched_hash'] + \
+                      list(model.scheduleColumns)
+            read = lambda session: sorted(session.query(*[getattr(model, c) 
+                                                          for c in columns]).all())
+            self.assertEqual(read(daily), read(versioned))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,219 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+
+from Backoff import Backoff
+from SFparkDataModels import Base, SFparkAvailabilityRecord
+from SFparkSource import SFparkSource
+from WriteSpool import WriteSpool
+from CollectorPipeline import SpoolDrainerThread
+from sfpark_stubserver import SyntheticSFpark
+
+LOCATIONS = 10
+POLLS = 10
+BATCH = 4
+
+
+class SpoolReplayTest(unittest.TestCase):
+    """
+    Responses left in the spool when the collector stops are written
+    at the next startup, once each.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        self.synthetic = SyntheticSFpark(LOCATIONS)
+        self.failures = 0
+
+    def tearDown(self):
+        self.session.close()
+        shutil.rmtree(self.directory)
+
+    def makeSource(self):
+        source = SFparkSource()
+        source.initialize(self.session)
+        return source
+
+    def spoolPolls(self, spool, source, polls):
+        for i in range(polls):
+            data = json.loads(json.dumps(self.synthetic.response()))
+            spool.append(source.name, source.parseJson(data))
+            self.synthetic.advance()
+
+    def writeItems(self, item):
+        source, responses = item
+        if self.failures > 0:
+            self.failures -= 1
+            raise IOError("The database is down")
+        try:
+            source.writeBatch(self.session, responses)
+        except Exception:
+            self.session.rollback()
+            raise
+
+    def drain(self, spool, source):
+        drainer = SpoolDrainerThread('drain-test', [source], spool, self.writeItems,
+                                     BATCH, Backoff(0.001, 0.01))
+        return drainer.drain()
+
+    def countByTime(self):
+        avl = SFparkAvailabilityRecord
+        return dict(self.session.query(avl.availability_updated_timestamp, func.count(avl.id))
+                                .group_by(avl.availability_updated_timestamp))
+
+    def listSegments(self):
+        return [name for name in os.listdir(self.directory) if name.endswith('.spool')]
+
+    def checkWritten(self, polls):
+        counts = self.countByTime()
+        self.assertEqual(len(counts), polls)
+        self.assertEqual(set(counts.values()), set([LOCATIONS]))
+
+    def testReplay(self):
+        source = self.makeSource()
+        spool = WriteSpool(self.directory)
+        self.spoolPolls(spool, source, POLLS)
+        spool.close()
+
+        spool = WriteSpool(self.directory)
+        source = self.makeSource()
+        self.assertEqual(spool.pending(source.name), POLLS)
+        self.assertTrue(self.drain(spool, source))
+        self.checkWritten(POLLS)
+        self.assertEqual(spool.pending(source.name), 0)
+        self.assertEqual(self.listSegments(), [])
+
+    def testPartlyCommitted(self):
+        # the batches committed before the stop aren't written again
+        source = self.makeSource()
+        spool = WriteSpool(self.directory)
+        self.spoolPolls(spool, source, POLLS)
+        items, position = spool.read(source.name, BATCH)
+        source.writeBatch(self.session, items)
+        spool.commit(source.name, position)
+        spool.close()
+
+        spool = WriteSpool(self.directory)
+        source = self.makeSource()
+        self.assertEqual(spool.pending(source.name), POLLS - BATCH)
+        self.assertTrue(self.drain(spool, source))
+        self.checkWritten(POLLS)
+
+    def testCommittedNotRecorded(self):
+        # the collector stopped after a batch was committed, but before
+        # the spool recorded it
+        source = self.makeSource()
+        spool = WriteSpool(self.directory)
+        self.spoolPolls(spool, source, POLLS)
+        items, position = spool.read(source.name, BATCH)
+        source.writeBatch(self.session, items)
+        spool.close()
+
+        spool = WriteSpool(self.directory)
+        source = self.makeSource()
+        self.assertEqual(spool.pending(source.name), POLLS)
+        self.assertTrue(self.drain(spool, source))
+        self.checkWritten(POLLS)
+        self.assertEqual(spool.pending(source.name), 0)
+
+    def testFailedWrite(self):
+        # a batch that fails stays in the spool, to be tried again
+        source = self.makeSource()
+        spool = WriteSpool(self.directory)
+        self.spoolPolls(spool, source, POLLS)
+        self.failures = 1
+        self.assertFalse(self.drain(spool, source))
+        self.assertEqual(spool.pending(source.name), POLLS)
+        self.assertEqual(self.countByTime(), {})
+
+        self.assertTrue(self.drain(spool, source))
+        self.checkWritten(POLLS)
+        spool.close()
+
+    def testOtherSources(self):
+        # a source whose writes fail doesn't hold up the others
+        broken = self.makeSource()
+        broken.name = 'broken'
+        source = self.makeSource()
+        spool = WriteSpool(self.directory)
+        self.spoolPolls(spool, broken, 2)
+        self.spoolPolls(spool, source, POLLS)
+
+        def writeItems(item):
+            if item[0] is broken:
+                raise IOError("Can't write %s" % broken.name)
+            self.writeItems(item)
+        drainer = SpoolDrainerThread('drain-test', [broken, source], spool, writeItems,
+                                     BATCH, Backoff(0.001, 0.01))
+        self.assertFalse(drainer.drain())
+        self.assertEqual(spool.pending(broken.name), 2)
+        self.assertEqual(spool.pending(source.name), 0)
+        self.checkWritten(POLLS)
+        spool.close()
+
+    def testDuplicate(self):
+        # the same response spooled again is skipped
+        source = self.makeSource()
+        spool = WriteSpool(self.directory)
+        data = json.loads(json.dumps(self.synthetic.response()))
+        spool.append(source.name, source.parseJson(data))
+        spool.append(source.name, source.parseJson(data))
+        self.synthetic.advance()
+        self.spoolPolls(spool, source, 1)
+        self.assertTrue(self.drain(spool, source))
+        self.checkWritten(2)
+        spool.close()
+
+    def testTornFrame(self):
+        # a frame cut short by a crash is left out, and the rest replayed
+        source = self.makeSource()
+        spool = WriteSpool(self.directory)
+        self.spoolPolls(spool, source, POLLS)
+        spool.close()
+        path = os.path.join(self.directory, self.listSegments()[0])
+        f = open(path, 'r+b')
+        try:
+            f.truncate(os.path.getsize(path) - 10)
+        finally:
+            f.close()
+
+        spool = WriteSpool(self.directory)
+        source = self.makeSource()
+        self.assertEqual(spool.pending(source.name), POLLS - 1)
+        self.assertTrue(self.drain(spool, source))
+        self.checkWritten(POLLS - 1)
+        spool.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import json
+import datetime
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, select, text, func
+from sqlalchemy.orm import sessionmaker
+
+from SFparkDataModels import Base, SFparkStringRecord
+from SFparkSource import SFparkSource
+from SFparkStrings import (StringCodes, createDecodedViews, getDecodedView,
+                           migrateToCodes, CODED_MODELS)
+from sfpark_stubserver import SyntheticSFpark
+
+LOCATIONS = 10
+
+
+class StringCodesTest(unittest.TestCase):
+    """
+    Rates and operating hours stored with their strings as codes read
+    back the same as those stored in full.
+    """
+
+    def collect(self, codedStrings, source=None, session=None):
+        """
+        Writes two days of synthetic responses, with a string on the
+        second day not seen on the first, and returns the session.
+        """
+        if session is None:
+            self.engine = create_engine('sqlite://')
+            Base.metadata.create_all(self.engine)
+            session = sessionmaker(bind=self.engine)()
+        if source is None:
+            source = SFparkSource(codedStrings=codedStrings)
+            source.initialize(session)
+        synthetic = SyntheticSFpark(LOCATIONS)
+        for day in range(2):
+            if day == 1:
+                synthetic.advance(synthetic.updatedTime + datetime.timedelta(days=1))
+                synthetic.locations[0]['RATES']['RS'][0]['RQ'] = 'Per visit'
+            for i in range(3):
+                data = json.loads(json.dumps(synthetic.response()))
+                source.write(session, source.parseJson(data))
+                synthetic.advance()
+        return session
+
+    def readDaily(self, session, model, table=None):
+        columns = [column.name for column in model.dailyModel.__table__.columns
+                   if column.name != 'id']
+        return sorted(session.execute(text("SELECT %s FROM %s" % (
+            ', '.join(columns), table or model.dailyModel.__tablename__))).fetchall())
+
+    def readDecoded(self, session, model):
+        createDecodedViews(self.engine)
+        return self.readDaily(session, model, getDecodedView(model))
+
+    def countStrings(self, session):
+        table = SFparkStringRecord.__table__
+        return (session.execute(select([func.count()]).select_from(table)).scalar(),
+                session.execute(select([func.count(table.c.value.distinct())])).scalar())
+
+    def testSameRows(self):
+        plain = self.collect(False)
+        coded = self.collect(True)
+        for model in CODED_MODELS:
+            rows = self.readDaily(plain, model)
+            self.assertTrue(len(rows) > 0)
+            self.assertEqual(self.readDecoded(coded, model), rows)
+            self.assertEqual(self.readDaily(coded, model), [])
+
+        # each string is stored once
+        numStrings, numDistinct = self.countStrings(coded)
+        self.assertEqual(numStrings, numDistinct)
+        self.assertTrue(u'Per visit' in [value for (value,) in 
+                                         coded.query(SFparkStringRecord.value)])
+
+    def testRestart(self):
+        # a restarted source uses the codes already stored
+        session = self.collect(True)
+        before = self.countStrings(session)
+        source = SFparkSource(codedStrings=True)
+        source.initialize(session)
+        self.assertEqual(len(source.strings), before[0])
+        self.collect(True, source, session)
+        self.assertEqual(self.countStrings(session), before)
+
+    def testRolledBack(self):
+        # codes added in a transaction that was rolled back are forgotten
+        # once the codes are loaded again
+        session = self.collect(True)
+        codes = StringCodes()
+        codes.load(session)
+        codes.getCode(session, 'Per fortnight')
+        session.rollback()
+        codes.load(session)
+        self.assertFalse('Per fortnight' in codes.codes)
+        codes.getCode(session, 'Per fortnight')
+        session.commit()
+        numStrings, numDistinct = self.countStrings(session)
+        self.assertEqual(numStrings, numDistinct)
+
+    def testMigrate(self):
+        session = self.collect(False)
+        codes = StringCodes()
+        for model in CODED_MODELS:
+            numRows = migrateToCodes(session, model, codes)
+            self.assertEqual(numRows, len(self.readDaily(session, model)))
+        session.commit()
+        for model in CODED_MODELS:
+            self.assertEqual(self.readDecoded(session, model), self.readDaily(session, model))
+            self.assertRaises(ValueError, migrateToCodes, session, model, codes)
+
+        # a source carrying on with codes uses those migrated
+        numStrings = self.countStrings(session)
+        source = SFparkSource(codedStrings=True)
+        source.initialize(session)
+        self.assertEqual(len(source.strings), numStrings[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import json
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from SFparkDataModels import (Base, SFparkLocationRecord, SFparkAvailabilityRecord,
+                              SFparkRatesRecord, SFparkOphrsRecord)
+from SFparkSource import SFparkSource, parseTiles, mergeTileJson
+from SFparkResponse import getLocationId
+from sfpark_stubserver import SyntheticSFpark, getArea
+
+LOCATIONS = 40
+POLLS = 4
+
+# two circles that overlap in the middle, and between them cover every
+# location SyntheticSFpark makes
+CIRCLES = '37.755,-122.4625,5;37.755,-122.3875,5'
+
+
+class Response(object):
+    def __init__(self, content):
+        self.content = content
+
+
+class TileFetcher(object):
+    """
+    Stands in for an HttpFetcher, answering each request from a
+    SyntheticSFpark, limited to the area in its parameters, and saying
+    nothing has changed when the body is the same as last time.
+    """
+
+    def __init__(self, synthetic):
+        self.synthetic = synthetic
+        self.bodies = {}
+
+    def get(self, url, params=None):
+        query = dict((key, [value]) for key, value in params.iteritems())
+        body = json.dumps(self.synthetic.response(params['PRICING'] == 'yes',
+                                                  getArea(query)))
+        key = tuple(sorted(params.items()))
+        if self.bodies.get(key) == body:
+            return None
+        self.bodies[key] = body
+        return Response(body)
+
+
+class TileTest(unittest.TestCase):
+    """
+    A poll split into tiles stores the same as a single request for the
+    whole city.
+    """
+
+    def collect(self, tiles):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        source = SFparkSource(tiles=tiles)
+        source.initialize(session)
+        synthetic = SyntheticSFpark(LOCATIONS, changeFraction=0.3)
+        fetcher = TileFetcher(synthetic)
+        for i in range(POLLS):
+            response = source.parse(source.fetch(fetcher))
+            source.write(session, response)
+
+            # nothing has changed until the next refresh
+            self.assertEqual(source.fetch(fetcher), None)
+            synthetic.advance()
+        return session
+
+    def readRows(self, session):
+        avl = SFparkAvailabilityRecord
+        return {'locations'    : sorted(session.query(SFparkLocationRecord.id,
+                                                      SFparkLocationRecord.name)),
+                'availability' : sorted(session.query(avl.loc_id,
+                                                      avl.availability_updated_timestamp,
+                                                      avl.occ, avl.oper)),
+                'rates'        : session.query(SFparkRatesRecord).count(),
+                'ophrs'        : session.query(SFparkOphrsRecord).count()}
+
+    def testTypes(self):
+        whole = self.readRows(self.collect(None))
+        self.assertEqual(len(whole['availability']), LOCATIONS * POLLS)
+        self.assertEqual(self.readRows(self.collect(parseTiles('on;off'))), whole)
+
+    def testOverlap(self):
+        # a location in both circles is stored once
+        whole = self.readRows(self.collect(None))
+        self.assertEqual(self.readRows(self.collect(parseTiles(CIRCLES))), whole)
+
+    def testMixedTiles(self):
+        # the server refreshed between the requests for the two tiles
+        synthetic = SyntheticSFpark(LOCATIONS)
+        tiles = parseTiles('on;off')
+        source = SFparkSource(tiles=tiles)
+        before = json.dumps(synthetic.response(True, getArea({'TYPE' : ['on']})))
+        synthetic.advance()
+        after = [json.dumps(synthetic.response(True, getArea({'TYPE' : [tile['TYPE']]})))
+                 for tile in tiles]
+
+        self.assertTrue(source.parseTile(0, before))
+        self.assertTrue(source.parseTile(1, after[1]))
+        self.assertEqual(source.mergeTiles(), None)
+        self.assertEqual(source.stats['mixedTiles'], 1)
+
+        # the next poll has the tile that changed since
+        self.assertTrue(source.parseTile(0, after[0]))
+        response = source.mergeTiles()
+        self.assertEqual(response.updated_time, synthetic.updatedTime)
+        self.assertEqual(len(response.loc_ids), LOCATIONS)
+
+        # and then, with nothing new, there's nothing to store
+        self.assertEqual(source.mergeTiles(), None)
+        self.assertEqual(source.stats['skippedUnchanged'], 1)
+
+    def testMergeJson(self):
+        synthetic = SyntheticSFpark(LOCATIONS)
+        tiles = [synthetic.response(True, getArea({'LAT' : [tile['LAT']],
+                                                   'LONG' : [tile['LONG']],
+                                                   'RADIUS' : [tile['RADIUS']]}))
+                 for tile in parseTiles(CIRCLES)]
+        self.assertTrue(len(tiles[0]['AVL']) + len(tiles[1]['AVL']) > LOCATIONS)
+        merged = mergeTileJson(tiles)
+        self.assertEqual(sorted([getLocationId(avl) for avl in merged['AVL']]),
+                         sorted([getLocationId(avl) for avl in synthetic.response()['AVL']]))
+        self.assertEqual(merged['NUM_RECORDS'], str(LOCATIONS))
+
+    def testParseTiles(self):
+        self.assertEqual(parseTiles('37.7946,-122.4017,1; ON'),
+                         [{'LAT' : '37.794600', 'LONG' : '-122.401700', 'RADIUS' : '1.000'},
+                          {'TYPE' : 'on'}])
+        for string in ('37.7946,-122.4017', 'north', '37.7946,west,1', ''):
+            self.assertRaises(ValueError, parseTiles, string)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+__author__      = "Gregory D. Erhardt"
+__copyright__   = "Copyright 2013 SFCTA"
+__license__     = """
+    This file is part of sfdata_collector.
+
+    sfdata_collector is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    sfdata_collector is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with sfdata_collector.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import time
+import json
+import datetime
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from SFparkSource import SFparkSource
+from SFparkResponse import (SFparkResponse, getPacificOffset, getDateId,
+                            PACIFIC_STANDARD, PACIFIC_DAYLIGHT)
+from CollectorMetrics import CollectorMetrics
+from sfpark_stubserver import SyntheticSFpark, formatTimestamp
+
+# time zones for the computer the collector runs on, as POSIX TZ strings,
+# so they don't depend on the zone files being installed
+ZONES = ('UTC0', 'JST-9', 'HST10', 'PST8PDT,M3.2.0,M11.1.0')
+
+
+def pacificTime(unixTime):
+    """
+    Returns the naive San Francisco time of *unixTime*.
+    """
+    utc = datetime.datetime.utcfromtimestamp(unixTime)
+    local = utc + getPacificOffset(utc - datetime.timedelta(hours=8))
+    return local.replace(microsecond=0)
+
+
+class TimeZoneTestCase(unittest.TestCase):
+    """
+    Runs each test with the computer's time zone set by setZone().
+    """
+
+    def setUp(self):
+        self.oldZone = os.environ.get('TZ')
+
+    def tearDown(self):
+        if self.oldZone is None:
+            os.environ.pop('TZ', None)
+        else:
+            os.environ['TZ'] = self.oldZone
+        time.tzset()
+
+    def setZone(self, zone):
+        os.environ['TZ'] = zone
+        time.tzset()
+
+    def makeResponse(self, updatedTime, numLocations=10):
+        """
+        Returns the raw json of a response as of the naive San Francisco
+        time *updatedTime*.
+        """
+        return json.dumps(SyntheticSFpark(numLocations, startTime=updatedTime).response())
+
+
+class DataTimeTest(TimeZoneTestCase):
+
+    def testUnixTimeFromOffset(self):
+        for zone in ZONES:
+            self.setZone(zone)
+            source = SFparkSource()
+            data = {'STATUS' : 'SUCCESS', 'AVL' : [],
+                    'AVAILABILITY_UPDATED_TIMESTAMP' : '2013-06-12T14:23:01.123-07:00'}
+            response = source.parseJson(data)
+            self.assertEqual(response.updated_time, datetime.datetime(2013, 6, 12, 14, 23, 1))
+            self.assertEqual(source.getDataUnixTime(response), 1371072181.0)
+
+    def testUnixTimeWithoutOffset(self):
+        for zone in ZONES:
+            self.setZone(zone)
+            winter = SFparkResponse(datetime.datetime(2013, 1, 5, 3, 0, 0))
+            summer = SFparkResponse(datetime.datetime(2013, 6, 12, 14, 23, 1))
+            self.assertEqual(winter.getUnixTime(), 1357383600.0)
+            self.assertEqual(summer.getUnixTime(), 1371072181.0)
+
+    def testDaylightChanges(self):
+        self.assertEqual(getPacificOffset(datetime.datetime(2013, 3, 10, 1, 59)), PACIFIC_STANDARD)
+        self.assertEqual(getPacificOffset(datetime.datetime(2013, 3, 10, 2, 0)), PACIFIC_DAYLIGHT)
+        self.assertEqual(getPacificOffset(datetime.datetime(2013, 11, 3, 1, 59)), PACIFIC_DAYLIGHT)
+        self.assertEqual(getPacificOffset(datetime.datetime(2013, 11, 3, 2, 0)), PACIFIC_STANDARD)
+        self.assertEqual(formatTimestamp(datetime.datetime(2013, 6, 1)),
+                         '2013-06-01T00:00:00.000-07:00')
+
+    def testMergeKeepsOffset(self):
+        source = SFparkSource()
+        response = source.parseContent(self.makeResponse(datetime.datetime(2013, 6, 1, 12)))
+        merged = SFparkResponse.merge([response, response])
+        self.assertEqual(merged.getUnixTime(), response.getUnixTime())
+        self.assertEqual(len(merged), len(response))
+
+    def testFreshnessLag(self):
+        for zone in ZONES:
+            self.setZone(zone)
+            source = SFparkSource()
+            now = time.time()
+            response = source.parseContent(self.makeResponse(pacificTime(now - 30)))
+
+            metrics = CollectorMetrics()
+            metrics.recordWrite(source, 0.1, {}, {}, source.getDataUnixTime(response))
+            lag = metrics.freshnessLag.values[(source.name,)][-1]
+            self.assertTrue(29 <= lag < 40, "%s lag of %.1f seconds" % (zone, lag))
+
+    def testPricingDay(self):
+        # pricing is asked for on San Francisco's day, whatever the zone
+        for zone in ZONES:
+            self.setZone(zone)
+            source = SFparkSource()
+            fetcher = ParamsFetcher()
+            source.lastPricedDate = getDateId(pacificTime(time.time()))
+            source.fetch(fetcher)
+            self.assertEqual(fetcher.params['PRICING'], 'no', zone)
+            self.assertFalse(source.pricingRequested)
+
+            source.lastPricedDate = getDateId(pacificTime(time.time() - 86400))
+            source.fetch(fetcher)
+            self.assertEqual(fetcher.params['PRICING'], 'yes', zone)
+
+
+class ParamsFetcher(object):
+    """
+    Stands in for an HttpFetcher, keeping the parameters of the last
+    request, and saying nothing has changed.
+    """
+
+    def __init__(self):
+        self.params = None
+
+    def get(self, url, params=None):
+        self.params = params
+        return None
+
+
+if __name__ == '__main__':
+    unittest.main()